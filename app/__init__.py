@@ -4,12 +4,10 @@ from flask_migrate import Migrate
 from flask_apscheduler import APScheduler
 from flask_login import LoginManager
 import os
-import plaid
-from plaid.api import plaid_api
 import logging
-import json
-from datetime import datetime, timedelta
 from markupsafe import Markup
+from app import database, rendering
+from app.plaid_gateway import PlaidGateway
 db = SQLAlchemy()
 migrate = Migrate()
 scheduler = APScheduler()
@@ -17,20 +15,13 @@ scheduler = APScheduler()
 from app.models import (
     User, Role, Client, Account, JournalEntries, Document, ImportTemplate,
     Budget, FinancialPeriod, FixedAsset, Depreciation, Product, Inventory,
-    Sale, RecurringTransaction, PlaidItem, PlaidAccount, PendingPlaidLink,
+    Sale, RecurringTransaction, PlaidItem, PlaidAccount, PendingPlaidLink, PlaidBackfillWindow,
     Transaction, AuditTrail, TransactionRule, Vendor, Reconciliation,
-    Notification
+    Notification, JobRun, JobRunResult, RecurringCandidate, RecurringDetectionState,
+    JournalEntryBudgetMatch, DailySpending, SchedulerLock, ScheduledJobState
 )
 
-class CustomJSONEncoder(json.JSONEncoder):
-    def default(self, obj):
-        if isinstance(obj, datetime):
-            return obj.isoformat()
-        if isinstance(obj, timedelta):
-            return str(obj)
-        return super().default(self, obj)
-
-def create_app():
+def create_app(config=None):
     app = Flask(__name__)
 
     from app.routes.main import main_bp
@@ -49,8 +40,29 @@ def create_app():
     from app.routes.guides import guides_bp
 
     app.config['SECRET_KEY'] = 'your_secret_key'  # Change this in a real application
-    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + os.path.join(os.path.abspath(os.path.dirname(__file__)), '..', 'bookkeeping.db')
+    app.config['SQLALCHEMY_DATABASE_URI'] = database.database_url()
     app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    # Worker threads used by the per-client scheduled jobs (app/jobs.py)
+    app.config['JOB_MAX_WORKERS'] = int(os.environ.get('JOB_MAX_WORKERS', 4))
+    # Optional JSON-lines file for high-volume audit records (app/audit.py)
+    app.config['AUDIT_LOG_FILE'] = os.environ.get('AUDIT_LOG_FILE')
+    # Audit rows older than this are moved to gzipped monthly files (default: instance/audit_archive)
+    app.config['AUDIT_RETENTION_DAYS'] = int(os.environ.get('AUDIT_RETENTION_DAYS', 365))
+    app.config['AUDIT_ARCHIVE_DIR'] = os.environ.get('AUDIT_ARCHIVE_DIR')
+    # Notification delivery (app/notifications.py). Without an SMTP host or SMS gateway URL,
+    # email and SMS alerts are appended to NOTIFY_OUTBOX_DIR (default: instance/notification_outbox).
+    app.config['NOTIFY_SMTP_HOST'] = os.environ.get('NOTIFY_SMTP_HOST')
+    app.config['NOTIFY_SMTP_PORT'] = int(os.environ.get('NOTIFY_SMTP_PORT', 25))
+    app.config['NOTIFY_EMAIL_FROM'] = os.environ.get('NOTIFY_EMAIL_FROM', 'alerts@localhost')
+    app.config['NOTIFY_SMS_URL'] = os.environ.get('NOTIFY_SMS_URL')
+    app.config['NOTIFY_OUTBOX_DIR'] = os.environ.get('NOTIFY_OUTBOX_DIR')
+    # How long the notification bell may hold a request open waiting for new items (0 = plain polling).
+    # Only raise it with threaded or async workers, since each waiting request occupies one.
+    app.config['NOTIFICATION_LONG_POLL_SECONDS'] = int(os.environ.get('NOTIFICATION_LONG_POLL_SECONDS', 0))
+    # Server-sent events (app/events.py). Set EVENTS_FANOUT_DB to a SQLite file path when running
+    # several worker processes so events reach streams opened on any of them.
+    app.config['EVENTS_FANOUT_DB'] = os.environ.get('EVENTS_FANOUT_DB')
+    app.config['EVENT_STREAM_SECONDS'] = int(os.environ.get('EVENT_STREAM_SECONDS', 300))
 
     # Plaid client setup
     app.config['PLAID_CLIENT_ID'] = os.environ.get('PLAID_CLIENT_ID')
@@ -59,29 +71,49 @@ def create_app():
     app.config['PLAID_PRODUCTS'] = os.environ.get('PLAID_PRODUCTS', 'transactions').split(',')
     app.config['PLAID_COUNTRY_CODES'] = os.environ.get('PLAID_COUNTRY_CODES', 'US').split(',')
     app.config['PLAID_WEBHOOK_URL'] = os.environ.get('PLAID_WEBHOOK_URL')
-
-    if app.config['PLAID_ENV'] == 'sandbox':
-        host = plaid.Environment.Sandbox
-    elif app.config['PLAID_ENV'] == 'development':
-        host = plaid.Environment.Development
-    elif app.config['PLAID_ENV'] == 'production':
-        host = plaid.Environment.Production
-    else:
-        raise ValueError("Invalid PLAID_ENV")
-
-    configuration = plaid.Configuration(
-        host=host,
-        api_key={
-            'clientId': app.config['PLAID_CLIENT_ID'],
-            'secret': app.config['PLAID_SECRET'],
-        }
-    )
-
-    api_client = plaid.ApiClient(configuration)
-    app.plaid_client = plaid_api.PlaidApi(api_client)
+    # PLAID_ENV=local points the client at PLAID_HOST instead, e.g. benchmarks/fake_plaid.py.
+    app.config['PLAID_HOST'] = os.environ.get('PLAID_HOST', 'http://127.0.0.1:8765')
+    # Pooled keep-alive connections to Plaid, also the number of concurrent page fetches.
+    app.config['PLAID_POOL_SIZE'] = int(os.environ.get('PLAID_POOL_SIZE', 8))
+    # Per-item token bucket (app/plaid_gateway.py): sustained calls per second and burst size.
+    app.config['PLAID_RATE_PER_ITEM'] = float(os.environ.get('PLAID_RATE_PER_ITEM', 2))
+    app.config['PLAID_RATE_BURST'] = int(os.environ.get('PLAID_RATE_BURST', 10))
+    # Scheduled balance refresh (app/plaid_balances.py): how often it runs (0 = never), how recent a
+    # refresh must be for an item to be skipped, and how many items are fetched from Plaid at once.
+    app.config['PLAID_BALANCE_REFRESH_MINUTES'] = int(os.environ.get('PLAID_BALANCE_REFRESH_MINUTES', 60))
+    app.config['PLAID_BALANCE_MAX_AGE_MINUTES'] = int(os.environ.get('PLAID_BALANCE_MAX_AGE_MINUTES', 30))
+    app.config['PLAID_BALANCE_CONCURRENCY'] = int(os.environ.get('PLAID_BALANCE_CONCURRENCY', 4))
+    # Historical fetches (app/plaid_backfill.py) are split into date windows of this many days,
+    # this many of which are fetched at once.
+    app.config['PLAID_BACKFILL_WINDOW_DAYS'] = int(os.environ.get('PLAID_BACKFILL_WINDOW_DAYS', 90))
+    app.config['PLAID_BACKFILL_CONCURRENCY'] = int(os.environ.get('PLAID_BACKFILL_CONCURRENCY', 4))
+    # Rendering (app/rendering.py): compiled templates are cached in JINJA_BYTECODE_CACHE_DIR
+    # (default: instance/jinja_cache, empty to disable) and responses of at least
+    # COMPRESS_MIN_SIZE bytes are brotli/gzip compressed when the client accepts it.
+    app.config['JINJA_BYTECODE_CACHE_DIR'] = os.environ.get('JINJA_BYTECODE_CACHE_DIR', os.path.join(app.instance_path, 'jinja_cache'))
+    app.config['RESPONSE_COMPRESSION'] = os.environ.get('RESPONSE_COMPRESSION', '1') != '0'
+    app.config['COMPRESS_MIN_SIZE'] = int(os.environ.get('COMPRESS_MIN_SIZE', 500))
+    # Whether web processes run the scheduled jobs (app/scheduling.py). Any number of processes may:
+    # they elect a leader through the scheduler_lock table, and only the leader runs jobs. It holds
+    # the lease for SCHEDULER_LEASE_SECONDS between renewals, and on election catches up runs missed
+    # in the last SCHEDULER_CATCH_UP_DAYS days (0 to disable).
+    app.config['SCHEDULER_ENABLED'] = os.environ.get('SCHEDULER_ENABLED', '1') != '0'
+    app.config['SCHEDULER_LEASE_SECONDS'] = int(os.environ.get('SCHEDULER_LEASE_SECONDS', 60))
+    app.config['SCHEDULER_CATCH_UP_DAYS'] = int(os.environ.get('SCHEDULER_CATCH_UP_DAYS', 7))
+
+    # Overrides (tests, benchmarks) must be applied before the extensions
+    # below are initialised, since the database engine is created in init_app.
+    if config:
+        app.config.update(config)
+    database.configure_database(app)
+
+    app.plaid_client = PlaidGateway.from_config(app.config)
+    rendering.init_app(app)
 
     db.init_app(app)
     migrate.init_app(app, db)
+    with app.app_context():
+        database.register_engine_events(app, db.engine)
 
     login_manager = LoginManager()
     login_manager.init_app(app)
@@ -90,22 +122,8 @@ def create_app():
     def load_user(user_id):
         return models.User.query.get(int(user_id))
 
-    if not scheduler.running:
-        from app import tasks
-        scheduler.init_app(app)
-        scheduler.start()
-        scheduler.add_job(id='calculate_depreciation', func=tasks.calculate_and_record_depreciation, trigger='cron', day=1, hour=0)
-        scheduler.add_job(id='reverse_accruals', func=tasks.reverse_accruals, trigger='cron', day=1, hour=0)
-        scheduler.add_job(id='create_recurring_journal_entries', func=tasks.create_recurring_journal_entries, trigger='cron', day=1, hour=0)
-        scheduler.add_job(id='cleanup_pending_plaid_links', func=tasks.cleanup_pending_plaid_links, trigger='cron', day='*', hour=2)
-        scheduler.add_job(id='check_budgets', func=tasks.check_budgets, trigger='cron', day='*', hour=3)
-        scheduler.add_job(id='check_notification_rules', func=tasks.check_notification_rules, trigger='cron', day='*', hour=4)
-
-    app.json_encoder = CustomJSONEncoder
-
-    @app.template_filter('tojson')
-    def tojson_filter(obj):
-        return json.dumps(obj)
+    from app import scheduling
+    scheduling.init_app(app)
 
     @app.template_filter('nl2br')
     def nl2br(s):
@@ -132,6 +150,12 @@ def create_app():
     app.cli.add_command(commands.import_data_command)
     app.cli.add_command(commands.create_user)
     app.cli.add_command(commands.create_overall_budgets)
+    app.cli.add_command(commands.run_job)
+    app.cli.add_command(commands.sync_budget_matches)
+    app.cli.add_command(commands.rebuild_daily_spending)
+    app.cli.add_command(commands.plaid_backfill)
+    app.cli.add_command(rendering.compile_templates)
+    app.cli.add_command(scheduling.run_scheduler)
 
     with app.app_context():
         return app
\ No newline at end of file
@@ -0,0 +1,145 @@
+import threading
+
+from flask import current_app, g, has_request_context
+from sqlalchemy import event, update
+from sqlalchemy.orm import Session
+
+from app import db
+from app.models import Account, Client
+from app.request_cache import memoized
+
+_CHANGED_KEY = 'account_tree_changed_accounts'
+_MOVED_FROM_KEY = 'account_tree_moved_from_clients'
+
+# Account columns the cached tree holds; changing any of them invalidates it.
+TREE_COLUMNS = ('name', 'type', 'category', 'parent_id', 'opening_balance', 'client_id')
+
+_lock = threading.Lock()
+
+
+class AccountNode:
+    """The structural fields of one account; balances are not cached."""
+
+    __slots__ = ('id', 'name', 'type', 'category', 'parent_id', 'opening_balance', 'level', 'children')
+
+    def __init__(self, row):
+        self.id = row.id
+        self.name = row.name
+        self.type = row.type
+        self.category = row.category
+        self.parent_id = row.parent_id
+        self.opening_balance = row.opening_balance or 0
+        self.level = 0
+        self.children = []
+
+
+class AccountTree:
+    """A client's chart of accounts as an in-memory tree, built from one query.
+
+    Siblings are ordered by name. Trees are shared between requests, so they
+    hold plain AccountNodes rather than ORM objects and must not be modified.
+    """
+
+    def __init__(self, rows):
+        self.by_id = {row.id: AccountNode(row) for row in rows}
+        self.roots = []
+        for node in self.by_id.values():
+            parent = self.by_id.get(node.parent_id)
+            if parent is not None and node.parent_id != node.id:
+                parent.children.append(node)
+            else:
+                self.roots.append(node)
+
+        self._ordered = []
+        self._descendants = {}
+        for root in self.roots:
+            self._walk(root, 0)
+
+    def _walk(self, node, level):
+        node.level = level
+        self._ordered.append(node)
+        descendants = []
+        for child in node.children:
+            self._walk(child, level + 1)
+            descendants.append(child.id)
+            descendants.extend(self._descendants[child.id])
+        self._descendants[node.id] = descendants
+
+    def get(self, account_id):
+        return self.by_id.get(account_id)
+
+    def children(self, account_id):
+        node = self.by_id.get(account_id)
+        return node.children if node else []
+
+    def descendant_ids(self, account_id):
+        return self._descendants.get(account_id, [])
+
+    def ordered(self):
+        """Every account depth-first, each parent followed by its sub-accounts."""
+        return self._ordered
+
+    def choices(self):
+        """(id, name, level) for account select boxes, in tree order."""
+        return [(node.id, node.name, node.level) for node in self._ordered]
+
+
+def load_account_tree(client_id):
+    """The client's AccountTree.
+
+    Trees are cached per process and keyed by Client.account_tree_version,
+    which the flush hooks below bump whenever one of the client's accounts is
+    added, edited or deleted, so a cached tree costs one primary-key lookup
+    per request and is rebuilt with a single query when it is out of date.
+    """
+    def compute():
+        version = db.session.query(Client.account_tree_version).filter(Client.id == client_id).scalar() or 0
+        cache = current_app.extensions.setdefault('account_trees', {})
+        with _lock:
+            cached = cache.get(client_id)
+        if cached is not None and cached[0] == version:
+            return cached[1]
+        rows = db.session.query(
+            Account.id, Account.name, Account.type, Account.category, Account.parent_id, Account.opening_balance
+        ).filter(Account.client_id == client_id).order_by(Account.name, Account.id).all()
+        tree = AccountTree(rows)
+        with _lock:
+            cache[client_id] = (version, tree)
+        return tree
+    return memoized('account_tree', client_id, compute)
+
+
+@event.listens_for(Session, 'before_flush')
+def _track_account_changes(session, flush_context, instances):
+    # Accounts are kept rather than their client ids, which may only be assigned by the flush.
+    changed = session.info.setdefault(_CHANGED_KEY, set())
+    for obj in session.new | session.deleted:
+        if isinstance(obj, Account):
+            changed.add(obj)
+    for obj in session.dirty:
+        if isinstance(obj, Account):
+            state = db.inspect(obj)
+            if any(state.attrs[name].history.has_changes() for name in TREE_COLUMNS):
+                changed.add(obj)
+                session.info.setdefault(_MOVED_FROM_KEY, set()).update(state.attrs.client_id.history.deleted)
+
+
+@event.listens_for(Session, 'after_flush_postexec')
+def _refresh_changed_trees(session, flush_context):
+    client_ids = {obj.client_id for obj in session.info.pop(_CHANGED_KEY, ())}
+    client_ids.update(session.info.pop(_MOVED_FROM_KEY, ()))
+    client_ids.discard(None)
+    if not client_ids:
+        return
+    session.connection().execute(
+        update(Client.__table__).where(Client.id.in_(client_ids))
+        .values(account_tree_version=Client.__table__.c.account_tree_version + 1)
+    )
+    if has_request_context():
+        g.pop('account_tree', None)
+
+
+@event.listens_for(Session, 'after_soft_rollback')
+def _discard_account_changes(session, previous_transaction):
+    session.info.pop(_CHANGED_KEY, None)
+    session.info.pop(_MOVED_FROM_KEY, None)
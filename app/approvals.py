@@ -0,0 +1,63 @@
+from sqlalchemy import insert, update
+
+from app import db
+from app.models import Transaction, JournalEntries
+
+# Keeps IN-lists under SQLite's bound-parameter limit.
+ID_CHUNK_SIZE = 500
+
+
+def _chunks(ids, size=ID_CHUNK_SIZE):
+    for i in range(0, len(ids), size):
+        yield ids[i:i + size]
+
+
+def bulk_approve_transactions(client_id, account_assignments):
+    """Approves unapproved transactions in bulk.
+
+    `account_assignments` maps transaction id -> (debit_account_id, credit_account_id).
+    Transactions are loaded a chunk at a time, their journal entries are
+    written with one bulk insert per chunk and is_approved is flipped with
+    one UPDATE per chunk. Ids that belong to another client or are already
+    approved are ignored. The caller commits. Returns the approved
+    (id, description) pairs.
+    """
+    ids = sorted(account_assignments)
+    approved = []
+    for chunk in _chunks(ids):
+        rows = db.session.query(
+            Transaction.id, Transaction.date, Transaction.description, Transaction.amount, Transaction.category
+        ).filter(
+            Transaction.id.in_(chunk),
+            Transaction.client_id == client_id,
+            Transaction.is_approved == False
+        ).all()
+        if not rows:
+            continue
+
+        journal_rows = []
+        for transaction_id, transaction_date, description, amount, category in rows:
+            debit_account_id, credit_account_id = account_assignments[transaction_id]
+            journal_rows.append({
+                'date': transaction_date,
+                'description': description,
+                'debit_account_id': debit_account_id,
+                'credit_account_id': credit_account_id,
+                'amount': abs(amount),
+                'category': category,
+                'transaction_id': transaction_id,
+                'client_id': client_id,
+                'locked': False,
+                'is_accrual': False,
+                'is_reversing': False,
+                'status': 'posted',
+            })
+            approved.append((transaction_id, description))
+        db.session.execute(insert(JournalEntries), journal_rows)
+        db.session.execute(
+            update(Transaction)
+            .where(Transaction.id.in_([row[0] for row in rows]))
+            .values(is_approved=True)
+            .execution_options(synchronize_session=False)
+        )
+    return approved
@@ -0,0 +1,217 @@
+import gzip
+import json
+import os
+from datetime import datetime, timedelta
+
+from flask import current_app, has_app_context
+from sqlalchemy import event, insert, delete
+from sqlalchemy.orm import Session
+
+from app import db
+from app.background import BackgroundWorker
+from app.models import AuditTrail, User
+
+_BUFFER_KEY = 'audit_buffer'
+
+PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+ARCHIVE_BATCH_SIZE = 5000
+
+
+def record(action, details=None, user_id=None, client_id=None, high_volume=False):
+    """Queues an audit record on the current session.
+
+    Nothing is written until the caller commits: the records are inserted in
+    one batch as part of that commit, and discarded if it rolls back, so the
+    audit trail always matches what was actually saved. With high_volume=True
+    the record goes to the asynchronous file sink instead (AUDIT_LOG_FILE),
+    after the commit succeeds; without a configured file it is stored like
+    any other record.
+    """
+    entry = {
+        'date': datetime.utcnow(),
+        'user_id': user_id,
+        'client_id': client_id,
+        'action': action[:255],
+        'details': details,
+    }
+    sink = 'file' if high_volume and has_app_context() and current_app.config.get('AUDIT_LOG_FILE') else 'db'
+    if sink == 'file':
+        entry['path'] = current_app.config['AUDIT_LOG_FILE']
+    db.session.info.setdefault(_BUFFER_KEY, []).append((sink, entry))
+
+
+@event.listens_for(Session, 'before_commit')
+def _write_buffered_records(session):
+    buffered = session.info.get(_BUFFER_KEY)
+    if not buffered:
+        return
+    rows = [entry for sink, entry in buffered if sink == 'db']
+    if rows:
+        session.execute(insert(AuditTrail), rows)
+    session.info[_BUFFER_KEY] = [(sink, entry) for sink, entry in buffered if sink != 'db']
+
+
+@event.listens_for(Session, 'after_commit')
+def _send_file_records(session):
+    buffered = session.info.pop(_BUFFER_KEY, None)
+    for sink, entry in buffered or []:
+        _file_sink.put(entry)
+
+
+@event.listens_for(Session, 'after_soft_rollback')
+def _discard_buffered_records(session, previous_transaction):
+    session.info.pop(_BUFFER_KEY, None)
+
+
+def _write_file_record(entry):
+    path = entry.pop('path')
+    entry['date'] = entry['date'].isoformat()
+    with open(path, 'a') as f:
+        f.write(json.dumps(entry) + '\n')
+
+
+# Appends high-volume audit records as JSON lines, so callers never wait on disk.
+_file_sink = BackgroundWorker('audit-file-sink', _write_file_record)
+
+
+def flush_file_sink():
+    _file_sink.flush()
+
+
+def encode_cursor(entry):
+    return f"{entry['date'].isoformat()}~{entry['id']}"
+
+
+def decode_cursor(cursor):
+    """(date, id) from a cursor string, or None if it is missing or malformed."""
+    try:
+        date_part, id_part = cursor.rsplit('~', 1)
+        return datetime.fromisoformat(date_part), int(id_part)
+    except (AttributeError, ValueError):
+        return None
+
+
+def _day_bounds(start, end):
+    """Datetime bounds for an inclusive start/end date range."""
+    return (datetime.combine(start, datetime.min.time()) if start else None,
+            datetime.combine(end + timedelta(days=1), datetime.min.time()) if end else None)
+
+
+def query_page(client_id, cursor=None, start=None, end=None, action=None, limit=PAGE_SIZE):
+    """One page of a client's audit trail, newest first.
+
+    Keyset-paginated on (date, id) through the (client_id, date, id) index,
+    so every page costs the same however far back it is. `action` matches
+    the start of the action text, which uses the (client_id, action, date)
+    index. Returns (entries, next_cursor); next_cursor is None on the last page.
+    """
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    query = db.session.query(
+        AuditTrail.id, AuditTrail.date, AuditTrail.action, AuditTrail.details, User.username
+    ).outerjoin(User, AuditTrail.user_id == User.id).filter(AuditTrail.client_id == client_id)
+    start_at, end_before = _day_bounds(start, end)
+    if start_at:
+        query = query.filter(AuditTrail.date >= start_at)
+    if end_before:
+        query = query.filter(AuditTrail.date < end_before)
+    if action:
+        query = query.filter(AuditTrail.action.startswith(action, autoescape=True))
+    position = decode_cursor(cursor)
+    if position:
+        query = query.filter(db.tuple_(AuditTrail.date, AuditTrail.id) < position)
+    rows = query.order_by(AuditTrail.date.desc(), AuditTrail.id.desc()).limit(limit + 1).all()
+
+    entries = [{'id': r.id, 'date': r.date, 'user': r.username, 'action': r.action, 'details': r.details}
+               for r in rows[:limit]]
+    return entries, encode_cursor(entries[-1]) if len(rows) > limit else None
+
+
+def archive_dir(client_id):
+    root = current_app.config.get('AUDIT_ARCHIVE_DIR') or os.path.join(current_app.instance_path, 'audit_archive')
+    return os.path.join(root, str(client_id))
+
+
+def _read_archive(path):
+    with gzip.open(path, 'rt') as f:
+        for line in f:
+            entry = json.loads(line)
+            entry['date'] = datetime.fromisoformat(entry['date'])
+            yield entry
+
+
+def _write_archive_month(path, entries):
+    """Merges entries into a month file; rewritten atomically and keyed by id, so a retried run can't duplicate rows."""
+    merged = {e['id']: e for e in _read_archive(path)} if os.path.exists(path) else {}
+    merged.update((e['id'], e) for e in entries)
+    tmp_path = path + '.tmp'
+    with gzip.open(tmp_path, 'wt') as f:
+        for entry in sorted(merged.values(), key=lambda e: (e['date'], e['id'])):
+            f.write(json.dumps(dict(entry, date=entry['date'].isoformat())) + '\n')
+    os.replace(tmp_path, path)
+
+
+def archive_client_audit_trail(client_id, run_date):
+    """Moves audit rows older than AUDIT_RETENTION_DAYS into gzipped monthly JSON-lines files.
+
+    Files live in AUDIT_ARCHIVE_DIR/<client_id>/<YYYY-MM>.jsonl.gz and are
+    searched on demand by search_archive. Archived rows are deleted from
+    audit_trail; the caller commits. Returns the number of rows archived.
+    """
+    cutoff = datetime.combine(run_date - timedelta(days=current_app.config.get('AUDIT_RETENTION_DAYS', 365)),
+                              datetime.min.time())
+    directory = archive_dir(client_id)
+    archived = 0
+    last_id = 0
+    while True:
+        rows = db.session.query(
+            AuditTrail.id, AuditTrail.date, AuditTrail.user_id, User.username, AuditTrail.action, AuditTrail.details
+        ).outerjoin(User, AuditTrail.user_id == User.id).filter(
+            AuditTrail.client_id == client_id,
+            AuditTrail.date < cutoff,
+            AuditTrail.id > last_id
+        ).order_by(AuditTrail.id).limit(ARCHIVE_BATCH_SIZE).all()
+        if not rows:
+            break
+        by_month = {}
+        for r in rows:
+            by_month.setdefault(r.date.strftime('%Y-%m'), []).append({
+                'id': r.id, 'date': r.date, 'user_id': r.user_id, 'user': r.username,
+                'action': r.action, 'details': r.details,
+            })
+        os.makedirs(directory, exist_ok=True)
+        for month, entries in by_month.items():
+            _write_archive_month(os.path.join(directory, f'{month}.jsonl.gz'), entries)
+        ids = [r.id for r in rows]
+        db.session.execute(delete(AuditTrail).where(AuditTrail.id.in_(ids)).execution_options(synchronize_session=False))
+        archived += len(ids)
+        last_id = ids[-1]
+    return archived
+
+
+def search_archive(client_id, cursor=None, start=None, end=None, action=None, limit=PAGE_SIZE):
+    """Same as query_page, but over the archive files. Only the months inside start/end are opened."""
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    directory = archive_dir(client_id)
+    if not os.path.isdir(directory):
+        return [], None
+    start_at, end_before = _day_bounds(start, end)
+    months = sorted((name[:7] for name in os.listdir(directory) if name.endswith('.jsonl.gz')), reverse=True)
+    if start_at:
+        months = [m for m in months if m >= start_at.strftime('%Y-%m')]
+    if end_before:
+        months = [m for m in months if m <= end_before.strftime('%Y-%m')]
+    position = decode_cursor(cursor)
+
+    entries = []
+    for month in months:
+        matches = [e for e in _read_archive(os.path.join(directory, f'{month}.jsonl.gz'))
+                   if (not start_at or e['date'] >= start_at)
+                   and (not end_before or e['date'] < end_before)
+                   and (not action or e['action'].startswith(action))
+                   and (not position or (e['date'], e['id']) < position)]
+        entries.extend(sorted(matches, key=lambda e: (e['date'], e['id']), reverse=True))
+        if len(entries) > limit:
+            break
+    page = [{k: e[k] for k in ('id', 'date', 'user', 'action', 'details')} for e in entries[:limit]]
+    return page, encode_cursor(page[-1]) if len(entries) > limit else None
@@ -0,0 +1,50 @@
+import atexit
+import logging
+import queue
+import threading
+
+
+class BackgroundWorker:
+    """Hands queued items to handle(item) on a daemon thread, so callers never wait on slow I/O.
+
+    The thread starts with the first item and is restarted if it died. Items
+    are handled in order; an item whose handler raises is logged and dropped.
+    """
+
+    def __init__(self, name, handle):
+        self.name = name
+        self._handle = handle
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+        atexit.register(self.close)
+
+    def put(self, item):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+                self._thread.start()
+        self._queue.put(item)
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                self._queue.task_done()
+                return
+            try:
+                self._handle(item)
+            except Exception:
+                logging.exception(f'{self.name} failed to handle a queued item')
+            finally:
+                self._queue.task_done()
+
+    def flush(self):
+        """Blocks until every queued item has been handled."""
+        if self._thread is not None and self._thread.is_alive():
+            self._queue.join()
+
+    def close(self):
+        if self._thread is not None and self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join(timeout=5)
@@ -0,0 +1,341 @@
+from sqlalchemy import event, insert, delete, update, select, literal
+from sqlalchemy.orm import Session
+
+from app import db
+from app.bulk_writes import CHUNK_SIZE, bulk_writes
+from app.models import Budget, JournalEntries, JournalEntryBudgetMatch, Account, Category, budget_categories
+from app.money import Money, to_cents, from_cents
+from app.request_cache import memoized
+
+_PENDING_KEY = 'budget_matches_pending'
+_BUDGETS_KEY = 'budget_matches_budgets'
+_DELETED_BUDGETS_KEY = 'budget_matches_deleted_budgets'
+_CATEGORIES_KEY = 'budget_matches_categories'
+
+# JournalEntries columns a budget matches on; changing any of them re-matches the entry.
+MATCHED_COLUMNS = ('description', 'category', 'client_id')
+
+
+def budget_keywords(budget):
+    return {k.strip() for k in budget.keywords.split(',')} if budget.keywords else set()
+
+
+def _match_condition(budget, category_names):
+    """SQL condition selecting the journal entries a budget covers, or None if it covers nothing."""
+    if budget.is_miscellaneous:
+        return None
+    conditions = []
+    if category_names:
+        conditions.append(JournalEntries.category.in_(category_names))
+    conditions.extend(JournalEntries.description.ilike(f'%{keyword}%') for keyword in budget_keywords(budget))
+    return db.or_(*conditions) if conditions else None
+
+
+def _category_names(connection, budget_ids):
+    names = {budget_id: set() for budget_id in budget_ids}
+    rows = connection.execute(
+        select(budget_categories.c.budget_id, Category.name)
+        .join(Category, Category.id == budget_categories.c.category_id)
+        .where(budget_categories.c.budget_id.in_(budget_ids))
+    )
+    for budget_id, name in rows:
+        names[budget_id].add(name)
+    return names
+
+
+def _insert_matches(connection, budget, category_names, *entry_filters):
+    condition = _match_condition(budget, category_names)
+    if condition is None:
+        return
+    connection.execute(insert(JournalEntryBudgetMatch.__table__).from_select(
+        ['journal_entry_id', 'budget_id'],
+        select(JournalEntries.id, literal(budget.id)).where(
+            JournalEntries.client_id == budget.client_id, condition, *entry_filters
+        )
+    ))
+
+
+def rematch_budgets(connection, budgets):
+    """Rebuilds the match rows of the given budgets against all of their client's entries."""
+    if not budgets:
+        return
+    category_names = _category_names(connection, [b.id for b in budgets])
+    connection.execute(delete(JournalEntryBudgetMatch.__table__).where(
+        JournalEntryBudgetMatch.budget_id.in_([b.id for b in budgets])))
+    for budget in budgets:
+        _insert_matches(connection, budget, category_names[budget.id])
+
+
+def sync_budget_matches(client_id=None, connection=None):
+    """Matches journal entries added or edited since the last sync (budget_matched = False).
+
+    Works entirely in SQL: one INSERT ... SELECT per budget of each affected
+    client, restricted to the pending entries. Runs automatically before any
+    commit that touched journal entries or renamed a category; entries
+    written by other means are picked up by the daily check_budgets job or
+    `flask sync-budget-matches`. Reads never call it: they only read the
+    stored matches. Returns the number of entries matched.
+    """
+    connection = connection or db.session.connection()
+    pending = select(JournalEntries.client_id, db.func.max(JournalEntries.id)).where(
+        JournalEntries.budget_matched == False
+    ).group_by(JournalEntries.client_id)
+    if client_id is not None:
+        pending = pending.where(JournalEntries.client_id == client_id)
+
+    synced = 0
+    for pending_client_id, max_id in connection.execute(pending).all():
+        # Bounded by the highest id seen, so entries inserted meanwhile stay pending.
+        entry_filters = (JournalEntries.budget_matched == False, JournalEntries.id <= max_id)
+        pending_ids = select(JournalEntries.id).where(JournalEntries.client_id == pending_client_id, *entry_filters)
+        connection.execute(delete(JournalEntryBudgetMatch.__table__).where(
+            JournalEntryBudgetMatch.journal_entry_id.in_(pending_ids)))
+        budgets = connection.execute(select(Budget.id, Budget.client_id, Budget.keywords, Budget.is_miscellaneous).where(
+            Budget.client_id == pending_client_id)).all()
+        category_names = _category_names(connection, [b.id for b in budgets])
+        for budget in budgets:
+            _insert_matches(connection, budget, category_names[budget.id], *entry_filters)
+        synced += connection.execute(update(JournalEntries.__table__).where(
+            JournalEntries.client_id == pending_client_id, *entry_filters
+        ).values(budget_matched=True)).rowcount
+    return synced
+
+
+def covered_by_budget():
+    """True for journal entries matched by at least one (non-miscellaneous) budget; correlate against JournalEntries."""
+    return select(JournalEntryBudgetMatch.journal_entry_id).where(
+        JournalEntryBudgetMatch.journal_entry_id == JournalEntries.id
+    ).exists()
+
+
+def matched_by_budgets(budget_ids):
+    """True for journal entries matched by any of the given budgets; correlate against JournalEntries."""
+    return select(JournalEntryBudgetMatch.journal_entry_id).where(
+        JournalEntryBudgetMatch.journal_entry_id == JournalEntries.id,
+        JournalEntryBudgetMatch.budget_id.in_(budget_ids)
+    ).exists()
+
+
+def expense_entries(client_id, start_date, end_date, *columns):
+    """Query over the client's expense entries (debited to an Expense account) dated within the window."""
+    return db.session.query(*columns).select_from(JournalEntries).join(
+        Account, JournalEntries.debit_account_id == Account.id
+    ).filter(
+        Account.type == 'Expense',
+        JournalEntries.client_id == client_id,
+        JournalEntries.date >= start_date,
+        JournalEntries.date <= end_date
+    )
+
+
+
+def matched_entries(client_id, budget_ids, start_date, end_date, *columns):
+    """Expense entries in the window matched by any budget in budget_ids, each entry once.
+
+    budget_ids may be a list or a select of budget ids. The set stays in the
+    database (an EXISTS against journal_entry_budget_match), so statement
+    size doesn't grow with the number of entries.
+    """
+    return expense_entries(client_id, start_date, end_date, *columns).filter(matched_by_budgets(budget_ids))
+
+
+def uncovered_entries(client_id, start_date, end_date, *columns):
+    """Expense entries in the window that no budget matches: what a miscellaneous budget covers."""
+    return expense_entries(client_id, start_date, end_date, *columns).filter(~covered_by_budget())
+
+
+def spent_by_budget(client_id, budget_ids, start_date, end_date):
+    """{budget_id: expense total matched by that budget in the window}, in one grouped query."""
+    rows = expense_entries(client_id, start_date, end_date, JournalEntryBudgetMatch.budget_id, db.func.sum(JournalEntries.amount)).join(
+        JournalEntryBudgetMatch, JournalEntryBudgetMatch.journal_entry_id == JournalEntries.id
+    ).filter(JournalEntryBudgetMatch.budget_id.in_(budget_ids)).group_by(JournalEntryBudgetMatch.budget_id)
+    return dict(rows.all())
+
+
+def spent_shared_with_parent(client_id, budget_ids, start_date, end_date):
+    """{budget_id: expense total matched by both the budget and its parent}, in one grouped query."""
+    parent_match = db.aliased(JournalEntryBudgetMatch)
+    rows = expense_entries(client_id, start_date, end_date, JournalEntryBudgetMatch.budget_id, db.func.sum(JournalEntries.amount)).join(
+        JournalEntryBudgetMatch, JournalEntryBudgetMatch.journal_entry_id == JournalEntries.id
+    ).join(Budget, Budget.id == JournalEntryBudgetMatch.budget_id).join(
+        parent_match, db.and_(parent_match.journal_entry_id == JournalEntries.id, parent_match.budget_id == Budget.parent_id)
+    ).filter(JournalEntryBudgetMatch.budget_id.in_(budget_ids)).group_by(JournalEntryBudgetMatch.budget_id)
+    return dict(rows.all())
+
+
+def miscellaneous_spending(client_id, start_date, end_date):
+    """A client's expenses in the window split into covered by a budget and not (miscellaneous).
+
+    Returns {'total', 'covered', 'uncovered', 'uncovered_by_day'}, from one
+    query grouped by day, so the dashboard, the budget analysis page and the
+    miscellaneous history can share a single result per request.
+    """
+    def compute():
+        covered_amount = db.case((covered_by_budget(), JournalEntries.amount), else_=0)
+        rows = expense_entries(
+            client_id, start_date, end_date, JournalEntries.date,
+            db.func.sum(JournalEntries.amount), db.func.sum(covered_amount, type_=Money())
+        ).group_by(JournalEntries.date).all()
+        # Summed in cents so the derived figures carry no float noise.
+        uncovered_by_day = {day: to_cents(day_total) - to_cents(day_covered) for day, day_total, day_covered in rows}
+        total = sum(to_cents(row[1]) for row in rows)
+        uncovered = sum(uncovered_by_day.values())
+        return {
+            'total': from_cents(total),
+            'covered': from_cents(total - uncovered),
+            'uncovered': from_cents(uncovered),
+            'uncovered_by_day': {day: from_cents(cents) for day, cents in uncovered_by_day.items()},
+        }
+    return memoized('miscellaneous_spending', (client_id, start_date, end_date), compute)
+
+
+def miscellaneous_breakdown(client_id, start_date, end_date):
+    """(category, total) for the window's uncovered expenses, largest first; memoized per request."""
+    def compute():
+        total = db.func.sum(JournalEntries.amount)
+        return uncovered_entries(client_id, start_date, end_date, JournalEntries.category, total.label('total')).filter(
+            JournalEntries.category != None,
+            JournalEntries.category != ''
+        ).group_by(JournalEntries.category).order_by(total.desc()).all()
+    return memoized('miscellaneous_breakdown', (client_id, start_date, end_date), compute)
+
+
+class BudgetTree:
+    """A client's budgets as an in-memory tree, so routes never walk parent/children lazily.
+
+    Built from two queries (budgets, then their category names). Levels,
+    descendant lists and rolled-up totals are computed once up front.
+    """
+
+    def __init__(self, budgets, category_names):
+        self.budgets = budgets
+        self.by_id = {b.id: b for b in budgets}
+        self._categories = category_names
+        self._children = {b.id: [] for b in budgets}
+        self.roots = []
+        for budget in budgets:
+            if budget.parent_id in self._children:
+                self._children[budget.parent_id].append(budget)
+            else:
+                self.roots.append(budget)
+
+        self._level = {}
+        self._descendants = {}
+        self._total = {}
+        for root in self.roots:
+            self._walk(root, 0)
+
+    def _walk(self, budget, level):
+        self._level[budget.id] = level
+        descendants = []
+        total = budget.amount or 0
+        for child in self._children[budget.id]:
+            self._walk(child, level + 1)
+            descendants.append(child)
+            descendants.extend(self._descendants[child.id])
+            total += self._total[child.id]
+        self._descendants[budget.id] = descendants
+        self._total[budget.id] = total
+
+    def get(self, budget_id):
+        return self.by_id.get(budget_id)
+
+    def children(self, budget_id):
+        return self._children.get(budget_id, [])
+
+    def descendants(self, budget_id):
+        return self._descendants.get(budget_id, [])
+
+    def level(self, budget_id):
+        return self._level.get(budget_id, 0)
+
+    def total_budgeted(self, budget_id):
+        """The budget's amount plus all of its descendants' (Budget.total_budgeted without the queries)."""
+        return self._total.get(budget_id, 0)
+
+    def categories(self, budget_id):
+        return self._categories.get(budget_id, [])
+
+
+def load_budget_tree(client_id):
+    """The client's BudgetTree, ordered by name; memoized per request."""
+    def compute():
+        budgets = Budget.query.filter_by(client_id=client_id).order_by(Budget.name).all()
+        category_names = {}
+        rows = db.session.query(budget_categories.c.budget_id, Category.name).join(
+            Category, Category.id == budget_categories.c.category_id
+        ).filter(Category.client_id == client_id).order_by(Category.name)
+        for budget_id, name in rows:
+            category_names.setdefault(budget_id, []).append(name)
+        return BudgetTree(budgets, category_names)
+    return memoized('budget_tree', client_id, compute)
+
+@event.listens_for(Session, 'before_flush')
+def _track_changes(session, flush_context, instances):
+    budgets = session.info.setdefault(_BUDGETS_KEY, set())
+    for obj in session.new:
+        if isinstance(obj, JournalEntries):
+            session.info[_PENDING_KEY] = True
+        elif isinstance(obj, Budget):
+            budgets.add(obj)
+    for obj in session.dirty:
+        if isinstance(obj, JournalEntries):
+            state = db.inspect(obj)
+            if any(state.attrs[name].history.has_changes() for name in MATCHED_COLUMNS):
+                obj.budget_matched = False
+                session.info[_PENDING_KEY] = True
+        elif isinstance(obj, Budget) and session.is_modified(obj):
+            budgets.add(obj)
+    deleted = session.info.setdefault(_DELETED_BUDGETS_KEY, set())
+    deleted.update(obj.id for obj in session.deleted if isinstance(obj, Budget))
+    # Budgets match categories by name, so entries filed under a renamed or deleted
+    # category's old or new name are re-matched.
+    categories = session.info.setdefault(_CATEGORIES_KEY, set())
+    for obj in session.dirty:
+        if isinstance(obj, Category):
+            history = db.inspect(obj).attrs.name.history
+            if history.has_changes():
+                categories.update((obj.client_id, name) for name in (*history.added, *history.deleted))
+    categories.update((obj.client_id, obj.name) for obj in session.deleted if isinstance(obj, Category))
+
+
+@event.listens_for(Session, 'after_flush_postexec')
+def _rematch_changed_budgets(session, flush_context):
+    budgets = session.info.pop(_BUDGETS_KEY, None)
+    deleted = session.info.pop(_DELETED_BUDGETS_KEY, None)
+    categories = session.info.pop(_CATEGORIES_KEY, None)
+    for client_id, name in categories or ():
+        session.connection().execute(update(JournalEntries.__table__).where(
+            JournalEntries.client_id == client_id, JournalEntries.category == name
+        ).values(budget_matched=False))
+        session.info[_PENDING_KEY] = True
+    if deleted:
+        session.connection().execute(delete(JournalEntryBudgetMatch.__table__).where(
+            JournalEntryBudgetMatch.budget_id.in_(deleted)))
+    if budgets:
+        rematch_budgets(session.connection(), [b for b in budgets if db.inspect(b).persistent])
+
+
+@event.listens_for(Session, 'before_commit')
+def _sync_pending_entries(session):
+    # Flush first: edits still waiting in the session are only noticed by _track_changes.
+    session.flush()
+    # Bulk writes skip _track_changes: inserted entries are unmatched already, updated ones are marked here.
+    writes = bulk_writes(session)
+    rematch = [entry_id for write in writes if write.kind == 'update' and write.columns & set(MATCHED_COLUMNS)
+               for _, _, entry_id in write.rows]
+    for i in range(0, len(rematch), CHUNK_SIZE):
+        session.connection().execute(update(JournalEntries.__table__).where(
+            JournalEntries.id.in_(rematch[i:i + CHUNK_SIZE])).values(budget_matched=False))
+    if rematch or any(write.kind == 'insert' for write in writes):
+        session.info[_PENDING_KEY] = True
+    if session.info.pop(_PENDING_KEY, False):
+        sync_budget_matches(connection=session.connection())
+
+
+@event.listens_for(Session, 'after_soft_rollback')
+def _discard_pending(session, previous_transaction):
+    session.info.pop(_PENDING_KEY, None)
+    session.info.pop(_BUDGETS_KEY, None)
+    session.info.pop(_DELETED_BUDGETS_KEY, None)
+    session.info.pop(_CATEGORIES_KEY, None)
@@ -0,0 +1,90 @@
+import collections
+
+from sqlalchemy import event, select
+from sqlalchemy.orm import Session
+
+from app import db
+from app.models import JournalEntries
+
+_WRITES_KEY = 'journal_bulk_writes'
+CHUNK_SIZE = 500
+
+# kind is 'insert', 'update' or 'delete'; columns the names an update sets (None otherwise);
+# rows the (client_id, date, id) of each entry written, before and after an update that moves it.
+BulkWrite = collections.namedtuple('BulkWrite', 'kind columns rows')
+
+
+def bulk_writes(session):
+    """The session.execute() writes to journal_entries in the current transaction, oldest first.
+
+    Bulk inserts, query.update()/delete() and bulk updates by primary key
+    skip the flush hooks; the hooks that keep budget matches, daily spending
+    and change events in step read them from here before the commit.
+    """
+    return session.info.get(_WRITES_KEY, [])
+
+
+def _updated_columns(orm_execute_state):
+    """Names of the JournalEntries columns an ORM UPDATE sets."""
+    params = orm_execute_state.parameters
+    if isinstance(params, list):
+        return {name for row in params for name in row if name != 'id'}
+    statement = orm_execute_state.statement
+    values = statement._ordered_values or list((statement._values or {}).items())
+    return {getattr(column, 'key', column) for column, _ in values} | set(params or {})
+
+
+def _entry_rows(connection, *criteria):
+    return [tuple(row) for row in connection.execute(
+        select(JournalEntries.client_id, JournalEntries.date, JournalEntries.id).where(*criteria))]
+
+
+def _rows_by_id(connection, ids):
+    return [row for i in range(0, len(ids), CHUNK_SIZE)
+            for row in _entry_rows(connection, JournalEntries.id.in_(ids[i:i + CHUNK_SIZE]))]
+
+
+@event.listens_for(Session, 'do_orm_execute')
+def _collect_bulk_writes(orm_execute_state):
+    if orm_execute_state.bind_mapper is not db.inspect(JournalEntries):
+        return
+    session = orm_execute_state.session
+    params = orm_execute_state.parameters
+    if orm_execute_state.is_insert:
+        rows = [(row.get('client_id'), row.get('date'), row.get('id'))
+                for row in (params if isinstance(params, list) else [params or {}])]
+        session.info.setdefault(_WRITES_KEY, []).append(BulkWrite('insert', None, rows))
+        return
+    if not (orm_execute_state.is_update or orm_execute_state.is_delete):
+        return
+
+    # The rows are read before the statement, and after it too if it moves them to another client or day.
+    connection = session.connection()
+    if isinstance(params, list):
+        rows = _rows_by_id(connection, [row['id'] for row in params if 'id' in row])
+    else:
+        where = orm_execute_state.statement.whereclause
+        rows = _entry_rows(connection, *([where] if where is not None else []))
+    if not rows:
+        return
+    if orm_execute_state.is_delete:
+        session.info.setdefault(_WRITES_KEY, []).append(BulkWrite('delete', None, rows))
+        return
+    columns = _updated_columns(orm_execute_state)
+    if not columns & {'client_id', 'date'}:
+        session.info.setdefault(_WRITES_KEY, []).append(BulkWrite('update', columns, rows))
+        return
+    result = orm_execute_state.invoke_statement()
+    moved = _rows_by_id(connection, [entry_id for _, _, entry_id in rows])
+    session.info.setdefault(_WRITES_KEY, []).append(BulkWrite('update', columns, rows + moved))
+    return result
+
+
+@event.listens_for(Session, 'after_commit')
+def _discard_after_commit(session):
+    session.info.pop(_WRITES_KEY, None)
+
+
+@event.listens_for(Session, 'after_soft_rollback')
+def _discard_after_rollback(session, previous_transaction):
+    session.info.pop(_WRITES_KEY, None)
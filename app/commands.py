@@ -3,14 +3,9 @@ from flask.cli import with_appcontext
 import json
 from datetime import datetime, date, timedelta
 from app.models import PlaidItem, Client, Vendor, Account, Budget, TransactionRule, FixedAsset, Product, Inventory, Sale, RecurringTransaction, PlaidAccount, Transaction, JournalEntries, Role, User, Document, ImportTemplate, Depreciation, FinancialPeriod, AuditTrail
-from plaid.model.accounts_get_request import AccountsGetRequest
-from plaid.model.accounts_balance_get_request import AccountsBalanceGetRequest
-from plaid.model.transactions_get_request import TransactionsGetRequest
 from app import db
 from flask import current_app
 import os
-import pandas as pd
-import numpy as np
 
 from dateutil.relativedelta import relativedelta
 
@@ -54,6 +49,7 @@ def inspect_plaid():
 @with_appcontext
 def accounts(item_id):
     """Fetches and saves the /accounts/get response for a given PlaidItem ID."""
+    from plaid.model.accounts_get_request import AccountsGetRequest
     item = PlaidItem.query.get_or_404(item_id)
     try:
         accounts_request = AccountsGetRequest(access_token=item.access_token)
@@ -71,6 +67,7 @@ def accounts(item_id):
 @with_appcontext
 def balance(item_id):
     """Fetches and saves the /accounts/balance/get response for a given PlaidItem ID."""
+    from plaid.model.accounts_balance_get_request import AccountsBalanceGetRequest
     item = PlaidItem.query.get_or_404(item_id)
     try:
         balance_request = AccountsBalanceGetRequest(access_token=item.access_token)
@@ -90,6 +87,7 @@ def balance(item_id):
 @with_appcontext
 def transactions(item_id, start_date_str, end_date_str):
     """Fetches and saves the /transactions/get response for a given PlaidItem ID."""
+    from plaid.model.transactions_get_request import TransactionsGetRequest
     item = PlaidItem.query.get_or_404(item_id)
     start_date = datetime.strptime(start_date_str, '%Y-%m-%d').date()
     end_date = datetime.strptime(end_date_str, '%Y-%m-%d').date()
@@ -172,6 +170,7 @@ def create_user(username, password, client_id):
 @with_appcontext
 def import_data_command():
     """Imports all data from the data_export.xlsx file."""
+    import pandas as pd
     
     export_file = 'data_export/data_export.xlsx'
     if not os.path.exists(export_file):
@@ -313,4 +312,76 @@ def import_data_command():
 
     except Exception as e:
         print(f"An error occurred during import: {e}")
-        db.session.rollback()
\ No newline at end of file
+        db.session.rollback()
+
+
+@click.command('run-job')
+@click.argument('job_name')
+@click.option('--date', 'run_date', default=None, help='Run date (YYYY-MM-DD, or YYYY-MM-DDTHH:MM for hourly and '
+                                                    'more frequent jobs). Defaults to now.')
+@click.option('--client-id', 'client_ids', type=int, multiple=True, help='Limit the run to these clients.')
+@click.option('--workers', type=int, default=None, help='Worker threads (defaults to JOB_MAX_WORKERS).')
+@with_appcontext
+def run_job(job_name, run_date, client_ids, workers):
+    """Runs a per-client scheduled job now. Clients that already succeeded for the period are skipped."""
+    from app.tasks import CLIENT_JOBS
+    from app.jobs import run_client_job
+    if job_name not in CLIENT_JOBS:
+        print(f"Unknown job '{job_name}'. Available jobs: {', '.join(sorted(CLIENT_JOBS))}")
+        return
+    client_func, run_key_func = CLIENT_JOBS[job_name]
+    # The run key comes from the same function the schedule uses, so a manual run and a
+    # scheduled one for the same period skip each other's finished clients.
+    run_at = datetime.fromisoformat(run_date) if run_date else datetime.now()
+    job_run = run_client_job(job_name, client_func, run_date=run_at.date(), run_key=run_key_func(run_at),
+                             client_ids=list(client_ids) or None, max_workers=workers)
+    print(f"{job_name} ({job_run.run_key}): {job_run.status} - {job_run.clients_succeeded} succeeded, "
+          f"{job_run.clients_failed} failed, {job_run.clients_skipped} skipped, {job_run.items_processed} items.")
+
+
+@click.command('sync-budget-matches')
+@click.option('--rebuild', is_flag=True, help='Re-match every entry, not just the pending ones.')
+@with_appcontext
+def sync_budget_matches(rebuild):
+    """Matches journal entries against budget categories and keywords (journal_entry_budget_match)."""
+    from app import budgeting
+    if rebuild:
+        db.session.execute(db.update(JournalEntries).values(budget_matched=False))
+    synced = budgeting.sync_budget_matches()
+    db.session.commit()
+    print(f"Matched {synced} journal entries.")
+
+
+@click.command('rebuild-daily-spending')
+@click.option('--client-id', 'client_ids', type=int, multiple=True, help='Limit the rebuild to these clients.')
+@with_appcontext
+def rebuild_daily_spending(client_ids):
+    """Recomputes the daily_spending totals that notification rules are evaluated against."""
+    from app.notifications import refresh_daily_spending
+    client_ids = list(client_ids) or [client_id for client_id, in db.session.query(Client.id)]
+    for client_id in client_ids:
+        refresh_daily_spending(db.session.connection(), client_id)
+    db.session.commit()
+    print(f"Rebuilt daily spending for {len(client_ids)} clients.")
+
+
+@click.command('plaid-backfill')
+@click.argument('item_id', type=int)
+@click.argument('start_date')
+@click.argument('end_date')
+@click.option('--account', 'account_ids', multiple=True, help="Limit to these Plaid account ids.")
+@with_appcontext
+def plaid_backfill(item_id, start_date, end_date, account_ids):
+    """Fetches a PlaidItem's transactions between two dates (YYYY-MM-DD), resuming an interrupted run."""
+    from app import plaid_backfill as backfill
+    from app.utils import update_all_balances
+    item = db.session.get(PlaidItem, item_id)
+    if not item:
+        print(f"PlaidItem {item_id} not found.")
+        return
+    start = datetime.strptime(start_date, '%Y-%m-%d').date()
+    end = datetime.strptime(end_date, '%Y-%m-%d').date()
+    added = backfill.backfill(item, start, end, account_ids=list(account_ids) or None,
+                              on_progress=lambda fetched, total: print(f"\r{fetched}/{total} transactions", end=''))
+    update_all_balances(item.client_id)
+    print(f"\nAdded {added} transactions for item {item_id}.")
@@ -0,0 +1,78 @@
+import os
+import sqlite3
+
+from sqlalchemy import event
+
+
+DEFAULT_SQLITE_PATH = os.path.join(os.path.abspath(os.path.dirname(__file__)), '..', 'bookkeeping.db')
+
+# Applied on every new SQLite connection. WAL lets report queries read while an
+# import or scheduled job is writing; busy_timeout makes writers wait for the
+# lock instead of failing immediately with "database is locked". SQLite ignores
+# foreign keys, including their ON DELETE CASCADE, unless they are switched on.
+SQLITE_PRAGMAS = {
+    'foreign_keys': 'ON',
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': 5000,          # ms
+    'mmap_size': 268435456,        # 256 MiB
+    'cache_size': -65536,          # negative = KiB, i.e. 64 MiB per connection
+    'temp_store': 'MEMORY',
+}
+
+
+def _env_int(name, default):
+    value = os.environ.get(name)
+    return int(value) if value not in (None, '') else default
+
+
+def database_url():
+    """Returns DATABASE_URL from the environment, falling back to the local SQLite file."""
+    url = os.environ.get('DATABASE_URL')
+    if not url:
+        return 'sqlite:///' + DEFAULT_SQLITE_PATH
+    # Heroku-style URLs use the scheme SQLAlchemy dropped in 1.4.
+    if url.startswith('postgres://'):
+        url = 'postgresql://' + url[len('postgres://'):]
+    return url
+
+
+def configure_database(app):
+    """Fills in engine options for the configured database.
+
+    Must run after all config overrides and before db.init_app(), since
+    Flask-SQLAlchemy creates the engine there.
+    """
+    uri = app.config['SQLALCHEMY_DATABASE_URI']
+    options = app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', {})
+
+    if uri.startswith('sqlite'):
+        pragmas = dict(SQLITE_PRAGMAS)
+        pragmas['busy_timeout'] = _env_int('SQLITE_BUSY_TIMEOUT_MS', pragmas['busy_timeout'])
+        pragmas.update(app.config.get('SQLITE_PRAGMAS', {}))
+        app.config['SQLITE_PRAGMAS'] = pragmas
+        connect_args = options.setdefault('connect_args', {})
+        # The driver-level timeout (seconds) should not undercut the pragma.
+        connect_args.setdefault('timeout', pragmas['busy_timeout'] / 1000.0)
+    else:
+        options.setdefault('pool_size', _env_int('DB_POOL_SIZE', 5))
+        options.setdefault('max_overflow', _env_int('DB_MAX_OVERFLOW', 10))
+        options.setdefault('pool_timeout', _env_int('DB_POOL_TIMEOUT', 30))
+        options.setdefault('pool_recycle', _env_int('DB_POOL_RECYCLE', 1800))
+        options.setdefault('pool_pre_ping', True)
+
+
+def register_engine_events(app, engine):
+    """Attaches the SQLite pragma hook to the engine created by db.init_app()."""
+    if engine.dialect.name != 'sqlite':
+        return
+    pragmas = app.config['SQLITE_PRAGMAS']
+
+    @event.listens_for(engine, 'connect')
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        if not isinstance(dbapi_connection, sqlite3.Connection):
+            return
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f'PRAGMA {name}={value}')
+        cursor.close()
@@ -0,0 +1,145 @@
+from datetime import date
+from functools import lru_cache
+
+from dateutil.relativedelta import relativedelta
+from sqlalchemy import insert
+
+from app import db
+from app.models import FixedAsset, Depreciation, Account, JournalEntries
+from app.money import to_cents, from_cents
+
+# Declining-balance methods and their rate multiplier over straight-line.
+DECLINING_BALANCE_FACTORS = {
+    'declining-balance': 2.0,
+    'double-declining-balance': 2.0,
+}
+
+DEPRECIATION_METHODS = [
+    ('straight-line', 'Straight-line'),
+    ('declining-balance', 'Declining balance (double)'),
+]
+
+
+@lru_cache(maxsize=4096)
+def _schedule(purchase_date, cost_cents, salvage_cents, useful_life, method):
+    """Monthly schedule as a tuple of (period_date, amount_cents).
+
+    Pure function of the asset's depreciation inputs, so it is cached and
+    shared by the posting job and the schedule view. Periods are dated the
+    first of each month after the purchase month; amounts are whole cents
+    and always total exactly cost - salvage.
+    """
+    months = useful_life * 12
+    depreciable = max(cost_cents - salvage_cents, 0)
+    if months <= 0 or depreciable == 0:
+        return ()
+    first_period = purchase_date.replace(day=1) + relativedelta(months=1)
+
+    amounts = []
+    factor = DECLINING_BALANCE_FACTORS.get(method)
+    if factor:
+        rate = factor / months
+        book = cost_cents
+        for i in range(months):
+            remaining_months = months - i
+            declining = round(book * rate)
+            # Switch to straight-line once it gives the larger charge.
+            straight = round((book - salvage_cents) / remaining_months)
+            amount = min(max(declining, straight), book - salvage_cents)
+            amounts.append(amount)
+            book -= amount
+    else:
+        base, remainder = divmod(depreciable, months)
+        amounts = [base] * months
+        amounts[-1] += remainder
+    # Absorb rounding so the schedule always ends exactly at salvage value.
+    amounts[-1] += depreciable - sum(amounts)
+
+    return tuple((first_period + relativedelta(months=i), amount) for i, amount in enumerate(amounts))
+
+
+def get_schedule(asset):
+    return _schedule(asset.purchase_date, to_cents(asset.purchase_price), to_cents(asset.salvage_value),
+                     asset.useful_life, asset.depreciation_method)
+
+
+def schedule_rows(asset, posted_months=frozenset()):
+    """Schedule in dollars with running totals, for display and export."""
+    rows = []
+    accumulated = 0
+    cost = to_cents(asset.purchase_price)
+    for period_date, amount in get_schedule(asset):
+        accumulated += amount
+        rows.append({
+            'date': period_date.strftime('%Y-%m-%d'),
+            'amount': from_cents(amount),
+            'accumulated_depreciation': from_cents(accumulated),
+            'book_value': from_cents(cost - accumulated),
+            'posted': (period_date.year, period_date.month) in posted_months,
+        })
+    return rows
+
+
+def posted_months(client_id, asset_ids=None):
+    """{asset_id: {(year, month), ...}} for everything already posted, in one query."""
+    query = db.session.query(Depreciation.fixed_asset_id, Depreciation.date).filter(Depreciation.client_id == client_id)
+    if asset_ids is not None:
+        query = query.filter(Depreciation.fixed_asset_id.in_(asset_ids))
+    posted = {}
+    for asset_id, posted_date in query:
+        posted.setdefault(asset_id, set()).add((posted_date.year, posted_date.month))
+    return posted
+
+
+def post_depreciation(client_id, through_date=None):
+    """Posts every due, not-yet-posted month for all of a client's assets.
+
+    Missed months are caught up, back to the asset's depreciation_from
+    if it has one. Depreciation and journal rows are written
+    with two bulk inserts; the caller commits. Returns the number of
+    periods posted.
+    """
+    through_date = through_date or date.today()
+    assets = FixedAsset.query.filter_by(client_id=client_id).all()
+    if not assets:
+        return 0
+    expense_account = Account.query.filter_by(type='Expense', category='Depreciation', client_id=client_id).first()
+    accumulated_account = Account.query.filter_by(type='Accumulated Depreciation', client_id=client_id).first()
+    already_posted = posted_months(client_id)
+
+    depreciation_rows = []
+    journal_rows = []
+    for asset in assets:
+        done = already_posted.get(asset.id, set())
+        for period_date, amount in get_schedule(asset):
+            if period_date > through_date:
+                break
+            if (period_date.year, period_date.month) in done or amount == 0:
+                continue
+            if asset.depreciation_from and period_date < asset.depreciation_from:
+                continue
+            depreciation_rows.append({
+                'fixed_asset_id': asset.id,
+                'date': period_date,
+                'amount': from_cents(amount),
+                'client_id': client_id,
+            })
+            if expense_account and accumulated_account:
+                journal_rows.append({
+                    'date': period_date,
+                    'description': f"Depreciation for {asset.name}",
+                    'debit_account_id': expense_account.id,
+                    'credit_account_id': accumulated_account.id,
+                    'amount': from_cents(amount),
+                    'client_id': client_id,
+                    'locked': False,
+                    'is_accrual': False,
+                    'is_reversing': False,
+                    'status': 'posted',
+                })
+
+    if depreciation_rows:
+        db.session.execute(insert(Depreciation), depreciation_rows)
+    if journal_rows:
+        db.session.execute(insert(JournalEntries), journal_rows)
+    return len(depreciation_rows)
@@ -0,0 +1,223 @@
+import collections
+import json
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+from flask import current_app, has_app_context
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from app import db
+from app.bulk_writes import bulk_writes
+from app.models import Account, JournalEntries, Transaction
+
+_PENDING_KEY = 'events_pending'
+
+# Events kept per client for clients reconnecting with Last-Event-ID (in-process broker).
+REPLAY_SIZE = 200
+# Seconds between keep-alive comments on an idle stream; proxies drop silent connections.
+KEEPALIVE_SECONDS = 15
+# How often a waiting stream re-reads the fan-out database for events from other processes.
+FANOUT_POLL_SECONDS = 1
+# Fan-out rows older than this are deleted as new events are written.
+FANOUT_RETENTION_SECONDS = 3600
+
+
+class EventBroker:
+    """In-process publish/subscribe of per-client events, for a single worker process.
+
+    Events get increasing ids; subscribers ask for everything after the last
+    id they saw and block until something newer arrives or they time out.
+    """
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._next_id = 1
+        self._events = collections.defaultdict(lambda: collections.deque(maxlen=REPLAY_SIZE))
+
+    def publish(self, client_id, event_type, data):
+        with self._condition:
+            event_id = self._next_id
+            self._next_id += 1
+            self._events[client_id].append((event_id, event_type, data))
+            self._condition.notify_all()
+        return event_id
+
+    def _after(self, client_id, last_id):
+        return [e for e in self._events.get(client_id, ()) if e[0] > last_id]
+
+    def latest_id(self):
+        with self._condition:
+            return self._next_id - 1
+
+    def listen(self, client_id, last_id, timeout):
+        """(id, type, data) events for the client after last_id, waiting up to timeout seconds for one."""
+        with self._condition:
+            self._condition.wait_for(lambda: self._after(client_id, last_id), timeout)
+            return self._after(client_id, last_id)
+
+
+class SqliteEventBroker(EventBroker):
+    """Fans events out between worker processes through a small SQLite file (EVENTS_FANOUT_DB).
+
+    Every process appends to and reads from the same table; waiting
+    subscribers are woken at once for events from their own process and
+    within FANOUT_POLL_SECONDS for events from the others.
+    """
+
+    def __init__(self, path):
+        super().__init__()
+        self.path = path
+        with self._connect() as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('CREATE TABLE IF NOT EXISTS events (id INTEGER PRIMARY KEY AUTOINCREMENT, '
+                         'client_id INTEGER NOT NULL, type TEXT NOT NULL, data TEXT NOT NULL, created REAL NOT NULL)')
+            conn.execute('CREATE INDEX IF NOT EXISTS ix_events_client_id_id ON events (client_id, id)')
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=5)
+
+    def publish(self, client_id, event_type, data):
+        now = time.time()
+        with self._connect() as conn:
+            event_id = conn.execute('INSERT INTO events (client_id, type, data, created) VALUES (?, ?, ?, ?)',
+                                    (client_id, event_type, json.dumps(data, default=str), now)).lastrowid
+            conn.execute('DELETE FROM events WHERE created < ?', (now - FANOUT_RETENTION_SECONDS,))
+        with self._condition:
+            self._condition.notify_all()
+        return event_id
+
+    def _read(self, client_id, last_id):
+        with self._connect() as conn:
+            rows = conn.execute('SELECT id, type, data FROM events WHERE client_id = ? AND id > ? ORDER BY id LIMIT ?',
+                                (client_id, last_id, REPLAY_SIZE)).fetchall()
+        return [(event_id, event_type, json.loads(data)) for event_id, event_type, data in rows]
+
+    def latest_id(self):
+        with self._connect() as conn:
+            return conn.execute('SELECT COALESCE(MAX(id), 0) FROM events').fetchone()[0]
+
+    def listen(self, client_id, last_id, timeout):
+        deadline = time.monotonic() + timeout
+        while True:
+            events = self._read(client_id, last_id)
+            remaining = deadline - time.monotonic()
+            if events or remaining <= 0:
+                return events
+            with self._condition:
+                self._condition.wait(min(remaining, FANOUT_POLL_SECONDS))
+
+
+def get_broker(app=None):
+    app = app or current_app
+    broker = app.extensions.get('event_broker')
+    if broker is None:
+        path = app.config.get('EVENTS_FANOUT_DB')
+        broker = app.extensions['event_broker'] = SqliteEventBroker(path) if path else EventBroker()
+    return broker
+
+
+def publish(client_id, event_type, **data):
+    """Sends an event to the client's open streams now; returns its id.
+
+    Use for progress that is not tied to a database change. For "this data
+    changed", use publish_on_commit so listeners never see it before the
+    change is visible to them.
+    """
+    if client_id is None or not has_app_context():
+        return None
+    return get_broker().publish(client_id, event_type, data)
+
+
+def publish_on_commit(client_id, event_type, session=None, **data):
+    """Queues an event that is published once the session commits, and dropped if it rolls back."""
+    session = session or db.session
+    session.info.setdefault(_PENDING_KEY, []).append((client_id, event_type, data))
+
+
+def format_event(event_id, event_type, data):
+    return f"id: {event_id}\nevent: {event_type}\ndata: {json.dumps(data, default=str)}\n\n"
+
+
+def stream(broker, client_id, last_id=None, duration=300):
+    """Server-sent events for the client, as strings, for up to duration seconds.
+
+    Without last_id the stream starts from now. Ending after duration makes
+    the browser reconnect with Last-Event-ID, so long-lived connections are
+    recycled without losing events.
+    """
+    if last_id is None:
+        last_id = broker.latest_id()
+    # Tell the browser to wait a few seconds before reconnecting.
+    yield 'retry: 3000\n\n'
+    deadline = time.monotonic() + duration
+    while True:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return
+        events = broker.listen(client_id, last_id, min(remaining, KEEPALIVE_SECONDS))
+        if not events:
+            yield ': keep-alive\n\n'
+        for event_id, event_type, data in events:
+            last_id = event_id
+            yield format_event(event_id, event_type, data)
+
+
+@event.listens_for(Session, 'before_flush')
+def _track_changes(session, flush_context, instances):
+    pending = session.info.setdefault(_PENDING_KEY, [])
+    for obj in session.new:
+        if isinstance(obj, Transaction):
+            pending.append((obj.client_id, 'transactions', {}))
+        elif isinstance(obj, JournalEntries):
+            pending.append((obj.client_id, 'journal', {}))
+    for obj in session.deleted:
+        if isinstance(obj, JournalEntries):
+            pending.append((obj.client_id, 'journal', {}))
+    for obj in session.dirty:
+        if isinstance(obj, JournalEntries) and session.is_modified(obj):
+            pending.append((obj.client_id, 'journal', {}))
+        elif isinstance(obj, Account) and db.inspect(obj).attrs.current_balance.history.has_changes():
+            # Keyed by account so the latest balance wins when events are merged.
+            updated = obj.balance_last_updated
+            pending.append((obj.client_id, 'balances', {'accounts': {obj.id: {
+                'balance': obj.current_balance,
+                'updated_at': updated.isoformat() if isinstance(updated, datetime) else None,
+            }}}))
+
+
+@event.listens_for(Session, 'before_commit')
+def _track_bulk_writes(session):
+    client_ids = {client_id for write in bulk_writes(session) for client_id, _, _ in write.rows}
+    if client_ids:
+        session.info.setdefault(_PENDING_KEY, []).extend((client_id, 'journal', {}) for client_id in client_ids)
+
+
+@event.listens_for(Session, 'after_commit')
+def _publish_pending(session):
+    pending = session.info.pop(_PENDING_KEY, None)
+    if not pending or not has_app_context():
+        return
+    # Change notices are merged to one per client and type per commit; other events keep their order.
+    changes, others = {}, []
+    for client_id, event_type, data in pending:
+        if client_id is None:
+            continue
+        if event_type == 'balances':
+            changes.setdefault((client_id, event_type), {'accounts': {}})['accounts'].update(data['accounts'])
+        elif event_type in ('transactions', 'journal'):
+            changes.setdefault((client_id, event_type), {})
+        else:
+            others.append((client_id, event_type, data))
+    broker = get_broker()
+    for (client_id, event_type), data in changes.items():
+        broker.publish(client_id, event_type, data)
+    for client_id, event_type, data in others:
+        broker.publish(client_id, event_type, data)
+
+
+@event.listens_for(Session, 'after_soft_rollback')
+def _discard_pending(session, previous_transaction):
+    session.info.pop(_PENDING_KEY, None)
@@ -0,0 +1,119 @@
+import logging
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from flask import current_app
+
+from app import db
+from app.models import Client, JobRun, JobRunResult
+
+
+def monthly_run_key(day):
+    return day.strftime('%Y-%m')
+
+
+def daily_run_key(day):
+    return day.strftime('%Y-%m-%d')
+
+
+def hourly_run_key(moment):
+    return moment.strftime('%Y-%m-%dT%H')
+
+
+def minute_run_key(moment):
+    return moment.strftime('%Y-%m-%dT%H:%M')
+
+
+def _record_result(job_name, run_key, job_run_id, client_id, status, items, error, started):
+    result = JobRunResult.query.filter_by(job_name=job_name, run_key=run_key, client_id=client_id).first()
+    if not result:
+        result = JobRunResult(job_name=job_name, run_key=run_key, client_id=client_id)
+        db.session.add(result)
+    result.job_run_id = job_run_id
+    result.status = status
+    result.items_processed = items
+    result.error = error
+    result.duration_ms = int((time.perf_counter() - started) * 1000)
+    result.finished_at = datetime.utcnow()
+
+
+def _run_for_client(app, job_name, run_key, job_run_id, client_func, client_id, run_date):
+    """Runs one client's share of a job in its own app context, session and transaction.
+
+    The JobRunResult row is written in the same transaction as the client's
+    work, so a committed 'success' row means the work is committed too. If
+    the work, its flush or the commit fails, everything is rolled back and a
+    'failed' row is written in a fresh transaction.
+    """
+    with app.app_context():
+        started = time.perf_counter()
+        try:
+            items = client_func(client_id, run_date) or 0
+            db.session.flush()
+            _record_result(job_name, run_key, job_run_id, client_id, 'success', items, None, started)
+            db.session.commit()
+            return 'success', items
+        except Exception:
+            db.session.rollback()
+            error = traceback.format_exc()
+            app.logger.error(f"Job {job_name} ({run_key}) failed for client {client_id}:\n{error}")
+
+        _record_result(job_name, run_key, job_run_id, client_id, 'failed', 0, error, started)
+        db.session.commit()
+        return 'failed', 0
+
+
+def run_client_job(job_name, client_func, run_date=None, run_key=None, client_ids=None, max_workers=None):
+    """Runs client_func(client_id, run_date) for every client, sharded across a thread pool.
+
+    Each client commits independently, so one failure only affects that
+    client. Clients that already succeeded for this (job_name, run_key) are
+    skipped, which makes re-running a job for the same period safe.
+    Returns the JobRun row.
+    """
+    app = current_app._get_current_object()
+    run_date = run_date or datetime.now().date()
+    run_key = run_key or daily_run_key(run_date)
+    if max_workers is None:
+        max_workers = app.config.get('JOB_MAX_WORKERS', 4)
+
+    if client_ids is None:
+        client_ids = [client_id for client_id, in db.session.query(Client.id).order_by(Client.id)]
+    done = {client_id for client_id, in db.session.query(JobRunResult.client_id).filter_by(
+        job_name=job_name, run_key=run_key, status='success')}
+    pending = [client_id for client_id in client_ids if client_id not in done]
+
+    job_run = JobRun(job_name=job_name, run_key=run_key, clients_total=len(client_ids),
+                     clients_skipped=len(client_ids) - len(pending))
+    db.session.add(job_run)
+    db.session.commit()
+    job_run_id = job_run.id
+
+    def run_one(client_id):
+        return _run_for_client(app, job_name, run_key, job_run_id, client_func, client_id, run_date)
+
+    if max_workers <= 1 or len(pending) <= 1:
+        outcomes = [run_one(client_id) for client_id in pending]
+    else:
+        with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=f'job-{job_name}') as executor:
+            outcomes = list(executor.map(run_one, pending))
+
+    job_run = db.session.get(JobRun, job_run_id)
+    job_run.clients_succeeded = sum(1 for status, _ in outcomes if status == 'success')
+    job_run.clients_failed = len(outcomes) - job_run.clients_succeeded
+    job_run.items_processed = sum(items for _, items in outcomes)
+    job_run.finished_at = datetime.utcnow()
+    if job_run.clients_failed == 0:
+        job_run.status = 'success'
+    elif job_run.clients_succeeded == 0:
+        job_run.status = 'failed'
+    else:
+        job_run.status = 'partial'
+    db.session.commit()
+
+    logging.info(f"Job {job_name} ({run_key}): {job_run.clients_succeeded} succeeded, "
+                 f"{job_run.clients_failed} failed, {job_run.clients_skipped} skipped, "
+                 f"{job_run.items_processed} items.")
+    return job_run
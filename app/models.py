@@ -5,6 +5,7 @@ from sqlalchemy import func
 from datetime import datetime, timedelta
 from dateutil.relativedelta import relativedelta
 from app import db
+from app.money import Money
 
 class User(UserMixin, db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -12,6 +13,8 @@ class User(UserMixin, db.Model):
     password_hash = db.Column(db.String(128), nullable=False)
     role_id = db.Column(db.Integer, db.ForeignKey('role.id'))
     client_id = db.Column(db.Integer, db.ForeignKey('client.id'))
+    # Read cursor: notifications up to this id count as read ("mark all as read")
+    last_read_notification_id = db.Column(db.Integer, nullable=False, default=0, server_default='0')
 
     role = db.relationship('Role', backref='users')
     client = db.relationship('Client', backref='users', foreign_keys=[client_id])
@@ -45,6 +48,8 @@ class Client(db.Model):
     billing_cycle = db.Column(db.String(50))
     client_status = db.Column(db.String(50))
     notes = db.Column(db.Text)
+    # Bumped whenever one of the client's accounts is added, edited or deleted (app/account_tree.py)
+    account_tree_version = db.Column(db.Integer, nullable=False, default=0, server_default='0')
 
     def __repr__(self):
         return f'<Client {self.business_name}>'
@@ -53,8 +58,8 @@ class Account(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(120), nullable=False)
     type = db.Column(db.String(50), nullable=False)  # e.g., Asset, Liability, Equity, Revenue, Expense
-    opening_balance = db.Column(db.Float, default=0.0)
-    current_balance = db.Column(db.Float, default=0.0)
+    opening_balance = db.Column(Money, default=0.0)
+    current_balance = db.Column(Money, default=0.0)
     balance_last_updated = db.Column(db.DateTime, default=datetime.utcnow)
     category = db.Column(db.String(120)) # e.g., Cash, Bank, Accounts Receivable, etc.
     client_id = db.Column(db.Integer, db.ForeignKey('client.id'), nullable=False)
@@ -73,7 +78,7 @@ class JournalEntries(db.Model):
     description = db.Column(db.String(255), nullable=False)
     debit_account_id = db.Column(db.Integer, db.ForeignKey('account.id'), nullable=False)
     credit_account_id = db.Column(db.Integer, db.ForeignKey('account.id'), nullable=False)
-    amount = db.Column(db.Float, nullable=False)
+    amount = db.Column(Money, nullable=False)
     category = db.Column(db.String(120))
     notes = db.Column(db.Text)
     client_id = db.Column(db.Integer, db.ForeignKey('client.id'), nullable=False)
@@ -84,12 +89,19 @@ class JournalEntries(db.Model):
     status = db.Column(db.String(50), default='posted') # posted, void, pending
     transaction_type = db.Column(db.String(50)) # e.g., 'sale', 'expense', 'deposit'
     transaction_id = db.Column(db.Integer, db.ForeignKey('transaction.id'))
+    # False until the entry has been matched against the client's budgets (app/budgeting.py)
+    budget_matched = db.Column(db.Boolean, default=False, nullable=False, server_default=db.false())
 
     debit_account = db.relationship('Account', foreign_keys=[debit_account_id], backref='debit_entries')
     credit_account = db.relationship('Account', foreign_keys=[credit_account_id], backref='credit_entries')
     client = db.relationship('Client', backref='journal_entries')
     transaction = db.relationship('Transaction', backref='journal_entries')
 
+    __table_args__ = (
+        db.Index('ix_journal_entries_client_id_budget_matched', 'client_id', 'budget_matched'),
+        db.Index('ix_journal_entries_client_id_date', 'client_id', 'date'),
+    )
+
     def __repr__(self):
         return f'<JournalEntries {self.date} - {self.description}: {self.amount}>'
 
@@ -147,7 +159,7 @@ class Category(db.Model):
 class Budget(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(120), nullable=False)
-    amount = db.Column(db.Float, nullable=False)
+    amount = db.Column(Money, nullable=False)
     start_date = db.Column(db.Date, nullable=False)
     end_date = db.Column(db.Date, nullable=False)
     period = db.Column(db.String(50), nullable=False) # e.g., 'monthly', 'quarterly', 'yearly'
@@ -237,6 +249,17 @@ class Budget(db.Model):
         
         return periods
 
+class JournalEntryBudgetMatch(db.Model):
+    """Which budgets' categories or keywords match each journal entry; maintained by app/budgeting.py."""
+    __tablename__ = 'journal_entry_budget_match'
+    journal_entry_id = db.Column(db.Integer, db.ForeignKey('journal_entries.id', ondelete='CASCADE'), primary_key=True)
+    budget_id = db.Column(db.Integer, db.ForeignKey('budget.id', ondelete='CASCADE'), primary_key=True)
+
+    __table_args__ = (db.Index('ix_journal_entry_budget_match_budget_id', 'budget_id', 'journal_entry_id'),)
+
+    def __repr__(self):
+        return f'<JournalEntryBudgetMatch entry {self.journal_entry_id} budget {self.budget_id}>'
+
 
 
 class FinancialPeriod(db.Model):
@@ -259,6 +282,8 @@ class FixedAsset(db.Model):
     salvage_value = db.Column(db.Float, nullable=False)
     useful_life = db.Column(db.Integer, nullable=False) # in years
     depreciation_method = db.Column(db.String(50), nullable=False) # e.g., 'straight-line'
+    # Months before this are never posted (assets that predate catch-up posting); None posts the whole schedule.
+    depreciation_from = db.Column(db.Date, nullable=True)
     client_id = db.Column(db.Integer, db.ForeignKey('client.id'), nullable=False)
 
     client = db.relationship('Client', backref='fixed_assets')
@@ -329,11 +354,15 @@ class RecurringTransaction(db.Model):
     start_date = db.Column(db.Date, nullable=False)
     end_date = db.Column(db.Date)
     client_id = db.Column(db.Integer, db.ForeignKey('client.id'), nullable=False)
+    next_due_date = db.Column(db.Date) # None once the recurrence has ended
+    last_posted_date = db.Column(db.Date)
 
     debit_account = db.relationship('Account', foreign_keys=[debit_account_id], backref='recurring_debit_transactions')
     credit_account = db.relationship('Account', foreign_keys=[credit_account_id], backref='recurring_credit_transactions')
     client = db.relationship('Client', backref='recurring_transactions')
 
+    __table_args__ = (db.Index('ix_recurring_transaction_next_due_date_client_id', 'next_due_date', 'client_id'),)
+
     def __repr__(self):
         return f'<RecurringTransaction {self.description} - {self.amount}>'
 
@@ -346,6 +375,7 @@ class PlaidItem(db.Model):
     institution_name = db.Column(db.String(255), nullable=False)
     last_synced = db.Column(db.DateTime, default=datetime.utcnow)
     cursor = db.Column(db.String(255)) # For Plaid Transactions Sync
+    balances_refreshed_at = db.Column(db.DateTime) # Last successful /accounts/balance/get
 
     client = db.relationship('Client', backref=db.backref('plaid_items', cascade="all, delete-orphan"))
 
@@ -353,6 +383,11 @@ class PlaidItem(db.Model):
         return f'<PlaidItem {self.institution_name}>'
 
 class PlaidAccount(db.Model):
+    __table_args__ = (
+        # Resolving a balance response's account ids for one item.
+        db.Index('ix_plaid_account_plaid_item_id_account_id', 'plaid_item_id', 'account_id'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     plaid_item_id = db.Column(db.Integer, db.ForeignKey('plaid_item.id'), nullable=False)
     account_id = db.Column(db.String(255), nullable=False) # Plaid's account ID
@@ -380,12 +415,34 @@ class PendingPlaidLink(db.Model):
     def __repr__(self):
         return f'<PendingPlaidLink {self.link_token}>'
 
+class PlaidBackfillWindow(db.Model):
+    """Checkpoint of a historical /transactions/get backfill for one date window of an item."""
+    id = db.Column(db.Integer, primary_key=True)
+    plaid_item_id = db.Column(db.Integer, db.ForeignKey('plaid_item.id', ondelete='CASCADE'), nullable=False)
+    account_key = db.Column(db.String(40), nullable=False, default='') # hash of the requested Plaid account ids, '' for all
+    start_date = db.Column(db.Date, nullable=False)
+    end_date = db.Column(db.Date, nullable=False)
+    next_offset = db.Column(db.Integer, nullable=False, default=0) # pages before this offset are stored
+    total_transactions = db.Column(db.Integer)
+    added = db.Column(db.Integer, nullable=False, default=0)
+    completed_at = db.Column(db.DateTime)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    plaid_item = db.relationship('PlaidItem', backref=db.backref('backfill_windows', cascade="all, delete-orphan"))
+
+    __table_args__ = (
+        db.UniqueConstraint('plaid_item_id', 'account_key', 'start_date', 'end_date', name='uq_plaid_backfill_window'),
+    )
+
+    def __repr__(self):
+        return f'<PlaidBackfillWindow item {self.plaid_item_id} {self.start_date}..{self.end_date}: {self.next_offset}>'
+
 class Transaction(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     plaid_transaction_id = db.Column(db.String(255), unique=True) # Plaid's transaction ID
     date = db.Column(db.Date, nullable=False)
     description = db.Column(db.String(255), nullable=False)
-    amount = db.Column(db.Float, nullable=False)
+    amount = db.Column(Money, nullable=False)
     category = db.Column(db.String(120))
     notes = db.Column(db.Text)
     client_id = db.Column(db.Integer, db.ForeignKey('client.id'), nullable=False)
@@ -415,6 +472,12 @@ class AuditTrail(db.Model):
     user = db.relationship('User', backref='audit_trails')
     client = db.relationship('Client', backref='audit_trails')
 
+    # (client_id, date, id) serves the keyset-paginated viewer; (client_id, action, date) its action filter.
+    __table_args__ = (
+        db.Index('ix_audit_trail_client_id_date_id', 'client_id', 'date', 'id'),
+        db.Index('ix_audit_trail_client_id_action_date', 'client_id', 'action', 'date'),
+    )
+
     def __repr__(self):
         return f'<AuditTrail {self.date} - {self.action}>'
 
@@ -476,24 +539,137 @@ class Reconciliation(db.Model):
 class NotificationRule(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(120), nullable=False)
-    criteria_type = db.Column(db.String(50), nullable=False) # e.g., 'daily_spending'
+    criteria_type = db.Column(db.String(50), nullable=False) # e.g., 'daily_spending', 'monthly_spending', 'category_spending', 'balance_below'
     criteria_value = db.Column(db.Float, nullable=False)
     notification_method = db.Column(db.String(50), nullable=False) # e.g., 'in_app', 'email', 'sms'
     client_id = db.Column(db.Integer, db.ForeignKey('client.id'), nullable=False)
+    category = db.Column(db.String(120)) # For 'category_spending'
+    account_id = db.Column(db.Integer, db.ForeignKey('account.id', ondelete='CASCADE')) # For 'balance_below'
+    # Period the rule last fired for ('2024-05-01', '2024-05' or 'below'), so each period alerts once
+    last_fired_key = db.Column(db.String(20))
 
     client = db.relationship('Client', backref='notification_rules')
+    account = db.relationship('Account')
 
     def __repr__(self):
         return f'<NotificationRule {self.name}>'
 
+class DailySpending(db.Model):
+    """Expense totals per client, day and journal category, kept current on commit (app/notifications.py)."""
+    __tablename__ = 'daily_spending'
+    client_id = db.Column(db.Integer, db.ForeignKey('client.id', ondelete='CASCADE'), primary_key=True)
+    day = db.Column(db.Date, primary_key=True)
+    category = db.Column(db.String(120), primary_key=True, default='')
+    amount = db.Column(Money, nullable=False, default=0)
+
 class Notification(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=True)
     message = db.Column(db.String(500), nullable=False)
     is_read = db.Column(db.Boolean, default=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    # e.g. 'budget:12:2024-05'; a user gets at most one notification per key (app/notifications.py)
+    dedup_key = db.Column(db.String(120))
 
     user = db.relationship('User', backref='notifications')
 
+    __table_args__ = (
+        db.Index('ix_notification_user_id_id', 'user_id', 'id'),
+        db.Index('ix_notification_user_id_dedup_key', 'user_id', 'dedup_key', unique=True),
+    )
+
+    def __repr__(self):
+        return f'<Notification {self.id}>'
+class JobRun(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    job_name = db.Column(db.String(120), nullable=False)
+    run_key = db.Column(db.String(50), nullable=False) # e.g., '2024-05' for monthly jobs, '2024-05-01' for daily
+    status = db.Column(db.String(50), nullable=False, default='running') # running, success, partial, failed
+    started_at = db.Column(db.DateTime, default=datetime.utcnow)
+    finished_at = db.Column(db.DateTime)
+    clients_total = db.Column(db.Integer, default=0)
+    clients_succeeded = db.Column(db.Integer, default=0)
+    clients_failed = db.Column(db.Integer, default=0)
+    clients_skipped = db.Column(db.Integer, default=0)
+    items_processed = db.Column(db.Integer, default=0)
+
+    __table_args__ = (db.Index('ix_job_run_job_name_run_key', 'job_name', 'run_key'),)
+
+    def __repr__(self):
+        return f'<JobRun {self.job_name} {self.run_key}: {self.status}>'
+
+class JobRunResult(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    job_run_id = db.Column(db.Integer, db.ForeignKey('job_run.id'), nullable=False)
+    job_name = db.Column(db.String(120), nullable=False)
+    run_key = db.Column(db.String(50), nullable=False)
+    client_id = db.Column(db.Integer, db.ForeignKey('client.id'), nullable=False)
+    status = db.Column(db.String(50), nullable=False) # success, failed
+    items_processed = db.Column(db.Integer, default=0)
+    duration_ms = db.Column(db.Integer)
+    error = db.Column(db.Text)
+    finished_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    job_run = db.relationship('JobRun', backref='results')
+    client = db.relationship('Client', backref='job_run_results')
+
+    __table_args__ = (db.UniqueConstraint('job_name', 'run_key', 'client_id', name='uq_job_run_result_client'),)
+
+    def __repr__(self):
+        return f'<JobRunResult {self.job_name} {self.run_key} client {self.client_id}: {self.status}>'
+
+class SchedulerLock(db.Model):
+    """A lease held by one process: 'leader' for the scheduler, 'job:<id>' while a scheduled job runs."""
+    name = db.Column(db.String(120), primary_key=True)
+    owner = db.Column(db.String(120), nullable=False) # host:pid:nonce of the holding process
+    expires_at = db.Column(db.DateTime, nullable=False) # UTC; anyone may take the lease after this
+
+    def __repr__(self):
+        return f'<SchedulerLock {self.name} held by {self.owner} until {self.expires_at}>'
+
+class ScheduledJobState(db.Model):
+    """The last run of each scheduled job, so a run happens once per scheduled time and missed ones are caught up."""
+    job_id = db.Column(db.String(120), primary_key=True)
+    last_scheduled_for = db.Column(db.DateTime) # local fire time of the last run
+    last_started_at = db.Column(db.DateTime)
+    last_finished_at = db.Column(db.DateTime)
+    last_error = db.Column(db.Text)
+
+    def __repr__(self):
+        return f'<ScheduledJobState {self.job_id}: {self.last_scheduled_for}>'
+
+class RecurringCandidate(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    client_id = db.Column(db.Integer, db.ForeignKey('client.id'), nullable=False)
+    merchant_key = db.Column(db.String(255), nullable=False) # normalized merchant name
+    amount_bucket = db.Column(db.Integer, nullable=False) # signed log-scale bucket, keeps distinct amounts at one merchant apart
+    description = db.Column(db.String(255), nullable=False) # most recent raw description
+    amount = db.Column(Money, nullable=False) # median amount
+    frequency = db.Column(db.String(50), nullable=False)
+    interval_days = db.Column(db.Float, nullable=False) # median gap
+    gap_mad_days = db.Column(db.Float, nullable=False) # median absolute deviation of the gaps
+    occurrences = db.Column(db.Integer, nullable=False)
+    first_date = db.Column(db.Date, nullable=False)
+    last_date = db.Column(db.Date, nullable=False)
+    next_expected_date = db.Column(db.Date)
+    confidence = db.Column(db.Float, nullable=False)
+    status = db.Column(db.String(50), nullable=False, default='open') # open, approved, dismissed, superseded, expired
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    client = db.relationship('Client', backref='recurring_candidates')
+
+    __table_args__ = (
+        db.UniqueConstraint('client_id', 'merchant_key', 'amount_bucket', name='uq_recurring_candidate_merchant_amount'),
+        db.Index('ix_recurring_candidate_client_id_status', 'client_id', 'status'),
+    )
+
+    def __repr__(self):
+        return f'<RecurringCandidate {self.merchant_key} {self.frequency}: {self.status}>'
+
+class RecurringDetectionState(db.Model):
+    client_id = db.Column(db.Integer, db.ForeignKey('client.id'), primary_key=True)
+    last_transaction_id = db.Column(db.Integer, nullable=False, default=0) # highest Transaction.id already analysed
+    last_run_at = db.Column(db.DateTime)
+
     def __repr__(self):
-        return f'<Notification {self.id}>'
\ No newline at end of file
+        return f'<RecurringDetectionState client {self.client_id}: {self.last_transaction_id}>'
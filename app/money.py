@@ -0,0 +1,35 @@
+from decimal import Decimal, ROUND_HALF_UP
+
+from sqlalchemy.types import TypeDecorator, BigInteger
+
+
+def to_cents(value):
+    """Converts a dollar amount (float, Decimal, str or int) to integer cents, rounding half up."""
+    if value is None:
+        return None
+    # str() gives the shortest repr of a float, so 0.1 + 0.2 becomes 30 cents, not 30.000000000000004.
+    return int((Decimal(str(value)) * 100).to_integral_value(rounding=ROUND_HALF_UP))
+
+
+def from_cents(cents):
+    if cents is None:
+        return None
+    return int(cents) / 100
+
+
+class Money(TypeDecorator):
+    """Stores amounts as integer cents and exposes them to Python as dollars.
+
+    Columns and SUM()/COALESCE() over them keep this type, so aggregation
+    happens on exact integers in the database and is converted once on the
+    way out. Comparisons against Python numbers are converted to cents too.
+    Expressions that lose the type (e.g. func.abs) need type_=Money().
+    """
+    impl = BigInteger
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        return to_cents(value)
+
+    def process_result_value(self, value, dialect):
+        return from_cents(value)
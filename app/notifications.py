@@ -0,0 +1,481 @@
+import json
+import logging
+import os
+import smtplib
+import threading
+import time
+import urllib.request
+from datetime import datetime, timedelta
+from email.message import EmailMessage
+
+from flask import current_app, has_app_context
+from sqlalchemy import event, delete, select
+from sqlalchemy.orm import Session
+
+from app import db
+from app.background import BackgroundWorker
+from app.bulk_writes import bulk_writes
+from app.models import Account, Client, DailySpending, JournalEntries, Notification, NotificationRule, User
+from app.money import to_cents, from_cents
+
+_TOUCHED_KEY = 'notification_touched_days'
+_REBUILD_KEY = 'notification_rebuild_clients'
+_BALANCES_KEY = 'notification_balance_clients'
+_OUTBOX_KEY = 'notification_outbox'
+_INBOX_USERS_KEY = 'notification_inbox_users'
+
+# JournalEntries columns that feed daily_spending; changing any of them refreshes the old and new day.
+SPENDING_COLUMNS = ('amount', 'date', 'category', 'debit_account_id', 'client_id')
+
+RULE_TYPES = {
+    'daily_spending': 'Daily Spending Exceeds',
+    'monthly_spending': 'Monthly Spending Exceeds',
+    'category_spending': 'Monthly Category Spending Exceeds',
+    'balance_below': 'Account Balance Falls Below',
+}
+SPENDING_RULES = ('daily_spending', 'monthly_spending', 'category_spending')
+
+# Above this many days a refresh recomputes the whole span instead of listing the days.
+MAX_LISTED_DAYS = 100
+
+INBOX_PAGE_SIZE = 50
+# Long-polling requests re-check the database this often, for notifications added by other processes.
+LONG_POLL_RECHECK_SECONDS = 5
+
+
+def _upsert(connection, table):
+    """INSERT ... ON CONFLICT for the connection's dialect (SQLite and Postgres)."""
+    if connection.dialect.name == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+    return dialect_insert(table)
+
+
+def refresh_daily_spending(connection, client_id, days=None):
+    """Recomputes the client's daily_spending rows for the given days, or for every day if None.
+
+    One INSERT ... SELECT grouped by day and category over the client's
+    expense entries (debited to an Expense account) that upserts the
+    totals, then one DELETE of the rows no entry backs any more. Upserting
+    rather than deleting and re-inserting means two commits refreshing the
+    same day can't both insert a row and fail on the primary key.
+    """
+    table = DailySpending.__table__
+    row_filters, entry_filters = [], []
+    if days is not None:
+        days = sorted(set(days))
+        if not days:
+            return
+        if len(days) > MAX_LISTED_DAYS:
+            row_filters.append(table.c.day.between(days[0], days[-1]))
+            entry_filters.append(JournalEntries.date.between(days[0], days[-1]))
+        else:
+            row_filters.append(table.c.day.in_(days))
+            entry_filters.append(JournalEntries.date.in_(days))
+    category = db.func.coalesce(JournalEntries.category, '')
+    totals = (
+        select(JournalEntries.client_id, JournalEntries.date, category, db.func.sum(JournalEntries.amount))
+        .join(Account, JournalEntries.debit_account_id == Account.id)
+        .where(Account.type == 'Expense', JournalEntries.client_id == client_id, *entry_filters)
+        .group_by(JournalEntries.client_id, JournalEntries.date, category)
+    )
+    upsert = _upsert(connection, table).from_select(['client_id', 'day', 'category', 'amount'], totals)
+    connection.execute(upsert.on_conflict_do_update(
+        index_elements=['client_id', 'day', 'category'], set_={'amount': upsert.excluded.amount}))
+
+    still_spent = select(JournalEntries.id).join(Account, JournalEntries.debit_account_id == Account.id).where(
+        Account.type == 'Expense',
+        JournalEntries.client_id == table.c.client_id,
+        JournalEntries.date == table.c.day,
+        category == table.c.category,
+    ).exists()
+    connection.execute(delete(table).where(table.c.client_id == client_id, *row_filters, ~still_spent))
+
+
+def _month_bounds(day):
+    start = day.replace(day=1)
+    end = (start + timedelta(days=32)).replace(day=1) - timedelta(days=1)
+    return start, end
+
+
+def _spending(session, client_id, today):
+    """(today's total, the month's total, {category: month total}) in cents, from daily_spending."""
+    start, end = _month_bounds(today)
+    rows = session.query(DailySpending.day, DailySpending.category, DailySpending.amount).filter(
+        DailySpending.client_id == client_id, DailySpending.day.between(start, end)
+    ).all()
+    day_total, month_total, by_category = 0, 0, {}
+    for day, category, amount in rows:
+        cents = to_cents(amount)
+        month_total += cents
+        by_category[category] = by_category.get(category, 0) + cents
+        if day == today:
+            day_total += cents
+    return day_total, month_total, by_category
+
+
+def _check_rule(rule, today, spending, balances):
+    """(period key, message) if the rule's condition holds, (None, None) if not."""
+    limit = rule.criteria_value
+    if rule.criteria_type == 'balance_below':
+        balance = balances.get(rule.account_id)
+        if balance is None or balance >= limit:
+            return None, None
+        name = rule.account.name if rule.account else 'account'
+        return 'below', f"The balance of {name} is {balance:.2f}, below your limit of {limit:.2f}."
+
+    day_total, month_total, by_category = spending
+    if rule.criteria_type == 'daily_spending':
+        spent, key = from_cents(day_total), today.isoformat()
+        message = f"You have spent {spent:.2f} today, which exceeds your daily spending limit of {limit:.2f}."
+    elif rule.criteria_type == 'monthly_spending':
+        spent, key = from_cents(month_total), today.strftime('%Y-%m')
+        message = f"You have spent {spent:.2f} this month, which exceeds your monthly spending limit of {limit:.2f}."
+    elif rule.criteria_type == 'category_spending':
+        spent, key = from_cents(by_category.get(rule.category or '', 0)), today.strftime('%Y-%m')
+        message = (f"You have spent {spent:.2f} on {rule.category} this month, "
+                   f"which exceeds your limit of {limit:.2f}.")
+    else:
+        return None, None
+    return (key, message) if spent > limit else (None, None)
+
+
+def evaluate_rules(client_id, today=None, spending=True, balances=True, session=None):
+    """Fires the client's notification rules whose condition now holds; returns how many fired.
+
+    Spending rules read daily_spending and balance rules Account.current_balance,
+    so nothing here scans the journal. Each rule fires once per period (day,
+    month, or each time a balance drops below the limit). In-app notifications
+    are added to the session; email and SMS are sent after it commits.
+    """
+    session = session or db.session
+    today = today or datetime.now().date()
+    wanted = set(SPENDING_RULES if spending else ()) | ({'balance_below'} if balances else set())
+    rules = [rule for rule in session.query(NotificationRule).filter_by(client_id=client_id)
+             if rule.criteria_type in wanted]
+    if not rules:
+        return 0
+
+    totals = _spending(session, client_id, today) if any(r.criteria_type in SPENDING_RULES for r in rules) else None
+    account_ids = [r.account_id for r in rules if r.criteria_type == 'balance_below' and r.account_id]
+    account_balances = dict(session.query(Account.id, Account.current_balance).filter(
+        Account.id.in_(account_ids))) if account_ids else {}
+
+    fired = 0
+    for rule in rules:
+        key, message = _check_rule(rule, today, totals, account_balances)
+        if key is None:
+            # A balance back above the limit re-arms its rule.
+            if rule.criteria_type == 'balance_below' and rule.last_fired_key is not None:
+                rule.last_fired_key = None
+            continue
+        if key == rule.last_fired_key:
+            continue
+        rule.last_fired_key = key
+        _dispatch(session, rule, key, message)
+        fired += 1
+    return fired
+
+
+def client_user_ids(client_id, session=None):
+    session = session or db.session
+    return [user_id for user_id, in session.query(User.id).filter(User.client_id == client_id)]
+
+
+def notify(user_ids, message, dedup_key=None, session=None):
+    """Adds a notification to each user's inbox; returns how many were added.
+
+    With a dedup_key (e.g. 'budget:12:2024-05'), users who already have a
+    notification with that key are skipped, so jobs that re-check the same
+    condition do not pile up copies.
+    """
+    session = session or db.session
+    user_ids = list(dict.fromkeys(user_ids))
+    if dedup_key and user_ids:
+        existing = {user_id for user_id, in session.query(Notification.user_id).filter(
+            Notification.dedup_key == dedup_key, Notification.user_id.in_(user_ids))}
+        user_ids = [user_id for user_id in user_ids if user_id not in existing]
+    for user_id in user_ids:
+        session.add(Notification(user_id=user_id, message=message[:500], dedup_key=dedup_key))
+    return len(user_ids)
+
+
+def _dispatch(session, rule, key, message):
+    if rule.notification_method == 'in_app':
+        # Balance rules re-arm, so the same key can legitimately fire again later.
+        dedup_key = f'rule:{rule.id}:{key}' if key != 'below' else None
+        notify(client_user_ids(rule.client_id, session), message, dedup_key, session=session)
+        return
+    client = session.get(Client, rule.client_id)
+    recipient = client.contact_email if rule.notification_method == 'email' else client.contact_phone
+    if not recipient:
+        logging.warning(f"Notification rule {rule.id} ({rule.notification_method}) has no recipient for client {rule.client_id}.")
+        return
+    session.info.setdefault(_OUTBOX_KEY, []).append({
+        'method': rule.notification_method,
+        'recipient': recipient,
+        'subject': f"Logical Books alert: {rule.name}",
+        'body': message,
+    })
+
+
+def inbox(user_id, since_id=0, limit=INBOX_PAGE_SIZE):
+    """A user's unread notifications newer than since_id, newest first, with the unread count.
+
+    Returns {'items', 'unread', 'cursor'}; pass cursor back as since_id to
+    get only what arrived since. Both queries are range scans on
+    (user_id, id) above the user's read cursor, so their cost follows the
+    number of unread notifications rather than the size of the history.
+    """
+    read_cursor = db.session.query(User.last_read_notification_id).filter(User.id == user_id).scalar() or 0
+    unread = db.session.query(Notification).filter(
+        Notification.user_id == user_id,
+        Notification.id > read_cursor,
+        Notification.is_read == False
+    )
+    items = unread.filter(Notification.id > since_id).order_by(Notification.id.desc()).limit(limit).all()
+    return {
+        'items': [{'id': n.id, 'message': n.message, 'created_at': n.created_at} for n in items],
+        'unread': unread.count(),
+        'cursor': max([since_id] + [n.id for n in items]),
+    }
+
+
+def wait_for_inbox(user_id, since_id=0, timeout=0):
+    """inbox(), but if nothing is newer than since_id, waits up to timeout seconds for something to arrive."""
+    deadline = time.monotonic() + timeout
+    while True:
+        version = _inbox_bell.version(user_id)
+        result = inbox(user_id, since_id)
+        remaining = deadline - time.monotonic()
+        if result['items'] or remaining <= 0:
+            return result
+        # End the read transaction so the next check sees newly committed rows.
+        db.session.rollback()
+        _inbox_bell.wait(user_id, version, min(remaining, LONG_POLL_RECHECK_SECONDS))
+
+
+def mark_read(user_id, notification_id):
+    """Marks one of the user's notifications read; False if it is not theirs."""
+    updated = db.session.query(Notification).filter(
+        Notification.id == notification_id, Notification.user_id == user_id
+    ).update({'is_read': True}, synchronize_session=False)
+    return updated > 0
+
+
+def mark_all_read(user_id):
+    """Moves the user's read cursor past their newest notification, without touching the rows."""
+    newest = db.session.query(db.func.max(Notification.id)).filter(Notification.user_id == user_id).scalar()
+    if newest:
+        db.session.query(User).filter(User.id == user_id).update(
+            {'last_read_notification_id': newest}, synchronize_session=False)
+
+
+class _InboxBell:
+    """Wakes long-polling requests in this process when one of their users' inbox gets a new row."""
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._versions = {}
+
+    def version(self, user_id):
+        with self._condition:
+            return self._versions.get(user_id, 0)
+
+    def ring(self, user_ids):
+        with self._condition:
+            for user_id in user_ids:
+                self._versions[user_id] = self._versions.get(user_id, 0) + 1
+            self._condition.notify_all()
+
+    def wait(self, user_id, version, timeout):
+        with self._condition:
+            self._condition.wait_for(lambda: self._versions.get(user_id, 0) != version, timeout)
+
+
+_inbox_bell = _InboxBell()
+
+
+class OutboxChannel:
+    """Local stand-in for a real email or SMS service: appends each message to <directory>/<method>.jsonl."""
+
+    def __init__(self, directory, method):
+        self.path = os.path.join(directory, f'{method}.jsonl')
+
+    def send(self, recipient, subject, body):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(self.path, 'a') as f:
+            f.write(json.dumps({'date': datetime.utcnow().isoformat(), 'to': recipient,
+                                'subject': subject, 'body': body}) + '\n')
+
+
+class SmtpChannel:
+    def __init__(self, host, port, sender):
+        self.host = host
+        self.port = port
+        self.sender = sender
+
+    def send(self, recipient, subject, body):
+        message = EmailMessage()
+        message['From'] = self.sender
+        message['To'] = recipient
+        message['Subject'] = subject
+        message.set_content(body)
+        with smtplib.SMTP(self.host, self.port, timeout=10) as smtp:
+            smtp.send_message(message)
+
+
+class HttpSmsChannel:
+    """Posts {"to", "body"} as JSON to an SMS gateway URL."""
+
+    def __init__(self, url):
+        self.url = url
+
+    def send(self, recipient, subject, body):
+        request = urllib.request.Request(self.url, data=json.dumps({'to': recipient, 'body': body}).encode(),
+                                         headers={'Content-Type': 'application/json'}, method='POST')
+        with urllib.request.urlopen(request, timeout=10):
+            pass
+
+
+def _outbox_dir(app):
+    return app.config.get('NOTIFY_OUTBOX_DIR') or os.path.join(app.instance_path, 'notification_outbox')
+
+
+def _email_channel(app):
+    if not app.config.get('NOTIFY_SMTP_HOST'):
+        return OutboxChannel(_outbox_dir(app), 'email')
+    return SmtpChannel(app.config['NOTIFY_SMTP_HOST'], app.config['NOTIFY_SMTP_PORT'], app.config['NOTIFY_EMAIL_FROM'])
+
+
+def _sms_channel(app):
+    if not app.config.get('NOTIFY_SMS_URL'):
+        return OutboxChannel(_outbox_dir(app), 'sms')
+    return HttpSmsChannel(app.config['NOTIFY_SMS_URL'])
+
+
+# notification_method -> factory(app) returning an object with send(recipient, subject, body)
+CHANNELS = {
+    'email': _email_channel,
+    'sms': _sms_channel,
+}
+
+
+def register_channel(method, factory):
+    """Adds or replaces the delivery channel for a notification method."""
+    CHANNELS[method] = factory
+
+
+def get_channel(method):
+    channels = current_app.extensions.setdefault('notification_channels', {})
+    if method not in channels:
+        factory = CHANNELS.get(method)
+        channels[method] = factory(current_app) if factory else None
+    return channels[method]
+
+
+def _send(message):
+    try:
+        channel = get_channel(message['method'])
+        if channel is None:
+            logging.warning(f"No notification channel for method '{message['method']}'.")
+            return
+        channel.send(message['recipient'], message['subject'], message['body'])
+    except Exception:
+        logging.exception(f"Failed to deliver {message['method']} notification to {message['recipient']}")
+
+
+def _deliver_in_context(item):
+    app, message = item
+    with app.app_context():
+        _send(message)
+
+
+# Sends email and SMS notifications in the background, so commits never wait on a mail server.
+_delivery_queue = BackgroundWorker('notification-delivery', _deliver_in_context)
+
+
+def deliver(messages):
+    """Queues messages ({'method', 'recipient', 'subject', 'body'}) for their channels."""
+    app = current_app._get_current_object()
+    for message in messages:
+        _delivery_queue.put((app, message))
+
+
+def flush_delivery_queue():
+    _delivery_queue.flush()
+
+
+def _touch(session, client_id, day):
+    if client_id is not None and day is not None:
+        session.info.setdefault(_TOUCHED_KEY, {}).setdefault(client_id, set()).add(day)
+
+
+@event.listens_for(Session, 'before_flush')
+def _track_spending_changes(session, flush_context, instances):
+    for obj in session.new | session.deleted:
+        if isinstance(obj, JournalEntries):
+            _touch(session, obj.client_id, obj.date)
+    inbox_users = {obj.user_id for obj in session.new if isinstance(obj, Notification) and obj.user_id}
+    if inbox_users:
+        session.info.setdefault(_INBOX_USERS_KEY, set()).update(inbox_users)
+    for obj in session.dirty:
+        if isinstance(obj, JournalEntries):
+            state = db.inspect(obj)
+            if any(state.attrs[name].history.has_changes() for name in SPENDING_COLUMNS):
+                # Both the old and the new (client, day) change.
+                for client_id in state.attrs.client_id.history.sum() or [obj.client_id]:
+                    for day in state.attrs.date.history.sum() or [obj.date]:
+                        _touch(session, client_id, day)
+        elif isinstance(obj, Account):
+            state = db.inspect(obj)
+            if state.attrs.type.history.has_changes():
+                session.info.setdefault(_REBUILD_KEY, set()).add(obj.client_id)
+            elif state.attrs.current_balance.history.has_changes():
+                session.info.setdefault(_BALANCES_KEY, set()).add(obj.client_id)
+
+
+@event.listens_for(Session, 'before_commit')
+def _refresh_and_evaluate(session):
+    # Changes not flushed yet have not been seen by _track_spending_changes.
+    if session.new or session.dirty or session.deleted:
+        session.flush()
+    for write in bulk_writes(session):
+        if write.kind != 'update' or write.columns & set(SPENDING_COLUMNS):
+            for client_id, day, _ in write.rows:
+                _touch(session, client_id, day)
+    if not any(key in session.info for key in (_TOUCHED_KEY, _REBUILD_KEY, _BALANCES_KEY)):
+        return
+    touched = session.info.pop(_TOUCHED_KEY, {})
+    rebuild = session.info.pop(_REBUILD_KEY, set())
+    balances = session.info.pop(_BALANCES_KEY, set())
+    connection = session.connection()
+    today = datetime.now().date()
+    month_start, month_end = _month_bounds(today)
+    for client_id in rebuild:
+        refresh_daily_spending(connection, client_id)
+    for client_id, days in touched.items():
+        if client_id not in rebuild:
+            refresh_daily_spending(connection, client_id, days)
+    for client_id in (set(touched) | rebuild | balances) - {None}:
+        current = client_id in rebuild or any(month_start <= day <= month_end for day in touched.get(client_id, ()))
+        if current or client_id in balances:
+            evaluate_rules(client_id, today, spending=current, balances=client_id in balances or client_id in rebuild,
+                           session=session)
+
+
+@event.listens_for(Session, 'after_commit')
+def _send_outbox(session):
+    inbox_users = session.info.pop(_INBOX_USERS_KEY, None)
+    if inbox_users:
+        _inbox_bell.ring(inbox_users)
+    messages = session.info.pop(_OUTBOX_KEY, None)
+    if messages and has_app_context():
+        deliver(messages)
+
+
+@event.listens_for(Session, 'after_soft_rollback')
+def _discard_spending_changes(session, previous_transaction):
+    for key in (_TOUCHED_KEY, _REBUILD_KEY, _BALANCES_KEY, _OUTBOX_KEY, _INBOX_USERS_KEY):
+        session.info.pop(key, None)
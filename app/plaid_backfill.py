@@ -0,0 +1,147 @@
+import asyncio
+import hashlib
+from datetime import datetime, timedelta
+
+from flask import current_app
+
+from app import db
+from app.models import PlaidAccount, PlaidBackfillWindow, Transaction
+
+
+def account_key(account_ids):
+    """Identifies the set of Plaid accounts a backfill is limited to ('' for the whole item)."""
+    if not account_ids:
+        return ''
+    return hashlib.sha1(','.join(sorted(account_ids)).encode()).hexdigest()
+
+
+def split_windows(start_date, end_date, days):
+    """Consecutive (start, end) date windows of at most `days` days covering start_date..end_date."""
+    windows = []
+    while start_date <= end_date:
+        window_end = min(end_date, start_date + timedelta(days=days - 1))
+        windows.append((start_date, window_end))
+        start_date = window_end + timedelta(days=1)
+    return windows
+
+
+def _load_windows(item, start_date, end_date, account_ids, days):
+    key = account_key(account_ids)
+    existing = {(w.start_date, w.end_date): w for w in PlaidBackfillWindow.query.filter_by(
+        plaid_item_id=item.id, account_key=key).filter(
+        PlaidBackfillWindow.start_date >= start_date, PlaidBackfillWindow.end_date <= end_date)}
+    windows = []
+    for window_start, window_end in split_windows(start_date, end_date, days):
+        window = existing.get((window_start, window_end))
+        if window is None:
+            window = PlaidBackfillWindow(plaid_item_id=item.id, account_key=key, start_date=window_start,
+                                         end_date=window_end, next_offset=0, added=0)
+            db.session.add(window)
+        windows.append(window)
+    if all(window.completed_at for window in windows):
+        # Asking again for a finished backfill starts it over, to pick up anything posted since.
+        for window in windows:
+            window.next_offset, window.added, window.total_transactions, window.completed_at = 0, 0, None, None
+    db.session.commit()
+    return windows
+
+
+def store_page(client_id, transactions, account_id_map):
+    """Adds the page's transactions that are not stored yet; returns how many were added."""
+    existing = {transaction_id for transaction_id, in db.session.query(Transaction.plaid_transaction_id).filter(
+        Transaction.plaid_transaction_id.in_([t['transaction_id'] for t in transactions]))}
+    added = 0
+    for t in transactions:
+        if t['transaction_id'] in existing:
+            continue
+        existing.add(t['transaction_id'])
+        db.session.add(Transaction(
+            plaid_transaction_id=t['transaction_id'],
+            date=t['date'],
+            description=t['name'],
+            amount=-t['amount'], # Plaid returns positive for debits, negative for credits
+            category=t['category'][0] if t['category'] else None,
+            client_id=client_id,
+            is_approved=False,
+            source_account_id=account_id_map.get(t['account_id'])
+        ))
+        added += 1
+    return added
+
+
+async def _stream(gateway, access_token, account_ids, plan, concurrency, consume):
+    """Fetches the planned windows concurrently and hands their pages to consume() one at a time.
+
+    At most `concurrency` windows are fetched at once and at most
+    `concurrency` fetched pages wait to be consumed, which bounds memory.
+    consume(window_id, page) gets page None when a window is exhausted.
+    """
+    queue = asyncio.Queue(maxsize=concurrency)
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def produce(window_id, start_date, end_date, offset):
+        try:
+            async with semaphore:
+                async for page in gateway.transactions_pages(access_token, start_date, end_date, account_ids,
+                                                             offset=offset):
+                    await queue.put((window_id, page))
+            await queue.put((window_id, None))
+        except Exception as e:
+            await queue.put((window_id, e))
+
+    producers = [asyncio.ensure_future(produce(*window)) for window in plan]
+    try:
+        remaining = len(producers)
+        while remaining:
+            window_id, page = await queue.get()
+            if isinstance(page, Exception):
+                raise page
+            consume(window_id, page)
+            if page is None:
+                remaining -= 1
+    finally:
+        for producer in producers:
+            producer.cancel()
+        await asyncio.gather(*producers, return_exceptions=True)
+
+
+def backfill(item, start_date, end_date, account_ids=None, on_progress=None):
+    """Streams the item's transactions between the dates from /transactions/get into the database.
+
+    The range is split into PLAID_BACKFILL_WINDOW_DAYS windows fetched
+    PLAID_BACKFILL_CONCURRENCY at a time. Each page is stored and committed
+    as it arrives together with its window's checkpoint, so only a few pages
+    are ever in memory and an interrupted backfill resumes from the last
+    committed page. on_progress(fetched, total) is called after each page.
+    Returns the number of transactions the backfill added.
+    """
+    config = current_app.config
+    windows = _load_windows(item, start_date, end_date, account_ids, config['PLAID_BACKFILL_WINDOW_DAYS'])
+    by_id = {window.id: window for window in windows}
+    plan = [(window.id, window.start_date, window.end_date, window.next_offset)
+            for window in windows if not window.completed_at]
+    account_id_map = dict(db.session.query(PlaidAccount.account_id, PlaidAccount.local_account_id).filter(
+        PlaidAccount.plaid_item_id == item.id))
+    # Plain values, since each commit expires the ORM state.
+    client_id = item.client_id
+    progress = {window.id: [window.next_offset, window.total_transactions or 0] for window in windows}
+
+    def consume(window_id, page):
+        window = by_id[window_id]
+        if page is None:
+            window.completed_at = datetime.utcnow()
+        else:
+            offset, transactions, total = page
+            window.added += store_page(client_id, transactions, account_id_map)
+            window.next_offset = offset + len(transactions)
+            window.total_transactions = total
+            progress[window_id] = [window.next_offset, total]
+        db.session.commit()
+        if on_progress and page is not None:
+            on_progress(sum(fetched for fetched, _ in progress.values()),
+                        sum(total for _, total in progress.values()))
+
+    if plan:
+        asyncio.run(_stream(current_app.plaid_client, item.access_token, account_ids, plan,
+                            config['PLAID_BACKFILL_CONCURRENCY'], consume))
+    return sum(window.added for window in windows)
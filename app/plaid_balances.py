@@ -0,0 +1,92 @@
+import asyncio
+from datetime import datetime, timedelta
+
+from flask import current_app
+
+from app import db, events
+from app.models import Account, PlaidAccount, PlaidItem
+
+
+def clients_with_plaid_items():
+    return [client_id for client_id, in db.session.query(PlaidItem.client_id).distinct().order_by(PlaidItem.client_id)]
+
+
+def apply_balances(item, accounts, now=None):
+    """Copies current balances from an /accounts/balance/get response onto the item's linked accounts.
+
+    The response's Plaid account ids are resolved to local accounts in one
+    query and the changed rows are written by the caller's next flush.
+    Returns the number of accounts updated.
+    """
+    now = now or datetime.utcnow()
+    current = {a['account_id']: a['balances']['current'] for a in accounts
+               if a['balances']['current'] is not None}
+    item.balances_refreshed_at = now
+    if not current:
+        return 0
+    linked = db.session.query(Account, PlaidAccount.account_id).join(
+        PlaidAccount, PlaidAccount.local_account_id == Account.id).filter(
+        PlaidAccount.plaid_item_id == item.id, PlaidAccount.account_id.in_(current)).all()
+    for account, plaid_account_id in linked:
+        account.current_balance = current[plaid_account_id]
+        account.balance_last_updated = now
+    return len(linked)
+
+
+async def _fetch_balances(gateway, access_tokens, concurrency):
+    from plaid.model.accounts_balance_get_request import AccountsBalanceGetRequest
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def fetch(access_token):
+        async with semaphore:
+            response = await gateway.acall('accounts_balance_get', AccountsBalanceGetRequest(access_token=access_token))
+            return response['accounts']
+
+    return await asyncio.gather(*(fetch(token) for token in access_tokens), return_exceptions=True)
+
+
+def refresh_balances(items, force=False):
+    """Refreshes balances for the given Plaid items from Plaid and commits.
+
+    Items refreshed within PLAID_BALANCE_MAX_AGE_MINUTES are skipped unless
+    force is set. Plaid is called for up to PLAID_BALANCE_CONCURRENCY items
+    at once; the results are written in one transaction. Returns
+    {item id: accounts updated, or None if Plaid failed for that item}.
+    """
+    now = datetime.utcnow()
+    max_age = timedelta(minutes=current_app.config['PLAID_BALANCE_MAX_AGE_MINUTES'])
+    stale = [item for item in items
+             if force or item.balances_refreshed_at is None or now - item.balances_refreshed_at >= max_age]
+    if not stale:
+        return {}
+
+    responses = asyncio.run(_fetch_balances(current_app.plaid_client, [item.access_token for item in stale],
+                                            current_app.config['PLAID_BALANCE_CONCURRENCY']))
+    results = {}
+    for item, response in zip(stale, responses):
+        if isinstance(response, Exception):
+            current_app.logger.error(f"Error updating balances for Plaid item {item.id}: {response}")
+            results[item.id] = None
+        else:
+            results[item.id] = apply_balances(item, response, now)
+    db.session.commit()
+
+    for item in stale:
+        events.publish(item.client_id, 'sync', kind='balances', item_id=item.id,
+                       stage='failed' if results[item.id] is None else 'done')
+    return results
+
+
+def refresh_client_balances(client_id, run_date=None, force=False):
+    """Refreshes every stale Plaid item of the client; returns the number of accounts updated.
+
+    Raises after committing the items that succeeded if any item failed, so
+    the job run records the client as failed and a re-run retries only the
+    items that are still stale.
+    """
+    items = PlaidItem.query.filter_by(client_id=client_id).order_by(PlaidItem.id).all()
+    results = refresh_balances(items, force=force)
+    failed = [item_id for item_id, updated in results.items() if updated is None]
+    if failed:
+        raise RuntimeError(f"Balance refresh failed for Plaid items {failed}")
+    return sum(results.values())
@@ -0,0 +1,212 @@
+import asyncio
+import collections
+import functools
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# PLAID_ENV values and the plaid.Environment host each one selects.
+PLAID_ENVIRONMENTS = {
+    'sandbox': 'Sandbox',
+    'development': 'Development',
+    'production': 'Production',
+}
+
+TRANSACTIONS_PAGE_SIZE = 500
+
+
+class TokenBucket:
+    """Allows `rate` calls per second on average, with bursts of up to `burst` calls."""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _reserve(self):
+        """Takes a token, possibly borrowed from the future; returns how long to wait before using it."""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= 1
+            return 0 if self._tokens >= 0 else -self._tokens / self.rate
+
+    def acquire(self):
+        wait = self._reserve()
+        if wait:
+            time.sleep(wait)
+        return wait
+
+
+class WebhookKeyCache:
+    """Plaid webhook verification keys (JWKs) by key id.
+
+    A key is fetched once and then served from memory until the TTL runs out
+    or Plaid's own expired_at passes; the least recently used keys are
+    evicted beyond max_size. Plaid rotates keys rarely, so nearly every
+    webhook is verified without a network call.
+    """
+
+    def __init__(self, fetch, ttl=24 * 3600, max_size=32):
+        self._fetch = fetch
+        self.ttl = ttl
+        self.max_size = max_size
+        self._keys = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, kid):
+        now = time.time()
+        with self._lock:
+            cached = self._keys.get(kid)
+            if cached and cached[0] > now:
+                self._keys.move_to_end(kid)
+                return cached[1]
+        key = self._fetch(kid)
+        expires = now + self.ttl
+        if key.get('expired_at'):
+            expires = min(expires, key['expired_at'])
+        with self._lock:
+            self._keys[kid] = (expires, key)
+            self._keys.move_to_end(kid)
+            while len(self._keys) > self.max_size:
+                self._keys.popitem(last=False)
+        return key
+
+
+class PlaidGateway:
+    """The app's Plaid client (app.plaid_client).
+
+    Every PlaidApi method is available under its usual name and behaves the
+    same, except that calls for an item (any request with an access_token)
+    first take a token from that item's rate limiter, so loops and concurrent
+    page fetches stay under Plaid's per-item limits instead of failing with
+    RATE_LIMIT_EXCEEDED. One ApiClient, and with it one pool of keep-alive
+    HTTP connections, is shared by all requests of the process.
+
+    Instead of a PlaidApi, api_factory may give a function that builds one.
+    The SDK's PlaidApi module takes over a second to import, so from_config
+    does this and the client is built on the first Plaid call rather than
+    at app startup.
+    """
+
+    def __init__(self, api=None, rate_per_item=2.0, burst_per_item=10, max_workers=8, api_factory=None):
+        self._api = api
+        self._api_factory = api_factory
+        self._api_lock = threading.Lock()
+        self.rate_per_item = rate_per_item
+        self.burst_per_item = burst_per_item
+        self._buckets = {}
+        self._buckets_lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='plaid')
+        self.webhook_keys = WebhookKeyCache(self._fetch_webhook_key)
+
+    @classmethod
+    def from_config(cls, config):
+        env = config['PLAID_ENV']
+        if env != 'local' and env not in PLAID_ENVIRONMENTS:
+            raise ValueError("Invalid PLAID_ENV")
+        settings = {key: config[key] for key in ('PLAID_HOST', 'PLAID_CLIENT_ID', 'PLAID_SECRET', 'PLAID_POOL_SIZE')}
+
+        def build_api():
+            import plaid
+            from plaid.api import plaid_api
+
+            credentials = {'clientId': settings['PLAID_CLIENT_ID'], 'secret': settings['PLAID_SECRET']}
+            if env == 'local':
+                # A stand-in server such as benchmarks/fake_plaid.py. It accepts any credentials,
+                # but the SDK cannot send unset ones, so placeholders stand in for them.
+                host = settings['PLAID_HOST']
+                credentials = {key: value or 'local' for key, value in credentials.items()}
+            else:
+                host = getattr(plaid.Environment, PLAID_ENVIRONMENTS[env])
+            configuration = plaid.Configuration(host=host, api_key=credentials)
+            # Enough pooled connections for the async page fetches plus request threads.
+            configuration.connection_pool_maxsize = settings['PLAID_POOL_SIZE']
+            return plaid_api.PlaidApi(plaid.ApiClient(configuration))
+
+        return cls(rate_per_item=config['PLAID_RATE_PER_ITEM'], burst_per_item=config['PLAID_RATE_BURST'],
+                   max_workers=config['PLAID_POOL_SIZE'], api_factory=build_api)
+
+    @property
+    def api(self):
+        """The SDK's PlaidApi, built on first use."""
+        if self._api is None:
+            with self._api_lock:
+                if self._api is None:
+                    self._api = self._api_factory()
+        return self._api
+
+    def _bucket(self, key):
+        with self._buckets_lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = TokenBucket(self.rate_per_item, self.burst_per_item)
+            return bucket
+
+    def _throttle(self, request):
+        access_token = getattr(request, 'access_token', None)
+        if access_token:
+            self._bucket(access_token).acquire()
+
+    def __getattr__(self, name):
+        if name.startswith('_') or name == 'api':
+            raise AttributeError(name)
+        method = getattr(self.api, name)
+        if not callable(method):
+            return method
+
+        @functools.wraps(method)
+        def call(request=None, *args, **kwargs):
+            self._throttle(request)
+            return method(request, *args, **kwargs)
+        return call
+
+    async def acall(self, name, request):
+        """Awaitable version of getattr(gateway, name)(request), run on the gateway's thread pool."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, getattr(self, name), request)
+
+    def _transactions_request(self, access_token, start_date, end_date, account_ids, offset, page_size):
+        from plaid.model.transactions_get_request import TransactionsGetRequest
+        from plaid.model.transactions_get_request_options import TransactionsGetRequestOptions
+
+        options = TransactionsGetRequestOptions(offset=offset, count=page_size)
+        if account_ids:
+            options.account_ids = account_ids
+        return TransactionsGetRequest(access_token=access_token, start_date=start_date, end_date=end_date,
+                                      options=options)
+
+    async def transactions_pages(self, access_token, start_date, end_date, account_ids=None, offset=0,
+                                 page_size=TRANSACTIONS_PAGE_SIZE):
+        """Yields (offset, transactions, total) for each /transactions/get page from offset on.
+
+        Pages are fetched one after another, so only the page being
+        processed is held in memory; interleave several windows for
+        concurrency.
+        """
+        while True:
+            response = await self.acall('transactions_get', self._transactions_request(
+                access_token, start_date, end_date, account_ids, offset, page_size))
+            transactions = response['transactions']
+            yield offset, transactions, response['total_transactions']
+            offset += len(transactions)
+            if not transactions or offset >= response['total_transactions']:
+                return
+
+    def _fetch_webhook_key(self, kid):
+        from plaid.model.webhook_verification_key_get_request import WebhookVerificationKeyGetRequest
+
+        response = self.webhook_verification_key_get(WebhookVerificationKeyGetRequest(key_id=kid))
+        return response['key'].to_dict()
+
+    def webhook_key(self, kid):
+        """The JWK (as a dict) for a webhook's key id, from the cache when possible."""
+        return self.webhook_keys.get(kid)
+
+    def close(self):
+        self._executor.shutdown(wait=False)
+        if self._api is not None:
+            self._api.api_client.close()
@@ -0,0 +1,144 @@
+from datetime import date
+
+from dateutil.relativedelta import relativedelta
+from sqlalchemy import insert
+
+from app import db
+from app.models import RecurringTransaction, JournalEntries
+
+FREQUENCY_STEPS = {
+    'daily': relativedelta(days=1),
+    'weekly': relativedelta(weeks=1),
+    'monthly': relativedelta(months=1),
+    'quarterly': relativedelta(months=3),
+    'yearly': relativedelta(years=1),
+}
+
+
+def occurrence(recurring, index):
+    """The index-th occurrence date. Always derived from start_date so month-end dates don't drift."""
+    return recurring.start_date + FREQUENCY_STEPS[recurring.frequency] * index
+
+
+def _occurrence_index_on_or_after(recurring, day):
+    start = recurring.start_date
+    if day <= start:
+        return 0
+    step = FREQUENCY_STEPS[recurring.frequency]
+    if step.days:
+        index = (day - start).days // step.days
+    else:
+        months = step.months + step.years * 12
+        index = ((day.year - start.year) * 12 + day.month - start.month) // months
+    while occurrence(recurring, index) < day:
+        index += 1
+    return index
+
+
+def first_due_on_or_after(recurring, day):
+    """First occurrence on or after `day`, or None once past end_date."""
+    due = occurrence(recurring, _occurrence_index_on_or_after(recurring, day))
+    if recurring.end_date and due > recurring.end_date:
+        return None
+    return due
+
+
+def _period_key(frequency, day):
+    if frequency == 'daily':
+        return day
+    if frequency == 'weekly':
+        return day.isocalendar()[:2]
+    if frequency == 'monthly':
+        return (day.year, day.month)
+    if frequency == 'quarterly':
+        return (day.year, (day.month - 1) // 3)
+    return day.year
+
+
+def _not_ended(today):
+    return db.or_(RecurringTransaction.end_date == None, RecurringTransaction.end_date >= today)
+
+
+def schedule_unscheduled(client_id, today):
+    """Sets next_due_date on recurrences that predate it (or were created without one).
+
+    Their last posting is taken from the newest journal entry with the same
+    description, found with one grouped query, and the next due date is the
+    first occurrence in a later period. Recurrences that never posted start
+    from today rather than back-filling their whole history, so ones that
+    ended before today have nothing left to post and are not selected.
+    """
+    unscheduled = RecurringTransaction.query.filter(
+        RecurringTransaction.client_id == client_id,
+        RecurringTransaction.next_due_date == None,
+        RecurringTransaction.last_posted_date == None,
+        _not_ended(today)
+    ).all()
+    if not unscheduled:
+        return 0
+    last_posted = dict(db.session.query(JournalEntries.description, db.func.max(JournalEntries.date)).filter(
+        JournalEntries.client_id == client_id,
+        JournalEntries.description.in_({r.description for r in unscheduled})
+    ).group_by(JournalEntries.description).all())
+
+    for recurring in unscheduled:
+        posted = last_posted.get(recurring.description)
+        if posted:
+            recurring.last_posted_date = posted
+            due = first_due_on_or_after(recurring, posted)
+            while due and _period_key(recurring.frequency, due) == _period_key(recurring.frequency, posted):
+                due = first_due_on_or_after(recurring, due + relativedelta(days=1))
+            recurring.next_due_date = due
+        else:
+            recurring.next_due_date = first_due_on_or_after(recurring, max(today, recurring.start_date))
+    return len(unscheduled)
+
+
+def post_due_recurring(client_id, today=None):
+    """Posts every occurrence due on or before `today`, catching up missed periods.
+
+    Selects only the due recurrences through the (next_due_date, client_id)
+    index and writes their journal entries with one bulk insert; the
+    caller commits. Returns the number of entries created.
+    """
+    today = today or date.today()
+    schedule_unscheduled(client_id, today)
+    due_recurrences = RecurringTransaction.query.filter(
+        RecurringTransaction.next_due_date <= today,
+        RecurringTransaction.client_id == client_id
+    ).all()
+
+    rows = []
+    for recurring in due_recurrences:
+        index = _occurrence_index_on_or_after(recurring, recurring.next_due_date)
+        due = occurrence(recurring, index)
+        while due <= today and not (recurring.end_date and due > recurring.end_date):
+            rows.append({
+                'date': due,
+                'description': recurring.description,
+                'debit_account_id': recurring.debit_account_id,
+                'credit_account_id': recurring.credit_account_id,
+                'amount': abs(recurring.amount),
+                'client_id': client_id,
+                'locked': False,
+                'is_accrual': False,
+                'is_reversing': False,
+                'status': 'posted',
+            })
+            recurring.last_posted_date = due
+            index += 1
+            due = occurrence(recurring, index)
+        recurring.next_due_date = None if recurring.end_date and due > recurring.end_date else due
+
+    if rows:
+        db.session.execute(insert(JournalEntries), rows)
+    return len(rows)
+
+
+def clients_with_due_recurring(today):
+    """Client ids that have something due (or not yet scheduled), so the job skips everyone else."""
+    return [client_id for client_id, in db.session.query(RecurringTransaction.client_id).filter(
+        db.or_(RecurringTransaction.next_due_date <= today,
+               db.and_(RecurringTransaction.next_due_date == None, RecurringTransaction.last_posted_date == None,
+                       _not_ended(today)))
+    ).distinct()]
@@ -0,0 +1,223 @@
+import math
+import re
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+from functools import lru_cache
+
+from app import db
+from app.models import Transaction, RecurringCandidate, RecurringDetectionState
+from app.money import to_cents, from_cents
+
+LOOKBACK_DAYS = 800          # a little over two years, enough to see yearly charges twice
+MIN_OCCURRENCES = 3
+AMOUNT_TOLERANCE = 0.10      # amounts within 10% (or $2) of each other are the same charge
+AMOUNT_TOLERANCE_CENTS = 200
+BUCKET_WIDTH = math.log(1.25)
+
+# (frequency, lowest median gap, highest median gap) in days
+FREQUENCY_RANGES = [
+    ('daily', 1, 1),
+    ('weekly', 6, 8),
+    ('monthly', 27, 33),
+    ('quarterly', 85, 95),
+    ('yearly', 355, 375),
+]
+
+_PREFIXES = re.compile(r'^(sq|tst|pos|ach|dd|paypal|pp|sp|debit card purchase|recurring payment|purchase)(\s*\*\s*|\s+)')
+_NOISE = re.compile(r'[#*]?\s*\d[\d\-/]*|[^a-z&\s]')
+
+
+@lru_cache(maxsize=65536)
+def normalize_merchant(description):
+    """Reduces a bank description to a stable merchant key.
+
+    'SQ *BLUE BOTTLE #0231', 'Sq*Blue Bottle 5581' -> 'blue bottle'
+    """
+    text = description.lower().strip()
+    text = _PREFIXES.sub('', text)
+    text = _NOISE.sub(' ', text)
+    tokens = text.split()
+    return ' '.join(tokens[:3])
+
+
+def _amount_bucket(cents):
+    magnitude = int(round(math.log(max(abs(cents), 1)) / BUCKET_WIDTH))
+    return magnitude if cents >= 0 else -magnitude - 1
+
+
+def _amount_clusters(rows):
+    """Splits one merchant's rows into groups of similar amounts (same sign, within tolerance)."""
+    rows = sorted(rows, key=lambda r: r[2])
+    clusters = []
+    current = []
+    for row in rows:
+        if current:
+            previous = current[-1][2]
+            tolerance = max(abs(previous) * AMOUNT_TOLERANCE, AMOUNT_TOLERANCE_CENTS)
+            if (row[2] >= 0) != (previous >= 0) or row[2] - previous > tolerance:
+                clusters.append(current)
+                current = []
+        current.append(row)
+    if current:
+        clusters.append(current)
+    return clusters
+
+
+def _classify(median_gap):
+    for frequency, low, high in FREQUENCY_RANGES:
+        if low <= median_gap <= high:
+            return frequency
+    return None
+
+
+def analyse_group(rows):
+    """Gap statistics for one (merchant, amount) group of (id, date, cents, description) rows.
+
+    Returns a dict of candidate fields, or None if the dates are not regular.
+    """
+    import numpy as np  # only detection needs numpy; importing it here keeps app startup light
+    # One charge per day; several same-day rows are splits or duplicates.
+    by_day = {}
+    for row in rows:
+        by_day.setdefault(row[1], row)
+    if len(by_day) < MIN_OCCURRENCES:
+        return None
+    days = np.array(sorted(by_day), dtype='datetime64[D]')
+    gaps = np.diff(days).astype(np.int64)
+    median_gap = float(np.median(gaps))
+    frequency = _classify(median_gap)
+    if not frequency:
+        return None
+    mad = float(np.median(np.abs(gaps - median_gap)))
+    if mad > max(1.0, median_gap * 0.1):
+        return None
+
+    cents = np.array([row[2] for row in by_day.values()], dtype=np.int64)
+    latest = max(by_day.values(), key=lambda r: r[1])
+    first_date, last_date = days[0].item(), days[-1].item()
+    regularity = 1.0 - min(mad / median_gap, 1.0)
+    support = min(len(days) / 6.0, 1.0)
+    return {
+        'description': latest[3],
+        'amount': from_cents(int(np.median(cents))),
+        'frequency': frequency,
+        'interval_days': median_gap,
+        'gap_mad_days': mad,
+        'occurrences': int(len(days)),
+        'first_date': first_date,
+        'last_date': last_date,
+        'next_expected_date': last_date + timedelta(days=int(round(median_gap))),
+        'confidence': round(regularity * support, 3),
+    }
+
+
+def _touched_merchant_rows(client_id, since_id, window_start):
+    """(merchant keys with transactions after since_id, {key: rows in the window}) for only those merchants.
+
+    Merchant keys are computed in Python, so the window's distinct
+    descriptions are mapped to keys first and only the rows whose
+    description belongs to a touched merchant are loaded.
+    """
+    window = (Transaction.client_id == client_id, Transaction.date >= window_start)
+    new_descriptions = {description for description, in db.session.query(Transaction.description).filter(
+        *window, Transaction.id > since_id).distinct()}
+    touched = {normalize_merchant(description) for description in new_descriptions} - {''}
+    if not touched:
+        return touched, {}
+    descriptions = [description for description, in db.session.query(Transaction.description).filter(*window).distinct()
+                    if normalize_merchant(description) in touched]
+
+    by_merchant = defaultdict(list)
+    rows = db.session.query(Transaction.id, Transaction.date, Transaction.amount, Transaction.description).filter(
+        *window, Transaction.description.in_(descriptions))
+    for transaction_id, transaction_date, amount, description in rows:
+        by_merchant[normalize_merchant(description)].append(
+            (transaction_id, transaction_date, to_cents(amount), description))
+    return touched, by_merchant
+
+
+def _retire_stale_candidates(candidates, detected):
+    """Closes the open candidates of re-analysed merchants that no longer describe a live charge.
+
+    Within one merchant and frequency, a candidate whose charges stopped
+    before the newest one's began was replaced by it (a price change into
+    another amount bucket) and becomes 'superseded'; one that is no longer
+    detected in the lookback window becomes 'expired'. Either reopens if it
+    is the newest again.
+    """
+    seen = set()
+    for group in detected.values():
+        newest = max(group, key=lambda c: c.last_date)
+        for candidate in group:
+            seen.add(candidate)
+            if candidate.last_date >= newest.first_date:
+                if candidate.status in ('superseded', 'expired'):
+                    candidate.status = 'open'
+            elif candidate.status == 'open':
+                candidate.status = 'superseded'
+    for candidate in candidates:
+        if candidate.status == 'open' and candidate not in seen:
+            candidate.status = 'expired'
+
+
+def detect_recurring_for_client(client_id, today=None):
+    """Refreshes the client's persisted recurring candidates.
+
+    Does nothing when no transactions arrived since the last run; otherwise
+    only the transactions of merchants that received new ones are loaded
+    and re-analysed, and their open candidates that a new price replaced or
+    that stopped are closed. Dismissed and approved candidates keep their
+    status, and a dismissal covers the merchant at that frequency, so a price
+    change that moves the charge to another amount bucket stays dismissed.
+    The caller commits. Returns the number of candidates written.
+    """
+    today = today or date.today()
+    state = db.session.get(RecurringDetectionState, client_id)
+    if not state:
+        state = RecurringDetectionState(client_id=client_id, last_transaction_id=0)
+        db.session.add(state)
+    latest_id = db.session.query(db.func.max(Transaction.id)).filter(Transaction.client_id == client_id).scalar() or 0
+    # Candidates whose charges all fell out of the lookback window are no longer recurring.
+    RecurringCandidate.query.filter(
+        RecurringCandidate.client_id == client_id, RecurringCandidate.status == 'open',
+        RecurringCandidate.last_date < today - timedelta(days=LOOKBACK_DAYS)
+    ).update({'status': 'expired'}, synchronize_session=False)
+    if latest_id <= state.last_transaction_id:
+        state.last_run_at = datetime.utcnow()
+        return 0
+
+    touched, by_merchant = _touched_merchant_rows(client_id, state.last_transaction_id,
+                                                  today - timedelta(days=LOOKBACK_DAYS))
+
+    existing = {}
+    dismissed = set()
+    if touched:
+        for c in RecurringCandidate.query.filter(RecurringCandidate.client_id == client_id,
+                                                 RecurringCandidate.merchant_key.in_(touched)):
+            existing[(c.merchant_key, c.amount_bucket)] = c
+            if c.status == 'dismissed':
+                dismissed.add((c.merchant_key, c.frequency))
+
+    written = 0
+    detected = defaultdict(list)
+    for key in touched:
+        for cluster in _amount_clusters(by_merchant[key]):
+            fields = analyse_group(cluster)
+            if not fields:
+                continue
+            bucket = _amount_bucket(to_cents(fields['amount']))
+            candidate = existing.get((key, bucket))
+            if not candidate:
+                status = 'dismissed' if (key, fields['frequency']) in dismissed else 'open'
+                candidate = RecurringCandidate(client_id=client_id, merchant_key=key, amount_bucket=bucket, status=status)
+                db.session.add(candidate)
+                existing[(key, bucket)] = candidate
+            for name, value in fields.items():
+                setattr(candidate, name, value)
+            detected[(key, candidate.frequency)].append(candidate)
+            written += 1
+    _retire_stale_candidates(existing.values(), detected)
+
+    state.last_transaction_id = latest_id
+    state.last_run_at = datetime.utcnow()
+    return written
@@ -0,0 +1,181 @@
+import dataclasses
+import decimal
+import gzip
+import hashlib
+import json
+import os
+import threading
+import uuid
+from datetime import date, datetime, timedelta
+
+import click
+from flask import request
+from flask.cli import with_appcontext
+from flask.json.provider import DefaultJSONProvider
+from jinja2 import FileSystemBytecodeCache
+
+try:
+    import orjson
+except ImportError:  # plain json is used when orjson is not installed
+    orjson = None
+
+try:
+    import brotli
+except ImportError:  # gzip only
+    brotli = None
+
+COMPRESSIBLE_MIMETYPES = {
+    'text/html', 'text/css', 'text/plain', 'text/csv', 'text/javascript', 'application/javascript',
+    'application/json', 'image/svg+xml',
+}
+# Fingerprinted static URLs never change content, so browsers may keep them for a year.
+STATIC_MAX_AGE = 365 * 24 * 3600
+
+
+def _default(obj):
+    """Types neither serializer handles natively, as the old CustomJSONEncoder and Flask's default did."""
+    if isinstance(obj, (datetime, date)):
+        return obj.isoformat()
+    if isinstance(obj, timedelta):
+        return str(obj)
+    if isinstance(obj, (decimal.Decimal, uuid.UUID)):
+        return str(obj)
+    if dataclasses.is_dataclass(obj) and not isinstance(obj, type):
+        return dataclasses.asdict(obj)
+    if hasattr(obj, '__html__'):
+        return str(obj.__html__())
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    """app.json: orjson when installed, otherwise the standard library.
+
+    Used by jsonify, request.get_json, the |tojson template filter and
+    routes that pre-serialize chart data. Dates and datetimes are ISO 8601.
+    """
+
+    def _orjson_option(self, kwargs):
+        """orjson flags equivalent to the json.dumps arguments Flask and Jinja pass, or None if there are none."""
+        if orjson is None or not set(kwargs) <= {'separators', 'indent', 'sort_keys'} or kwargs.get('indent') not in (None, 2):
+            return None
+        option = orjson.OPT_NON_STR_KEYS
+        if kwargs.get('indent'):
+            option |= orjson.OPT_INDENT_2
+        if kwargs.get('sort_keys'):
+            option |= orjson.OPT_SORT_KEYS
+        return option
+
+    def dumps(self, obj, **kwargs):
+        option = self._orjson_option(kwargs)
+        if option is not None:
+            return orjson.dumps(obj, default=_default, option=option).decode()
+        kwargs.setdefault('default', _default)
+        return json.dumps(obj, **kwargs)
+
+    def loads(self, s, **kwargs):
+        if orjson is not None and not kwargs:
+            return orjson.loads(s)
+        return json.loads(s, **kwargs)
+
+
+class StaticFingerprints:
+    """Short content hashes of static files, recomputed when a file's mtime changes."""
+
+    def __init__(self, static_folder):
+        self.static_folder = static_folder
+        self._hashes = {}
+        self._lock = threading.Lock()
+
+    def get(self, filename):
+        path = os.path.join(self.static_folder, filename)
+        try:
+            mtime = os.stat(path).st_mtime
+        except OSError:
+            return None
+        with self._lock:
+            cached = self._hashes.get(filename)
+        if cached and cached[0] == mtime:
+            return cached[1]
+        with open(path, 'rb') as f:
+            digest = hashlib.md5(f.read()).hexdigest()[:12]
+        with self._lock:
+            self._hashes[filename] = (mtime, digest)
+        return digest
+
+
+def compress_response(response, min_size, gzip_level=6, brotli_quality=5):
+    """Compresses a finished response body with brotli or gzip, if the client accepts it and it is worth it."""
+    if (response.status_code != 200 or 'Content-Encoding' in response.headers
+            or response.mimetype not in COMPRESSIBLE_MIMETYPES):
+        return response
+    # Generated streams (server-sent events) are left alone; files sent with send_file are read below.
+    if response.is_streamed and not response.direct_passthrough:
+        return response
+    if brotli is not None and request.accept_encodings['br']:
+        encoding = 'br'
+    elif request.accept_encodings['gzip']:
+        encoding = 'gzip'
+    else:
+        return response
+
+    response.direct_passthrough = False
+    data = response.get_data()
+    if len(data) < min_size:
+        return response
+    if encoding == 'br':
+        data = brotli.compress(data, quality=brotli_quality)
+    else:
+        data = gzip.compress(data, compresslevel=gzip_level)
+    response.set_data(data)
+    response.headers['Content-Encoding'] = encoding
+    response.vary.add('Accept-Encoding')
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+    return response
+
+
+def init_app(app):
+    """Sets up JSON, the template bytecode cache, static fingerprints and response compression."""
+    app.json = FastJSONProvider(app)
+
+    cache_dir = app.config['JINJA_BYTECODE_CACHE_DIR']
+    if cache_dir:
+        os.makedirs(cache_dir, exist_ok=True)
+        app.jinja_env.bytecode_cache = FileSystemBytecodeCache(cache_dir)
+
+    fingerprints = StaticFingerprints(app.static_folder)
+    app.extensions['static_fingerprints'] = fingerprints
+
+    @app.url_defaults
+    def fingerprint_static_urls(endpoint, values):
+        if endpoint == 'static' and 'filename' in values and 'v' not in values:
+            digest = fingerprints.get(values['filename'])
+            if digest:
+                values['v'] = digest
+
+    @app.after_request
+    def finish_response(response):
+        if request.endpoint == 'static' and request.args.get('v') and response.status_code in (200, 304):
+            response.cache_control.public = True
+            response.cache_control.max_age = STATIC_MAX_AGE
+            response.cache_control.immutable = True
+            response.cache_control.no_cache = None
+        if app.config['RESPONSE_COMPRESSION']:
+            response = compress_response(response, app.config['COMPRESS_MIN_SIZE'])
+        return response
+
+
+@click.command('compile-templates')
+@with_appcontext
+def compile_templates():
+    """Compiles every template into the bytecode cache, so no worker compiles on its first requests."""
+    from flask import current_app
+    env = current_app.jinja_env
+    if env.bytecode_cache is None:
+        print("JINJA_BYTECODE_CACHE_DIR is not set; nothing to do.")
+        return
+    names = env.list_templates(filter_func=lambda name: name.endswith('.html'))
+    for name in names:
+        env.get_template(name)
+    print(f"Compiled {len(names)} templates into {current_app.config['JINJA_BYTECODE_CACHE_DIR']}.")
@@ -0,0 +1,11 @@
+from flask import g, has_request_context
+
+
+def memoized(name, key, compute):
+    """compute() once per request for each key; outside a request it just runs."""
+    if not has_request_context():
+        return compute()
+    cache = g.setdefault(name, {})
+    if key not in cache:
+        cache[key] = compute()
+    return cache[key]
@@ -1,6 +1,7 @@
 from flask import Blueprint, render_template, request, redirect, url_for, session, flash
 from app import db
 from app.models import Account
+from app.account_tree import load_account_tree
 from app.utils import get_account_choices
 
 accounts_bp = Blueprint('accounts', __name__)
@@ -9,25 +10,15 @@ accounts_bp = Blueprint('accounts', __name__)
 def accounts():
     account_choices = get_account_choices(session['client_id'])
     
-    # Use a recursive function to build the list in order
-    def get_accounts_recursive(parent_id, level):
-        accounts = Account.query.filter_by(client_id=session['client_id'], parent_id=parent_id).order_by(Account.name).all()
-        acc_list = []
-        for account in accounts:
-            is_parent = account.children.first() is not None
-            acc_list.append({
-                'id': account.id,
-                'name': account.name,
-                'type': account.type,
-                'category': account.category,
-                'parent_id': account.parent_id,
-                'level': level,
-                'is_parent': is_parent
-            })
-            acc_list.extend(get_accounts_recursive(account.id, level + 1))
-        return acc_list
-
-    accounts_data = get_accounts_recursive(None, 0)
+    accounts_data = [{
+        'id': node.id,
+        'name': node.name,
+        'type': node.type,
+        'category': node.category,
+        'parent_id': node.parent_id,
+        'level': node.level,
+        'is_parent': bool(node.children)
+    } for node in load_account_tree(session['client_id']).ordered()]
 
     return render_template('accounts.html', 
                            account_choices=account_choices, 
@@ -74,8 +65,10 @@ def edit_account(account_id):
             flash('An account cannot be its own parent.', 'danger')
             return redirect(url_for('accounts.edit_account', account_id=account_id))
 
-        # A more complex check would be needed to prevent circular dependencies
-        # (e.g., setting parent to one of its own children), but this covers the direct case.
+        # Or as a child of one of its own sub-accounts
+        if parent_id in load_account_tree(session['client_id']).descendant_ids(account.id):
+            flash('An account cannot be moved under one of its own sub-accounts.', 'danger')
+            return redirect(url_for('accounts.edit_account', account_id=account_id))
 
         if Account.query.filter(Account.name == name, Account.id != account_id, Account.client_id == session['client_id']).first():
             flash(f'Account "{name}" already exists.', 'danger')
@@ -1,23 +1,25 @@
-from flask import Blueprint, render_template, request, redirect, url_for, session
-from app import db
+from flask import Blueprint, render_template, request, redirect, url_for, session, current_app
+from app import db, budgeting
 from app.models import JournalEntries, Account, Budget
 from datetime import datetime, timedelta
-import json
 from dateutil.relativedelta import relativedelta
-from app.utils import get_account_tree, get_budgets_actual_spent, get_num_periods
+from app.utils import get_account_tree, get_budgets_actual_spent, get_num_periods, get_budget_periods, get_miscellaneous_historical_performance
 
 dashboard_bp = Blueprint('dashboard', __name__)
 
-def get_performance_data_recursive(budget, start_date, end_date):
+def get_performance_data_recursive(budget, start_date, end_date, tree):
     performance_data = []
     all_budgets_for_summary = []
 
     # Get performance data for the current budget
     num_periods = get_num_periods(start_date, end_date, budget.period)
-    total_budgeted = budget.total_budgeted * num_periods
+    total_budgeted = tree.total_budgeted(budget.id) * num_periods
     
-    actual_spendings = get_budgets_actual_spent([budget.id], start_date, end_date)
-    actual_spent = actual_spendings.get(budget.id, {'actual_spent': 0.0})['actual_spent']
+    if budget.is_miscellaneous:
+        actual_spent = budgeting.miscellaneous_spending(budget.client_id, start_date, end_date)['uncovered']
+    else:
+        actual_spendings = get_budgets_actual_spent([budget.id], start_date, end_date)
+        actual_spent = actual_spendings.get(budget.id, {'actual_spent': 0.0})['actual_spent']
     difference = total_budgeted - actual_spent
 
     num_days = (end_date - start_date).days + 1
@@ -34,61 +36,19 @@ def get_performance_data_recursive(budget, start_date, end_date):
         'id': budget.id
     })
     
-    history = []
-    
-    # Calculate the number of periods based on the dashboard's date range
-    num_periods_to_display = get_num_periods(start_date, end_date, budget.period)
-
-    # Iterate backwards from the dashboard's end_date
-    current_end_of_period = end_date
-    for i in range(num_periods_to_display):
-        if budget.period == 'monthly':
-            period_start = current_end_of_period.replace(day=1)
-            period_end = current_end_of_period
-            period_name = period_start.strftime("%B %Y")
-            current_end_of_period = period_start - timedelta(days=1) # Move to end of previous month
-        elif budget.period == 'quarterly':
-            # Calculate start and end of current quarter
-            current_quarter_start_month = (current_end_of_period.month - 1) // 3 * 3 + 1
-            period_start = current_end_of_period.replace(month=current_quarter_start_month, day=1)
-            period_end = (period_start + relativedelta(months=3)) - timedelta(days=1)
-            period_name = f"Q{(current_quarter_start_month - 1) // 3 + 1} {current_end_of_period.year}"
-            current_end_of_period = period_start - timedelta(days=1) # Move to end of previous quarter
-        else: # yearly
-            period_start = current_end_of_period.replace(month=1, day=1)
-            period_end = current_end_of_period.replace(month=12, day=31)
-            period_name = str(current_end_of_period.year)
-            current_end_of_period = period_start - timedelta(days=1) # Move to end of previous year
-
-        # Ensure the period is within the dashboard's overall start_date and end_date
-        effective_period_start = max(period_start, start_date)
-        effective_period_end = min(period_end, end_date)
-
-        if budget.is_miscellaneous:
-            total_expenses = db.session.query(db.func.sum(JournalEntries.amount)).join(Account, JournalEntries.debit_account_id == Account.id).filter(
-                Account.type == 'Expense',
-                JournalEntries.client_id == budget.client_id,
-                JournalEntries.date >= effective_period_start,
-                JournalEntries.date <= effective_period_end
-            ).scalar() or 0
-
-            non_misc_budgets = Budget.query.filter(Budget.client_id == budget.client_id, Budget.is_miscellaneous == False).all()
-            non_misc_budget_ids = [b.id for b in non_misc_budgets]
-            non_misc_actual_spendings = get_budgets_actual_spent(non_misc_budget_ids, effective_period_start, effective_period_end)
-            total_non_misc_spent = sum(s['actual_spent'] for s in non_misc_actual_spendings.values())
-
-            hist_actual_spent = total_expenses - total_non_misc_spent
-        else:
-            hist_actual_spendings = get_budgets_actual_spent([budget.id], effective_period_start, effective_period_end)
+    if budget.is_miscellaneous:
+        history = get_miscellaneous_historical_performance(budget, start_date, end_date)
+    else:
+        history = []
+        for period_name, period_start, period_end in get_budget_periods(budget.period, start_date, end_date):
+            hist_actual_spendings = get_budgets_actual_spent([budget.id], period_start, period_end)
             hist_actual_spent = hist_actual_spendings.get(budget.id, {'actual_spent': 0.0})['actual_spent']
-
-        history.append({
-            'period_name': period_name,
-            'budgeted': budget.total_budgeted,
-            'actual': hist_actual_spent,
-            'difference': budget.total_budgeted - hist_actual_spent
-        })
-    history.reverse()
+            history.append({
+                'period_name': period_name,
+                'budgeted': tree.total_budgeted(budget.id),
+                'actual': hist_actual_spent,
+                'difference': tree.total_budgeted(budget.id) - hist_actual_spent
+            })
 
     performance_data.append({
         'id': budget.id,
@@ -103,11 +63,11 @@ def get_performance_data_recursive(budget, start_date, end_date):
         'history': history,
         'level': 0, # This will be updated later
         'parent_id': budget.parent_id,
-        'has_children': bool(budget.children.first())
+        'has_children': bool(tree.children(budget.id))
     })
     
-    for child in budget.children:
-        child_performance_data, child_summary_data = get_performance_data_recursive(child, start_date, end_date)
+    for child in tree.children(budget.id):
+        child_performance_data, child_summary_data = get_performance_data_recursive(child, start_date, end_date, tree)
         performance_data.extend(child_performance_data)
         all_budgets_for_summary.extend(child_summary_data)
         
@@ -163,9 +123,9 @@ def dashboard():
 
     all_months = sorted(list(set(income_by_month.keys()) | set(expense_by_month.keys())))
 
-    bar_chart_labels = json.dumps(all_months)
-    bar_chart_income = json.dumps([income_by_month.get(m, 0) for m in all_months])
-    bar_chart_expense = json.dumps([expense_by_month.get(m, 0) for m in all_months])
+    bar_chart_labels = current_app.json.dumps(all_months)
+    bar_chart_income = current_app.json.dumps([income_by_month.get(m, 0) for m in all_months])
+    bar_chart_expense = current_app.json.dumps([expense_by_month.get(m, 0) for m in all_months])
 
     # Expense breakdown for the selected period for the pie chart
     expense_breakdown_query = db.session.query(
@@ -182,8 +142,8 @@ def dashboard():
 
     expense_breakdown = expense_breakdown_query.all()
 
-    pie_chart_labels = json.dumps([item.category for item in expense_breakdown])
-    pie_chart_data = json.dumps([item.total for item in expense_breakdown])
+    pie_chart_labels = current_app.json.dumps([item.category for item in expense_breakdown])
+    pie_chart_data = current_app.json.dumps([item.total for item in expense_breakdown])
 
     # Income breakdown for the selected period for the pie chart
     income_breakdown_query = db.session.query(
@@ -200,8 +160,8 @@ def dashboard():
 
     income_breakdown = income_breakdown_query.all()
 
-    income_pie_chart_labels = json.dumps([item.category for item in income_breakdown])
-    income_pie_chart_data = json.dumps([item.total for item in income_breakdown])
+    income_pie_chart_labels = current_app.json.dumps([item.category for item in income_breakdown])
+    income_pie_chart_data = current_app.json.dumps([item.total for item in income_breakdown])
 
     # KPIs for the selected period
     income_this_period = db.session.query(db.func.sum(JournalEntries.amount)).join(Account, JournalEntries.credit_account_id == Account.id).filter(
@@ -252,46 +212,18 @@ def dashboard():
         liability_balances[account.name] = account.opening_balance + credits - debits
 
     # Budget performance data
-    budgets = Budget.query.filter_by(client_id=session['client_id'], parent_id=None).all()
+    tree = budgeting.load_budget_tree(client_id)
     performance_data = []
     all_budgets_for_summary = []
-    misc_budget = None
-    non_misc_budgets = []
-    for budget in budgets:
-        if budget.is_miscellaneous:
-            misc_budget = budget
-        else:
-            non_misc_budgets.append(budget)
-
-    for budget in budgets:
-        child_performance_data, child_summary_data = get_performance_data_recursive(budget, start_date, end_date)
+    for budget in tree.roots:
+        child_performance_data, child_summary_data = get_performance_data_recursive(budget, start_date, end_date, tree)
         performance_data.extend(child_performance_data)
         all_budgets_for_summary.extend(child_summary_data)
 
-    if misc_budget:
-        non_misc_budget_ids = [b.id for b in non_misc_budgets]
-        non_misc_actual_spendings = get_budgets_actual_spent(non_misc_budget_ids, start_date, end_date)
-        total_non_misc_spent = sum(s['actual_spent'] for s in non_misc_actual_spendings.values())
-        misc_actual_spent = m_expenses - total_non_misc_spent
-
-        for p_data in performance_data:
-            if p_data['id'] == misc_budget.id:
-                p_data['actual'] = misc_actual_spent
-                p_data['difference'] = p_data['budgeted'] - misc_actual_spent
-                p_data['avg_daily_spent'] = misc_actual_spent / ((end_date - start_date).days + 1) if (end_date - start_date).days + 1 > 0 else 0
-                p_data['avg_monthly_spent'] = misc_actual_spent / get_num_periods(start_date, end_date, 'monthly') if get_num_periods(start_date, end_date, 'monthly') > 0 else 0
-
-
-
     # Remove duplicates from all_budgets_for_summary
     all_budgets_for_summary = [dict(t) for t in {tuple(d.items()) for d in all_budgets_for_summary}]
 
     # Calculate Overall Budget Health
-    all_transaction_ids = set()
-    for b in all_budgets_for_summary:
-        budget_spendings = get_budgets_actual_spent([b['id']], start_date, end_date)
-        all_transaction_ids.update(budget_spendings.get(b['id'], {'transaction_ids': set()})['transaction_ids'])
-
     overall_budgeted = sum(b['budgeted'] for b in all_budgets_for_summary)
     overall_actual = m_expenses
     overall_difference = overall_budgeted - overall_actual
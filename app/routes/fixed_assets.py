@@ -2,6 +2,7 @@ from flask import Blueprint, render_template, request, redirect, url_for, sessio
 from app import db
 from app.models import FixedAsset, Depreciation, Account, JournalEntries
 from app.utils import log_audit
+from app.depreciation import DEPRECIATION_METHODS, schedule_rows, posted_months
 from datetime import datetime
 
 fixed_assets_bp = Blueprint('fixed_assets', __name__)
@@ -15,19 +16,22 @@ def fixed_assets():
 def add_fixed_asset():
     if request.method == 'POST':
         name = request.form['name']
-        description = request.form['description']
         purchase_date = datetime.strptime(request.form['purchase_date'], '%Y-%m-%d').date()
         cost = abs(float(request.form['cost']))
         useful_life = int(request.form['useful_life'])
         salvage_value = float(request.form['salvage_value'])
+        depreciation_method = request.form.get('depreciation_method', 'straight-line')
+        if depreciation_method not in dict(DEPRECIATION_METHODS):
+            flash(f'Unknown depreciation method: {depreciation_method}.', 'danger')
+            return redirect(url_for('fixed_assets.add_fixed_asset'))
 
         new_asset = FixedAsset(
             name=name, 
-            description=description, 
             purchase_date=purchase_date, 
-            cost=cost, 
+            purchase_price=cost, 
             useful_life=useful_life, 
             salvage_value=salvage_value, 
+            depreciation_method=depreciation_method,
             client_id=session['client_id']
         )
         db.session.add(new_asset)
@@ -50,7 +54,7 @@ def add_fixed_asset():
 
         flash('Fixed asset added successfully.', 'success')
         return redirect(url_for('fixed_assets.fixed_assets'))
-    return render_template('add_fixed_asset.html')
+    return render_template('add_fixed_asset.html', depreciation_methods=DEPRECIATION_METHODS)
 
 @fixed_assets_bp.route('/delete_fixed_asset/<int:asset_id>')
 def delete_fixed_asset(asset_id):
@@ -71,9 +75,8 @@ def delete_fixed_asset(asset_id):
     Depreciation.query.filter_by(fixed_asset_id=asset.id).delete()
 
     db.session.delete(asset)
-    db.session.commit()
-
     log_audit(f'Deleted fixed asset: {asset.name}')
+    db.session.commit()
 
     flash('Fixed asset and all associated entries deleted successfully.', 'success')
     return redirect(url_for('fixed_assets.fixed_assets'))
@@ -84,19 +87,7 @@ def depreciation_schedule(asset_id):
     if asset.client_id != session['client_id']:
         return "Unauthorized", 403
 
-    depreciation_entries = Depreciation.query.filter_by(fixed_asset_id=asset.id).order_by(Depreciation.date).all()
-    schedule = []
-    accumulated_depreciation = 0
-    book_value = asset.cost
-
-    for entry in depreciation_entries:
-        accumulated_depreciation += entry.amount
-        book_value -= entry.amount
-        schedule.append({
-            'date': entry.date.strftime('%Y-%m-%d'),
-            'amount': entry.amount,
-            'accumulated_depreciation': accumulated_depreciation,
-            'book_value': book_value
-        })
+    posted = posted_months(asset.client_id, [asset.id]).get(asset.id, set())
+    schedule = schedule_rows(asset, posted)
 
     return render_template('depreciation_schedule.html', asset=asset, schedule=schedule)
@@ -4,6 +4,7 @@ from app.models import JournalEntries, Account, Transaction, Category
 from datetime import datetime
 from sqlalchemy import func
 from app.utils import get_account_choices, log_audit, update_all_balances
+from app.money import Money, to_cents
 
 journal_bp = Blueprint('journal', __name__)
 
@@ -62,13 +63,13 @@ def journal():
     seen = set()
     duplicates = set()
     for entry in entries:
-        key = (entry.date, entry.description.strip(), round(entry.amount, 2))
+        key = (entry.date, entry.description.strip(), to_cents(entry.amount))
         if key in seen:
             duplicates.add(key)
         seen.add(key)
 
     for entry in entries:
-        key = (entry.date, entry.description.strip(), round(entry.amount, 2))
+        key = (entry.date, entry.description.strip(), to_cents(entry.amount))
         if key in duplicates:
             entry.is_duplicate = True
         else:
@@ -88,8 +89,8 @@ def add_entry():
     new_entry = JournalEntries(date=date, description=description, debit_account_id=debit_account_id, credit_account_id=credit_account_id, amount=amount, category=category, notes=notes, client_id=session['client_id'])
     db.session.add(new_entry)
     update_all_balances(session['client_id'])
-    db.session.commit()
     log_audit(f'Added journal entry: {new_entry.description}')
+    db.session.commit()
     flash('Journal entry added successfully.', 'success')
     return redirect(url_for('journal.journal'))
 
@@ -115,8 +116,8 @@ def edit_entry(entry_id):
             entry.category = None
         entry.notes = request.form.get('notes')
         update_all_balances(session['client_id'])
-        db.session.commit()
         log_audit(f'Edited journal entry: {entry.description}')
+        db.session.commit()
         flash('Journal entry updated successfully.', 'success')
         return redirect(url_for('journal.journal'))
     else:
@@ -142,7 +143,7 @@ def delete_entry(entry_id):
             Transaction.client_id == session['client_id'],
             Transaction.date == entry.date,
             Transaction.description == entry.description,
-            func.abs(Transaction.amount) == entry.amount
+            func.abs(Transaction.amount, type_=Money()) == entry.amount
         ).first()
         if transaction:
             db.session.delete(transaction)
@@ -287,7 +288,7 @@ def delete_duplicate_journal_entries():
     seen = {}
     duplicates_to_delete = []
     for entry in all_entries:
-        key = (entry.date, entry.description.strip(), round(entry.amount, 2))
+        key = (entry.date, entry.description.strip(), to_cents(entry.amount))
         if key in seen:
             duplicates_to_delete.append(entry.id)
         else:
@@ -1,8 +1,10 @@
-from flask import Blueprint, render_template, session, redirect, url_for, request, flash
+from flask import Blueprint, render_template, session, redirect, url_for, request, flash, current_app, Response
 from flask_login import login_required, current_user, login_user, logout_user
 from app.models import Client, Notification, User
 from flask import jsonify
 from app import db
+from app.notifications import notify, client_user_ids, wait_for_inbox, mark_all_read
+from app import events
 
 main_bp = Blueprint('main', __name__)
 
@@ -49,8 +51,7 @@ def add_notification():
     if request.method == 'POST':
         message = request.form.get('message')
         if message:
-            notification = Notification(message=message)
-            db.session.add(notification)
+            notify(client_user_ids(session['client_id']), message)
             db.session.commit()
             flash('Notification added successfully!', 'success')
             return redirect(url_for('main.add_notification'))
@@ -58,5 +59,28 @@ def add_notification():
 
 @main_bp.route('/notifications')
 def notifications():
-    notifications = Notification.query.filter_by(is_read=False).order_by(Notification.created_at.desc()).all()
-    return jsonify([{'id': n.id, 'message': n.message, 'created_at': n.created_at} for n in notifications])
+    """The current user's unread notifications newer than ?since=<cursor>; ?wait=<seconds> long-polls."""
+    since = request.args.get('since', 0, type=int)
+    if not current_user.is_authenticated:
+        return jsonify({'items': [], 'unread': 0, 'cursor': since})
+    wait = max(0, min(request.args.get('wait', 0, type=int), current_app.config['NOTIFICATION_LONG_POLL_SECONDS']))
+    return jsonify(wait_for_inbox(current_user.id, since, wait))
+
+@main_bp.route('/notifications/read_all', methods=['POST'])
+def read_all_notifications():
+    if current_user.is_authenticated:
+        mark_all_read(current_user.id)
+        db.session.commit()
+    return jsonify({'success': True})
+
+@main_bp.route('/events')
+def event_stream():
+    """Server-sent events for the current client: sync/import progress, balance and data changes."""
+    last_id = request.headers.get('Last-Event-ID', type=int)
+    broker = events.get_broker()
+    client_id = session['client_id']
+    # The stream can stay open for minutes; don't hold a database connection meanwhile.
+    db.session.close()
+    return Response(events.stream(broker, client_id, last_id, current_app.config['EVENT_STREAM_SECONDS']),
+                    mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
@@ -1,6 +1,9 @@
 from flask import Blueprint, render_template, request, flash, redirect, url_for, session, jsonify
+from flask_login import current_user
 from app import db
-from app.models import NotificationRule, Notification
+from app.models import NotificationRule, Notification, Category
+from app.notifications import RULE_TYPES
+from app.utils import get_account_choices
 
 notifications_bp = Blueprint('notifications', __name__)
 
@@ -11,13 +14,21 @@ def notification_rules():
         criteria_type = request.form.get('criteria_type')
         criteria_value = request.form.get('criteria_value')
         notification_method = request.form.get('notification_method')
+        category = request.form.get('category') or None
+        account_id = request.form.get('account_id', type=int)
 
-        if name and criteria_type and criteria_value and notification_method:
+        if criteria_type == 'category_spending' and not category:
+            flash('Choose a category for a category spending rule.', 'danger')
+        elif criteria_type == 'balance_below' and not account_id:
+            flash('Choose an account for a balance rule.', 'danger')
+        elif name and criteria_type in RULE_TYPES and criteria_value and notification_method:
             rule = NotificationRule(
                 name=name,
                 criteria_type=criteria_type,
                 criteria_value=float(criteria_value),
                 notification_method=notification_method,
+                category=category if criteria_type == 'category_spending' else None,
+                account_id=account_id if criteria_type == 'balance_below' else None,
                 client_id=session['client_id']
             )
             db.session.add(rule)
@@ -26,7 +37,9 @@ def notification_rules():
             return redirect(url_for('notifications.notification_rules'))
 
     rules = NotificationRule.query.filter_by(client_id=session['client_id']).all()
-    return render_template('notification_rules.html', rules=rules)
+    categories = Category.query.filter_by(client_id=session['client_id']).order_by(Category.name).all()
+    return render_template('notification_rules.html', rules=rules, rule_types=RULE_TYPES, categories=categories,
+                           accounts=get_account_choices(session['client_id']))
 
 @notifications_bp.route('/notification_rules/delete/<int:rule_id>', methods=['POST'])
 def delete_notification_rule(rule_id):
@@ -42,8 +55,8 @@ def delete_notification_rule(rule_id):
 @notifications_bp.route('/delete/<int:notification_id>', methods=['DELETE'])
 def delete_notification(notification_id):
     notification = Notification.query.get(notification_id)
-    if notification:
+    if notification and current_user.is_authenticated and notification.user_id == current_user.id:
         db.session.delete(notification)
         db.session.commit()
         return jsonify({'success': True})
-    return jsonify({'success': False}), 404
\ No newline at end of file
+    return jsonify({'success': False}), 404
@@ -2,22 +2,7 @@ from flask import Blueprint, render_template, request, redirect, url_for, sessio
 from app import db
 from app.models import PlaidItem, PlaidAccount, PendingPlaidLink, Account, Transaction, Client
 from app.utils import update_all_balances
-import plaid
-from plaid.api import plaid_api
-from plaid.model.products import Products
-from plaid.model.country_code import CountryCode
-from plaid.model.link_token_create_request import LinkTokenCreateRequest
-from plaid.model.link_token_create_request_user import LinkTokenCreateRequestUser
-from plaid.model.link_token_get_request import LinkTokenGetRequest
-from plaid.model.link_token_create_request_update import LinkTokenCreateRequestUpdate
-from plaid.model.item_public_token_exchange_request import ItemPublicTokenExchangeRequest
-from plaid.model.item_remove_request import ItemRemoveRequest
-from plaid.model.webhook_verification_key_get_request import WebhookVerificationKeyGetRequest
-from plaid.model.transactions_get_request import TransactionsGetRequest
-from plaid.model.transactions_get_request_options import TransactionsGetRequestOptions
-from plaid.model.transactions_sync_request import TransactionsSyncRequest
-from plaid.model.accounts_get_request import AccountsGetRequest
-from plaid.model.accounts_balance_get_request import AccountsBalanceGetRequest
+from app import events, plaid_balances, plaid_backfill
 import os
 import json
 from datetime import datetime, timedelta
@@ -30,6 +15,7 @@ import hashlib
 
 def verify_plaid_webhook(request):
     """Verifies a Plaid webhook request."""
+    import plaid
     # Get the JWT from the Plaid-Verification header
     jwt_token = request.headers.get('Plaid-Verification')
     if not jwt_token:
@@ -40,15 +26,12 @@ def verify_plaid_webhook(request):
         jwt_header = jwt.get_unverified_header(jwt_token)
         key_id = jwt_header['kid']
 
-        # Fetch the corresponding JWK from Plaid
-        response = current_app.plaid_client.webhook_verification_key_get(
-            WebhookVerificationKeyGetRequest(key_id=key_id)
-        )
-        jwk = response['key']
+        # The corresponding JWK, fetched from Plaid only on a cache miss
+        jwk = current_app.plaid_client.webhook_key(key_id)
 
         # Verify the JWT signature
         algorithm = jwt.get_algorithm_by_name('ES256')
-        public_key = algorithm.from_jwk(json.dumps(jwk.to_dict()))
+        public_key = algorithm.from_jwk(json.dumps(jwk, default=str))
         decoded_jwt = jwt.decode(jwt_token, public_key, algorithms=['ES256'], options={"verify_aud": False})
 
         # Check the timestamp
@@ -115,6 +98,11 @@ def plaid_oauth_return():
 
 @plaid_bp.route('/api/create_link_token', methods=['POST'])
 def create_link_token():
+    import plaid
+    from plaid.model.country_code import CountryCode
+    from plaid.model.link_token_create_request import LinkTokenCreateRequest
+    from plaid.model.link_token_create_request_user import LinkTokenCreateRequestUser
+    from plaid.model.products import Products
     current_app.logger.info("--- create_link_token: start ---")
     try:
         client_id = session['client_id']  # will 400/KeyError if missing; fine since /plaid protects it
@@ -152,6 +140,11 @@ def create_link_token():
 
 @plaid_bp.route('/api/generate_hosted_link/<int:client_id>', methods=['POST'])
 def generate_hosted_link(client_id):
+    import plaid
+    from plaid.model.country_code import CountryCode
+    from plaid.model.link_token_create_request import LinkTokenCreateRequest
+    from plaid.model.link_token_create_request_user import LinkTokenCreateRequestUser
+    from plaid.model.products import Products
     # Ensure the current user has access to this client
     if session.get('client_id') != client_id:
         return "Unauthorized", 403
@@ -190,6 +183,9 @@ def generate_hosted_link(client_id):
 
 @plaid_bp.route('/api/create_link_token_for_update', methods=['POST'])
 def create_link_token_for_update():
+    import plaid
+    from plaid.model.country_code import CountryCode
+    from plaid.model.link_token_create_request import LinkTokenCreateRequest
     plaid_item_id = request.json['plaid_item_id']
     item = PlaidItem.query.get_or_404(plaid_item_id)
     if item.client_id != session['client_id']:
@@ -209,6 +205,8 @@ def create_link_token_for_update():
         return jsonify(json.loads(e.body)), 500
 
 def _exchange_public_token(public_token, institution_name, institution_id, client_id):
+    import plaid
+    from plaid.model.item_public_token_exchange_request import ItemPublicTokenExchangeRequest
     current_app.logger.info(f"_exchange_public_token: public_token={public_token}, institution_name={institution_name}, institution_id={institution_id}, client_id={client_id}")
     try:
         exchange_request = ItemPublicTokenExchangeRequest(public_token=public_token)
@@ -285,6 +283,8 @@ def exchange_public_token():
 
 @plaid_bp.route('/api/plaid_webhook', methods=['POST'])
 def plaid_webhook():
+    import plaid
+    from plaid.model.link_token_get_request import LinkTokenGetRequest
     current_app.logger.info("--- plaid_webhook: start ---")
     is_valid, error_response = verify_plaid_webhook(request)
     if not is_valid:
@@ -323,7 +323,7 @@ def plaid_webhook():
             
             try:
                 # For Hosted Link, we must call /link/token/get to fetch the institution details.
-                link_get_request = plaid.model.link_token_get_request.LinkTokenGetRequest(link_token=link_token)
+                link_get_request = LinkTokenGetRequest(link_token=link_token)
                 link_get_response = current_app.plaid_client.link_token_get(link_get_request)
 
                 institution_id = None
@@ -366,6 +366,8 @@ def sync_initial_transactions(item_id):
     Syncs initial transactions for a new item.
     This is typically called after receiving an INITIAL_UPDATE or HISTORICAL_UPDATE webhook.
     """
+    import plaid
+    from plaid.model.transactions_sync_request import TransactionsSyncRequest
     with current_app.app_context():
         item = PlaidItem.query.filter_by(item_id=item_id).first()
         if not item:
@@ -375,6 +377,9 @@ def sync_initial_transactions(item_id):
         client_id = item.client_id
         access_token = item.access_token
         cursor = None
+        total_added = 0
+        status = 'done'
+        events.publish(client_id, 'sync', kind='initial', item_id=item.id, stage='started')
 
         while True:
             try:
@@ -406,10 +411,12 @@ def sync_initial_transactions(item_id):
                             source_account_id=source_account_id
                         )
                         db.session.add(new_transaction)
+                        total_added += 1
 
                 item.cursor = response['next_cursor']
                 item.last_synced = datetime.now()
                 db.session.commit()
+                events.publish(client_id, 'sync', kind='initial', item_id=item.id, stage='progress', added=total_added)
 
                 if not response['has_more']:
                     break
@@ -424,17 +431,22 @@ def sync_initial_transactions(item_id):
                     cursor = None
                     continue
                 current_app.logger.error(f"Plaid API error during initial transaction sync for item {item_id}: {e}")
+                status = 'failed'
                 break
             except Exception as e:
                 current_app.logger.error(f"Error during initial transaction sync for item {item_id}: {e}")
+                status = 'failed'
                 break
         
         update_all_balances(client_id)
+        events.publish(client_id, 'sync', kind='initial', item_id=item.id, stage=status, added=total_added)
         current_app.logger.info(f"sync_initial_transactions: Finished for item {item_id}.")
 
 
 @plaid_bp.route('/api/transactions/sync', methods=['POST'])
 def sync_transactions():
+    import plaid
+    from plaid.model.transactions_sync_request import TransactionsSyncRequest
     plaid_account_id = request.json['plaid_account_id']
     current_app.logger.info(f"Syncing transactions for plaid_account_id: {plaid_account_id}")
     plaid_account = PlaidAccount.query.get_or_404(plaid_account_id)
@@ -507,6 +519,7 @@ def sync_transactions():
     if retries == max_retries:
         return jsonify({'error': 'Failed to sync transactions after multiple retries due to Plaid data mutations.'}), 500
 
+    events.publish(session['client_id'], 'sync', kind='transactions', item_id=item.id, stage='done', added=added_count)
     return jsonify({'status': 'success', 'added': added_count})
 
 @plaid_bp.route('/api/plaid/set_account', methods=['POST'])
@@ -525,37 +538,26 @@ def set_plaid_account():
     db.session.commit()
     return jsonify({'status': 'success'})
 
-def update_balances(plaid_item):
-    try:
-        balance_request = AccountsBalanceGetRequest(access_token=plaid_item.access_token)
-        accounts_response = current_app.plaid_client.accounts_balance_get(balance_request)
-        balances = accounts_response['accounts']
-
-        for balance_info in balances:
-            plaid_account = PlaidAccount.query.filter_by(account_id=balance_info['account_id']).first()
-            if plaid_account and plaid_account.local_account:
-                plaid_account.local_account.current_balance = balance_info['balances']['current']
-                plaid_account.local_account.balance_last_updated = datetime.utcnow()
-        
-        db.session.commit()
-        return True
-    except Exception as e:
-        current_app.logger.error(f"Error updating balances: {e}")
-        return False
-
 @plaid_bp.route('/api/plaid/refresh_balances', methods=['POST'])
 def refresh_balances():
-    plaid_item_id = request.json['plaid_item_id']
-    item = PlaidItem.query.get_or_404(plaid_item_id)
-    if item.client_id != session['client_id']:
-        return "Unauthorized", 403
-
-    if update_balances(item):
-        return jsonify({'status': 'success'})
+    plaid_item_id = (request.json or {}).get('plaid_item_id')
+    if plaid_item_id:
+        item = PlaidItem.query.get_or_404(plaid_item_id)
+        if item.client_id != session['client_id']:
+            return "Unauthorized", 403
+        # An explicit refresh of one institution always goes to Plaid.
+        results = plaid_balances.refresh_balances([item], force=True)
     else:
+        items = PlaidItem.query.filter_by(client_id=session['client_id']).order_by(PlaidItem.id).all()
+        results = plaid_balances.refresh_balances(items)
+
+    if any(updated is None for updated in results.values()):
         return jsonify({'error': 'Failed to update balances'}), 500
+    return jsonify({'status': 'success', 'refreshed': len(results), 'updated': sum(results.values())})
 
 def sync_plaid_accounts(plaid_item_id=None):
+    import plaid
+    from plaid.model.accounts_get_request import AccountsGetRequest
     with current_app.app_context():
         current_app.logger.info(f'Syncing accounts for plaid_item_id: {plaid_item_id}')
         if plaid_item_id:
@@ -647,57 +649,23 @@ def fetch_transactions():
     if item.client_id != session['client_id']:
         return "Unauthorized", 403
 
+    events.publish(item.client_id, 'sync', kind='fetch', item_id=item.id, stage='started')
     try:
-        all_transactions = []
-        offset = 0
-        count = 500
-        while True:
-            transactions_get_request = TransactionsGetRequest(
-                access_token=item.access_token,
-                start_date=start_date,
-                end_date=end_date,
-                options=TransactionsGetRequestOptions(
-                    account_ids=target_account_ids,
-                    offset=offset,
-                    count=count
-                )
-            )
-            response = current_app.plaid_client.transactions_get(transactions_get_request)
-            transactions = response['transactions']
-            all_transactions.extend(transactions)
+        def on_progress(fetched, total):
+            events.publish(item.client_id, 'sync', kind='fetch', item_id=item.id, stage='progress',
+                           fetched=fetched, total=total)
 
-            if len(transactions) < count:
-                break
-            offset += len(transactions)
-
-        current_app.logger.info(f"Found {len(all_transactions)} transactions from Plaid for item {item.id}")
-
-
-        account_id_map = {pa.account_id: pa.local_account_id for pa in PlaidAccount.query.filter(PlaidAccount.plaid_item_id == item.id).all()}
-
-        added_count = 0
-        for t in all_transactions:
-            if not Transaction.query.filter_by(plaid_transaction_id=t['transaction_id']).first():
-                source_account_id = account_id_map.get(t['account_id'])
-                new_transaction = Transaction(
-                    plaid_transaction_id=t['transaction_id'],
-                    date=t['date'],
-                    description=t['name'],
-                    amount=-t['amount'], # Plaid returns positive for debits, negative for credits
-                    category=t['category'][0] if t['category'] else None,
-                    client_id=session['client_id'],
-                    is_approved=False,
-                    source_account_id=source_account_id
-                )
-                db.session.add(new_transaction)
-                added_count += 1
-        
+        # Pages are stored as they arrive and checkpointed, so re-running an interrupted fetch resumes it.
+        added_count = plaid_backfill.backfill(item, start_date, end_date, account_ids=target_account_ids,
+                                              on_progress=on_progress)
         current_app.logger.info(f"Added {added_count} new transactions to the database.")
         update_all_balances(session['client_id'])
         db.session.commit()
+        events.publish(item.client_id, 'sync', kind='fetch', item_id=item.id, stage='done', added=added_count)
         return jsonify({'status': 'success', 'added': added_count})
     except Exception as e:
         current_app.logger.error(f"Error fetching transactions: {e}")
+        events.publish(item.client_id, 'sync', kind='fetch', item_id=item.id, stage='failed')
         return jsonify({'error': 'An error occurred while fetching transactions.'}), 500
 
 @plaid_bp.route('/api/plaid/delete_account', methods=['POST'])
@@ -715,6 +683,7 @@ def delete_plaid_account():
         return jsonify({'error': 'An error occurred while deleting the account.'}), 500
 @plaid_bp.route('/api/plaid/delete_institution', methods=['POST'])
 def delete_institution():
+    from plaid.model.item_remove_request import ItemRemoveRequest
     plaid_item_id = request.json['plaid_item_id']
     item = PlaidItem.query.get_or_404(plaid_item_id)
     if item.client_id != session['client_id']:
@@ -736,6 +705,8 @@ def delete_institution():
 
 @plaid_bp.route('/api/plaid/debug_link_token', methods=['POST'])
 def debug_link_token():
+    import plaid
+    from plaid.model.link_token_get_request import LinkTokenGetRequest
     link_token = request.json['link_token']
     try:
         response = current_app.plaid_client.link_token_get(LinkTokenGetRequest(link_token=link_token))
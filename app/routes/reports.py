@@ -1,11 +1,11 @@
-from flask import Blueprint, render_template, request, session, make_response, redirect, url_for, flash, jsonify
-from app import db
-from app.models import Account, JournalEntries, Reconciliation, Budget, AuditTrail, Transaction, Category
+from flask import Blueprint, render_template, request, session, make_response, redirect, url_for, flash, jsonify, current_app
+from app import db, audit, budgeting
+from app.models import Account, JournalEntries, Reconciliation, Budget, Transaction, Category
 from datetime import datetime, timedelta
 from dateutil.relativedelta import relativedelta
 import csv
 import io
-import json
+from app.money import to_cents
 from app.utils import get_account_tree, get_budgets_actual_spent, get_num_periods, get_miscellaneous_historical_performance, get_miscellaneous_spending_breakdown
 
 reports_bp = Blueprint('reports', __name__)
@@ -64,7 +64,7 @@ def balance_sheet():
     total_equity = total_equity_from_accounts + net_income
 
     # Check if books are balanced
-    is_balanced = round(total_assets, 2) == round(total_liabilities + total_equity, 2)
+    is_balanced = to_cents(total_assets) == to_cents(total_liabilities) + to_cents(total_equity)
 
     return render_template('balance_sheet.html', 
                            asset_data=asset_data, 
@@ -176,8 +176,8 @@ def analysis():
     ).group_by(JournalEntries.category).order_by(db.func.sum(JournalEntries.amount).desc())
 
     spending_by_category = spending_by_category_query.all()
-    category_labels = json.dumps([item.category for item in spending_by_category])
-    category_data = json.dumps([item.total for item in spending_by_category])
+    category_labels = current_app.json.dumps([item.category for item in spending_by_category])
+    category_data = current_app.json.dumps([item.total for item in spending_by_category])
 
     # --- Income by Category (Period 1) ---
     income_by_category_query = db.session.query(
@@ -193,8 +193,8 @@ def analysis():
     ).group_by(JournalEntries.category).order_by(db.func.sum(JournalEntries.amount).desc())
 
     income_by_category = income_by_category_query.all()
-    income_category_labels = json.dumps([item.category for item in income_by_category])
-    income_category_data = json.dumps([float(item.total) for item in income_by_category])
+    income_category_labels = current_app.json.dumps([item.category for item in income_by_category])
+    income_category_data = current_app.json.dumps([float(item.total) for item in income_by_category])
 
     # --- Category Comparison ---
     # For simplicity, we'll just use the top 5 categories from Period 1 for comparison
@@ -222,9 +222,9 @@ def analysis():
         ).scalar() or 0
         category_comparison_data_2.append(total_2)
 
-    category_comparison_labels = json.dumps(top_categories)
-    category_comparison_data_1 = json.dumps(category_comparison_data_1)
-    category_comparison_data_2 = json.dumps(category_comparison_data_2)
+    category_comparison_labels = current_app.json.dumps(top_categories)
+    category_comparison_data_1 = current_app.json.dumps(category_comparison_data_1)
+    category_comparison_data_2 = current_app.json.dumps(category_comparison_data_2)
 
     # --- Income vs. Expense ---
     # Monthly data for line chart (similar to dashboard)
@@ -253,9 +253,9 @@ def analysis():
 
     all_months = sorted(list(set(income_by_month.keys()) | set(expense_by_month.keys())))
 
-    income_trend_data = json.dumps([income_by_month.get(m, 0) for m in all_months])
-    expense_trend_data = json.dumps([expense_by_month.get(m, 0) for m in all_months])
-    all_months_json = json.dumps(all_months) # Renamed to avoid conflict with template variable
+    income_trend_data = current_app.json.dumps([income_by_month.get(m, 0) for m in all_months])
+    expense_trend_data = current_app.json.dumps([expense_by_month.get(m, 0) for m in all_months])
+    all_months_json = current_app.json.dumps(all_months) # Renamed to avoid conflict with template variable
 
     # --- Cash Flow Statement (using Period 1 for now) ---
     # Net Income
@@ -391,17 +391,10 @@ def budget():
         db.session.commit()
         return redirect(url_for('reports.budget'))
 
-    def get_budget_level(budget, all_budgets):
-        level = 0
-        parent = budget.parent
-        while parent:
-            level += 1
-            parent = parent.parent
-        return level
-
-    all_budgets = Budget.query.filter_by(client_id=session['client_id']).order_by(Budget.name).all()
-    overall_budget = Budget.query.filter_by(client_id=session['client_id'], name='Overall Budget').first()
-    other_budgets = Budget.query.filter(Budget.client_id == session['client_id'], Budget.name != 'Overall Budget').order_by(Budget.name).all()
+    tree = budgeting.load_budget_tree(session['client_id'])
+    all_budgets = tree.budgets
+    overall_budget = next((b for b in all_budgets if b.name == 'Overall Budget'), None)
+    other_budgets = [b for b in all_budgets if b.name != 'Overall Budget']
 
     budget_ids = [b.id for b in all_budgets]
     
@@ -412,13 +405,10 @@ def budget():
     actual_spendings = get_budgets_actual_spent(budget_ids, start_date, end_date)
 
     overall_budget_spent = actual_spendings.get(overall_budget.id, {'actual_spent': 0.0})['actual_spent'] if overall_budget else 0.0
-    overall_budget_transaction_ids = actual_spendings.get(overall_budget.id, {'transaction_ids': set()})['transaction_ids'] if overall_budget else set()
 
-    all_other_transaction_ids = set()
-    for budget in other_budgets:
-        all_other_transaction_ids.update(actual_spendings.get(budget.id, {'transaction_ids': set()})['transaction_ids'])
-
-    other_budgets_spent = db.session.query(db.func.sum(JournalEntries.amount)).filter(JournalEntries.id.in_(all_other_transaction_ids)).scalar() or 0
+    other_budgets_spent = budgeting.matched_entries(
+        session['client_id'], [b.id for b in other_budgets], start_date, end_date, db.func.sum(JournalEntries.amount)
+    ).scalar() or 0
 
     miscellaneous_spending = overall_budget_spent - other_budgets_spent
 
@@ -440,21 +430,21 @@ def budget():
         })
 
     for budget in other_budgets:
-        budget_info = actual_spendings.get(budget.id, {'actual_spent': 0.0, 'transaction_ids': set()})
+        budget_info = actual_spendings.get(budget.id, {'actual_spent': 0.0})
         actual_spent = budget_info['actual_spent']
         
         budgets_data.append({
             'id': budget.id,
             'name': budget.name,
-            'categories': [c.name for c in budget.categories],
+            'categories': tree.categories(budget.id),
             'period': budget.period,
             'start_date': budget.start_date.isoformat(),
             'amount': budget.amount,
             'actual_spent': actual_spent,
             'remaining': budget.amount - actual_spent,
             'parent_id': budget.parent_id,
-            'level': get_budget_level(budget, all_budgets),
-            'is_parent': bool(budget.children),
+            'level': tree.level(budget.id),
+            'is_parent': bool(tree.children(budget.id)),
             'keywords': budget.keywords
         })
 
@@ -462,22 +452,17 @@ def budget():
 
     # Now, let's adjust the parent budget's spending to avoid double-counting
     budgets_by_id = {b['id']: b for b in budgets_data}
+    shared_with_parent = budgeting.spent_shared_with_parent(session['client_id'], budget_ids, start_date, end_date)
     for budget_data in sorted(budgets_data, key=lambda b: b.get('level', 0), reverse=True):
         if budget_data.get('parent_id') and budget_data['parent_id'] in budgets_by_id:
             parent = budgets_by_id[budget_data['parent_id']]
-            
-            parent_transaction_ids = actual_spendings.get(parent['id'], {'transaction_ids': set()})['transaction_ids']
-            child_transaction_ids = actual_spendings.get(budget_data['id'], {'transaction_ids': set()})['transaction_ids']
-            
-            overlapping_transactions = parent_transaction_ids.intersection(child_transaction_ids)
-            
-            if overlapping_transactions:
-                overlapping_amount = db.session.query(db.func.sum(JournalEntries.amount)).filter(JournalEntries.id.in_(overlapping_transactions)).scalar() or 0
+            overlapping_amount = shared_with_parent.get(budget_data['id'], 0)
+            if overlapping_amount:
                 parent['actual_spent'] -= overlapping_amount
                 if 'remaining' in parent and 'amount' in parent and isinstance(parent['amount'], (int, float)):
                     parent['remaining'] = parent['amount'] - parent['actual_spent']
 
-    all_budgets_for_form = Budget.query.filter_by(client_id=session['client_id']).order_by(Budget.name).all()
+    all_budgets_for_form = all_budgets
     journal_categories = db.session.query(JournalEntries.category).filter(
         JournalEntries.client_id == session['client_id'], 
         JournalEntries.category != None, 
@@ -492,7 +477,7 @@ def budget():
         
     all_categories = [{'name': name} for name in sorted(list(category_names))]
 
-    return render_template('budget.html', budgets_data=json.dumps(budgets_data), all_budgets=all_budgets_for_form, all_categories=all_categories)
+    return render_template('budget.html', budgets_data=current_app.json.dumps(budgets_data), all_budgets=all_budgets_for_form, all_categories=all_categories)
 
 @reports_bp.route('/budget/<int:budget_id>/delete', methods=['POST'])
 def delete_budget(budget_id):
@@ -598,79 +583,38 @@ def budget_analysis(budget_id):
         num_periods = get_num_periods(start_date, end_date, budget.period)
         total_budgeted = budget.amount * num_periods
 
-        total_expenses = db.session.query(db.func.sum(JournalEntries.amount)).join(Account, JournalEntries.debit_account_id == Account.id).filter(
-            Account.type == 'Expense',
-            JournalEntries.client_id == session['client_id'],
-            JournalEntries.date >= start_date,
-            JournalEntries.date <= end_date
-        ).scalar() or 0
-
-        non_misc_budgets = Budget.query.filter(Budget.client_id == session['client_id'], Budget.is_miscellaneous == False).all()
-        non_misc_budget_ids = [b.id for b in non_misc_budgets]
-        non_misc_actual_spendings = get_budgets_actual_spent(non_misc_budget_ids, start_date, end_date)
-        total_non_misc_spent = sum(s['actual_spent'] for s in non_misc_actual_spendings.values())
-
-        actual_spent = total_expenses - total_non_misc_spent
+        actual_spent = budgeting.miscellaneous_spending(session['client_id'], start_date, end_date)['uncovered']
         difference = total_budgeted - actual_spent
 
-        all_expense_transactions = JournalEntries.query \
-            .join(Account, JournalEntries.debit_account_id == Account.id) \
-            .filter(Account.type == 'Expense', JournalEntries.client_id == session['client_id'], JournalEntries.date >= start_date, JournalEntries.date <= end_date) \
-            .all()
-        all_expense_transaction_ids = {t.id for t in all_expense_transactions}
-
-        non_misc_transaction_ids = set()
-        for b_id in non_misc_budget_ids:
-            non_misc_transaction_ids.update(non_misc_actual_spendings.get(b_id, {'transaction_ids': set()})['transaction_ids'])
-
-        misc_transaction_ids = all_expense_transaction_ids - non_misc_transaction_ids
-
         page = request.args.get('page', 1, type=int)
-        contributing_transactions = JournalEntries.query.filter(JournalEntries.id.in_(misc_transaction_ids)).order_by(JournalEntries.date.desc()).paginate(page=page, per_page=20, error_out=False)
+        contributing_transactions = budgeting.uncovered_entries(
+            session['client_id'], start_date, end_date, JournalEntries
+        ).order_by(JournalEntries.date.desc()).paginate(page=page, per_page=20, error_out=False)
 
         historical_performance = get_miscellaneous_historical_performance(budget, start_date, end_date)
         spending_breakdown = get_miscellaneous_spending_breakdown(budget, start_date, end_date)
 
     else:
-        all_budgets_in_tree = [budget] + budget.get_all_descendants()
+        tree = budgeting.load_budget_tree(budget.client_id)
+        all_budgets_in_tree = [budget] + tree.descendants(budget.id)
         budget_ids = [b.id for b in all_budgets_in_tree]
 
         num_periods = get_num_periods(start_date, end_date, budget.period)
-        total_budgeted = sum(b.total_budgeted * num_periods for b in all_budgets_in_tree)
+        total_budgeted = sum(tree.total_budgeted(b.id) * num_periods for b in all_budgets_in_tree)
 
-        actual_spendings = get_budgets_actual_spent(budget_ids, start_date, end_date)
-        
-        all_transaction_ids = set()
-        for b_id in budget_ids:
-            all_transaction_ids.update(actual_spendings.get(b_id, {'transaction_ids': set()})['transaction_ids'])
-
-        actual_spent = db.session.query(db.func.sum(JournalEntries.amount)).filter(JournalEntries.id.in_(all_transaction_ids)).scalar() or 0
+        actual_spent = budgeting.matched_entries(
+            session['client_id'], budget_ids, start_date, end_date, db.func.sum(JournalEntries.amount)
+        ).scalar() or 0
         difference = total_budgeted - actual_spent
 
-        all_categories = []
-        all_keywords = []
-        for b in all_budgets_in_tree:
-            for c in b.categories:
-                all_categories.append(c.name)
-            if b.keywords:
-                all_keywords.extend([k.strip() for k in b.keywords.split(',')])
-
         journal_filters = [
             JournalEntries.client_id == session['client_id'],
             JournalEntries.date >= start_date,
             JournalEntries.date <= end_date,
-            Account.type == 'Expense'
+            Account.type == 'Expense',
+            budgeting.matched_by_budgets(budget_ids)
         ]
 
-        conditions = []
-        if all_categories:
-            conditions.append(JournalEntries.category.in_(all_categories))
-        if all_keywords:
-            conditions.append(db.or_(*[JournalEntries.description.ilike(f'%{kw}%') for kw in all_keywords]))
-        
-        if conditions:
-            journal_filters.append(db.or_(*conditions))
-
         sort_by = request.args.get('sort_by', 'date')
         sort_dir = request.args.get('sort_dir', 'desc')
         description = request.args.get('description', '')
@@ -720,56 +664,25 @@ def export_budget_transactions(budget_id):
     notes = request.args.get('notes', '')
 
     if budget.is_miscellaneous:
-        # Get all expenses for the period
-        all_expenses_query = db.session.query(JournalEntries.id, JournalEntries.amount).join(Account, JournalEntries.debit_account_id == Account.id).filter(
-            Account.type == 'Expense',
+        # Expenses not covered by any non-miscellaneous budget
+        journal_filters = [
             JournalEntries.client_id == session['client_id'],
             JournalEntries.date >= start_date,
-            JournalEntries.date <= end_date
-        )
-        all_expenses = {e.id: e.amount for e in all_expenses_query.all()}
-        all_expense_ids = set(all_expenses.keys())
-
-        # Get transaction IDs covered by non-miscellaneous budgets
-        non_misc_budgets = Budget.query.filter(Budget.client_id == session['client_id'], Budget.is_miscellaneous == False).all()
-        non_misc_budget_ids = [b.id for b in non_misc_budgets]
-        non_misc_budgets_actual_spendings = get_budgets_actual_spent(non_misc_budget_ids, start_date, end_date)
-        
-        covered_transaction_ids = set()
-        for b_id in non_misc_budget_ids:
-            covered_transaction_ids.update(non_misc_budgets_actual_spendings.get(b_id, {'transaction_ids': set()})['transaction_ids'])
-
-        # Transactions not covered by any non-miscellaneous budget
-        uncovered_transaction_ids = all_expense_ids - covered_transaction_ids
-
-        journal_filters = [JournalEntries.id.in_(uncovered_transaction_ids)]
+            JournalEntries.date <= end_date,
+            Account.type == 'Expense',
+            ~budgeting.covered_by_budget()
+        ]
 
     else:
-        all_budgets_in_tree = [budget] + budget.get_all_descendants()
-        all_categories = []
-        all_keywords = []
-        for b in all_budgets_in_tree:
-            for c in b.categories:
-                all_categories.append(c.name)
-            if b.keywords:
-                all_keywords.extend([k.strip() for k in b.keywords.split(',')])
-
+        all_budgets_in_tree = [budget] + budgeting.load_budget_tree(budget.client_id).descendants(budget.id)
         journal_filters = [
             JournalEntries.client_id == session['client_id'],
             JournalEntries.date >= start_date,
             JournalEntries.date <= end_date,
-            Account.type == 'Expense'
+            Account.type == 'Expense',
+            budgeting.matched_by_budgets([b.id for b in all_budgets_in_tree])
         ]
 
-        conditions = []
-        if all_categories:
-            conditions.append(JournalEntries.category.in_(all_categories))
-        if all_keywords:
-            conditions.append(db.or_(*[JournalEntries.description.ilike(f'%{kw}%') for kw in all_keywords]))
-        
-        if conditions:
-            journal_filters.append(db.or_(*conditions))
-
     if description:
         journal_filters.append(JournalEntries.description.ilike(f'%{description}%'))
     if notes:
@@ -787,10 +700,31 @@ def export_budget_transactions(budget_id):
     output.headers["Content-type"] = "text/csv"
     return output
 
+def _audit_trail_page():
+    filters = {
+        'start': request.args.get('start_date', type=lambda v: datetime.strptime(v, '%Y-%m-%d').date()),
+        'end': request.args.get('end_date', type=lambda v: datetime.strptime(v, '%Y-%m-%d').date()),
+        'action': request.args.get('action', '').strip() or None,
+    }
+    archived = request.args.get('archived') == '1'
+    page = audit.search_archive if archived else audit.query_page
+    limit = max(1, min(request.args.get('limit', audit.PAGE_SIZE, type=int), audit.MAX_PAGE_SIZE))
+    logs, next_cursor = page(session['client_id'], cursor=request.args.get('cursor'), limit=limit, **filters)
+    return logs, next_cursor, archived
+
 @reports_bp.route('/audit_trail')
 def audit_trail():
-    logs = AuditTrail.query.join(AuditTrail.user).filter_by(client_id=session['client_id']).order_by(AuditTrail.date.desc()).all()
-    return render_template('audit_trail.html', logs=logs)
+    logs, next_cursor, archived = _audit_trail_page()
+    next_args = dict(request.args, cursor=next_cursor) if next_cursor else None
+    return render_template('audit_trail.html', logs=logs, next_args=next_args, archived=archived)
+
+@reports_bp.route('/audit_trail/api')
+def audit_trail_api():
+    logs, next_cursor, archived = _audit_trail_page()
+    return jsonify({
+        'entries': [dict(log, date=log['date'].isoformat()) for log in logs],
+        'next_cursor': next_cursor,
+    })
 
 @reports_bp.route('/what_if_scenarios', methods=['GET', 'POST'])
 def what_if_scenarios():
@@ -819,9 +753,9 @@ def what_if_scenarios():
 
         # Calculate actual spending for both original and scenario budgets
         actual_spendings = get_budgets_actual_spent([original_budget.id], start_date, end_date)
-        actual_spent = actual_spendings.get(original_budget.id, 0.0)
+        actual_spent = actual_spendings.get(original_budget.id, {'actual_spent': 0.0})['actual_spent']
 
-        original_difference = original_budget.total_budgeted - actual_spent
+        original_difference = budgeting.load_budget_tree(original_budget.client_id).total_budgeted(original_budget.id) - actual_spent
         scenario_difference = new_amount - actual_spent
 
         return render_template('what_if_scenarios.html', 
@@ -858,8 +792,8 @@ def full_pie_chart_expenses():
     ).group_by(JournalEntries.category).order_by(db.func.sum(JournalEntries.amount).desc())
 
     spending_by_category = spending_by_category_query.all()
-    labels = json.dumps([item.category for item in spending_by_category])
-    data = json.dumps([float(item.total) for item in spending_by_category])
+    labels = current_app.json.dumps([item.category for item in spending_by_category])
+    data = current_app.json.dumps([float(item.total) for item in spending_by_category])
 
     return render_template('full_pie_chart.html', 
                            title='Expense Breakdown', 
@@ -890,8 +824,8 @@ def full_pie_chart_income():
     ).group_by(JournalEntries.category).order_by(db.func.sum(JournalEntries.amount).desc())
 
     income_by_category = income_by_category_query.all()
-    labels = json.dumps([item.category for item in income_by_category])
-    data = json.dumps([float(item.total) for item in income_by_category])
+    labels = current_app.json.dumps([item.category for item in income_by_category])
+    data = current_app.json.dumps([float(item.total) for item in income_by_category])
 
     return render_template('full_pie_chart.html', 
                            title='Income Breakdown', 
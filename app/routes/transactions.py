@@ -1,8 +1,11 @@
-import json
 from flask import Blueprint, render_template, request, redirect, url_for, session, flash, jsonify, current_app
-from app import db
-from app.models import Transaction, JournalEntries, Account, TransactionRule, ImportTemplate, RecurringTransaction
+from app import db, events
+from app.models import Transaction, JournalEntries, Account, TransactionRule, ImportTemplate, RecurringTransaction, RecurringCandidate, RecurringDetectionState
 from app.utils import get_account_choices, log_audit
+from app.money import to_cents
+from app.recurring import first_due_on_or_after
+from app.approvals import bulk_approve_transactions
+from app.recurring_detection import detect_recurring_for_client
 from datetime import datetime
 from sqlalchemy import func
 from app.utils import get_account_choices, log_audit
@@ -81,9 +84,9 @@ def cleanup_orphaned_transactions():
 def unapproved_transactions():
     accounts_for_macro = get_account_choices(session['client_id'])
     account_choices = get_account_choices(session['client_id'])
-    accounts_json = json.dumps([{'id': a[0], 'name': a[1]} for a in account_choices])
+    accounts_json = current_app.json.dumps([{'id': a[0], 'name': a[1]} for a in account_choices])
     categories = db.session.query(Transaction.category).filter(Transaction.client_id == session['client_id']).distinct().all()
-    categories_json = json.dumps([c[0] for c in categories if c[0]])
+    categories_json = current_app.json.dumps([c[0] for c in categories if c[0]])
     return render_template('unapproved_transactions.html', accounts=accounts_for_macro, accounts_json=accounts_json, categories_json=categories_json)
 
 @transactions_bp.route('/assign_category/<int:transaction_id>', methods=['POST'])
@@ -129,11 +132,11 @@ def bulk_assign_category():
 def delete_duplicates():
     unapproved_transactions = Transaction.query.filter_by(client_id=session['client_id'], is_approved=False).all()
     journal_entries = JournalEntries.query.filter_by(client_id=session['client_id']).all()
-    journal_fingerprints = set((je.date, je.description.strip(), round(je.amount, 2)) for je in journal_entries)
+    journal_fingerprints = set((je.date, je.description.strip(), to_cents(je.amount)) for je in journal_entries)
 
     duplicates_to_delete = []
     for t in unapproved_transactions:
-        key = (t.date, t.description.strip(), round(abs(t.amount), 2))
+        key = (t.date, t.description.strip(), to_cents(abs(t.amount)))
         if key in journal_fingerprints:
             duplicates_to_delete.append(t.id)
 
@@ -146,37 +149,36 @@ def delete_duplicates():
 
     return redirect(url_for('transactions.unapproved_transactions'))
 
+def _log_approvals(approved):
+    if len(approved) == 1:
+        log_audit(f'Approved transaction and generated journal entry: {approved[0][1]}')
+    else:
+        # Bulk approvals list every transaction, so they go to AUDIT_LOG_FILE when it is set.
+        details = '\n'.join(f'{transaction_id}: {description}' for transaction_id, description in approved)
+        log_audit(f'Approved {len(approved)} transactions and generated journal entries', details=details,
+                  high_volume=True)
+
 @transactions_bp.route('/approve_transactions', methods=['POST'])
 def approve_transactions():
-    transaction_ids = request.form.getlist('transaction_ids')
+    transaction_ids = request.form.getlist('transaction_ids', type=int)
+    assignments = {}
+    missing = []
     for transaction_id in transaction_ids:
-        transaction = Transaction.query.get_or_404(transaction_id)
-        if transaction.client_id != session['client_id']:
-            continue
-
-        debit_account_id = request.form.get(f'debit_account_{transaction_id}')
-        credit_account_id = request.form.get(f'credit_account_{transaction_id}')
-
+        debit_account_id = request.form.get(f'debit_account_{transaction_id}', type=int)
+        credit_account_id = request.form.get(f'credit_account_{transaction_id}', type=int)
         if not debit_account_id or not credit_account_id:
-            flash(f'Debit and credit accounts must be selected for transaction {transaction.id}.', 'danger')
+            missing.append(transaction_id)
             continue
+        assignments[transaction_id] = (debit_account_id, credit_account_id)
 
-        new_entry = JournalEntries(
-                date=transaction.date,
-                description=transaction.description,
-                debit_account_id=debit_account_id,
-                credit_account_id=credit_account_id,
-                amount=abs(transaction.amount),
-                category=transaction.category,
-                transaction_id=transaction.id,
-                client_id=session['client_id']
-        )
-        db.session.add(new_entry)
-        transaction.is_approved = True
-        log_audit(f'Approved transaction and generated journal entry: {transaction.description}')
+    if missing:
+        flash(f'Debit and credit accounts must be selected for transactions: {", ".join(map(str, missing))}.', 'danger')
 
+    approved = bulk_approve_transactions(session['client_id'], assignments)
+    if approved:
+        _log_approvals(approved)
     db.session.commit()
-    flash('Selected transactions approved and journal entries created.', 'success')
+    flash(f'{len(approved)} transactions approved and journal entries created.', 'success')
     return redirect(url_for('transactions.unapproved_transactions'))
 
 @transactions_bp.route('/approve_transaction/<int:transaction_id>', methods=['POST'])
@@ -185,27 +187,16 @@ def approve_transaction(transaction_id):
     if transaction.client_id != session['client_id']:
         return "Unauthorized", 403
 
-    debit_account_id = request.form.get(f'debit_account_{transaction_id}')
-    credit_account_id = request.form.get(f'credit_account_{transaction_id}')
+    debit_account_id = request.form.get(f'debit_account_{transaction_id}', type=int)
+    credit_account_id = request.form.get(f'credit_account_{transaction_id}', type=int)
 
     if not debit_account_id or not credit_account_id:
         flash(f'Debit and credit accounts must be selected for transaction {transaction.id}.', 'danger')
         return redirect(url_for('transactions.unapproved_transactions'))
 
-    new_entry = JournalEntries(
-        date=transaction.date,
-        description=transaction.description,
-        debit_account_id=debit_account_id,
-        credit_account_id=credit_account_id,
-        amount=abs(transaction.amount),
-        category=transaction.category,
-        transaction_id=transaction.id,
-        client_id=session['client_id']
-    )
-    db.session.add(new_entry)
-    transaction.is_approved = True
-    log_audit(f'Approved transaction and generated journal entry: {transaction.description}')
-
+    approved = bulk_approve_transactions(session['client_id'], {transaction.id: (debit_account_id, credit_account_id)})
+    if approved:
+        _log_approvals(approved)
     db.session.commit()
     flash('Transaction approved and journal entry created.', 'success')
     return redirect(url_for('transactions.unapproved_transactions'))
@@ -414,7 +405,9 @@ def import_csv():
         flash('No import template found for the selected account.', 'danger')
         return redirect(url_for('transactions.import_page'))
 
-    for file in files:
+    imported = 0
+    events.publish(session['client_id'], 'import', stage='started', files=len(files))
+    for file_number, file in enumerate(files, 1):
         if file and file.filename.endswith('.csv'):
             current_app.logger.info(f"Processing CSV file: {file.filename}")
             stream = io.StringIO(file.stream.read().decode("UTF8"), newline=None)
@@ -449,13 +442,17 @@ def import_csv():
                         source_account_id=account_id
                     )
                     db.session.add(new_transaction)
+                    imported += 1
                     current_app.logger.info(f"Successfully processed row {i+1}: {row}")
                 except (ValueError, IndexError) as e:
                     current_app.logger.error(f"Error processing row {i+1}: {row}. Error: {e}")
                     flash(f'Error processing row: {row}. Error: {e}', 'danger')
                     continue
+            events.publish(session['client_id'], 'import', stage='progress', file=file.filename,
+                           files_done=file_number, files=len(files), rows=imported)
     
     db.session.commit()
+    events.publish(session['client_id'], 'import', stage='done', rows=imported)
     flash('CSV files imported successfully.', 'success')
     return redirect(url_for('transactions.unapproved_transactions'))
 
@@ -468,15 +465,29 @@ def transaction_analysis_page():
 
 @transactions_bp.route('/recurring_transactions')
 def recurring_transactions():
-    from app.tasks import detect_recurring_transactions
-    detected_transactions = detect_recurring_transactions(session['client_id'])
+    detected_transactions = RecurringCandidate.query.filter_by(client_id=session['client_id'], status='open') \
+        .order_by(RecurringCandidate.confidence.desc(), RecurringCandidate.last_date.desc()).all()
     approved_transactions = RecurringTransaction.query.filter_by(client_id=session['client_id']).all()
+    detection_state = db.session.get(RecurringDetectionState, session['client_id'])
     accounts = get_account_choices(session['client_id'])
-    return render_template('recurring_transactions.html', detected_transactions=detected_transactions, approved_transactions=approved_transactions, accounts=accounts)
+    return render_template('recurring_transactions.html', detected_transactions=detected_transactions, approved_transactions=approved_transactions, detection_state=detection_state, accounts=accounts)
+
+@transactions_bp.route('/refresh_recurring_transactions', methods=['POST'])
+def refresh_recurring_transactions():
+    found = detect_recurring_for_client(session['client_id'])
+    db.session.commit()
+    flash(f'Recurring transaction detection refreshed ({found} candidates updated).', 'success')
+    return redirect(url_for('transactions.recurring_transactions'))
 
 @transactions_bp.route('/approve_recurring_transaction', methods=['POST'])
 def approve_recurring_transaction():
-    name = request.form.get('name')
+    candidate = None
+    candidate_id = request.form.get('candidate_id', type=int)
+    if candidate_id:
+        candidate = RecurringCandidate.query.get_or_404(candidate_id)
+        if candidate.client_id != session['client_id']:
+            return "Unauthorized", 403
+
     description = request.form.get('description')
     amount = float(request.form.get('amount'))
     frequency = request.form.get('frequency')
@@ -486,7 +497,6 @@ def approve_recurring_transaction():
     credit_account_id = int(request.form.get('credit_account_id'))
 
     new_recurring_transaction = RecurringTransaction(
-        name=name,
         description=description,
         amount=amount,
         frequency=frequency,
@@ -496,7 +506,12 @@ def approve_recurring_transaction():
         credit_account_id=credit_account_id,
         client_id=session['client_id']
     )
+    # Detected recurrences start in the past and those occurrences are already
+    # in the books, so posting begins with the next occurrence from today.
+    new_recurring_transaction.next_due_date = first_due_on_or_after(new_recurring_transaction, max(datetime.now().date(), start_date))
     db.session.add(new_recurring_transaction)
+    if candidate:
+        candidate.status = 'approved'
     db.session.commit()
     flash('Recurring transaction approved and saved.', 'success')
     return redirect(url_for('transactions.recurring_transactions'))
@@ -512,10 +527,14 @@ def delete_recurring_transaction(transaction_id):
     flash('Recurring transaction deleted successfully.', 'success')
     return redirect(url_for('transactions.recurring_transactions'))
 
-@transactions_bp.route('/dismiss_recurring_transaction/<description>')
-def dismiss_recurring_transaction(description):
-    # TODO: Implement a more permanent solution for dismissing transactions
-    flash(f'Transaction "{description}" dismissed for this session.', 'info')
+@transactions_bp.route('/dismiss_recurring_transaction/<int:candidate_id>', methods=['POST'])
+def dismiss_recurring_transaction(candidate_id):
+    candidate = RecurringCandidate.query.get_or_404(candidate_id)
+    if candidate.client_id != session['client_id']:
+        return "Unauthorized", 403
+    candidate.status = 'dismissed'
+    db.session.commit()
+    flash(f'Transaction "{candidate.description}" dismissed.', 'info')
     return redirect(url_for('transactions.recurring_transactions'))
 
 @transactions_bp.route('/add_transaction_rule', methods=['GET', 'POST'])
@@ -641,11 +660,11 @@ def unapproved_transactions_data(table_id):
     transactions = base_query.offset(start).limit(length).all()
 
     journal_entries = JournalEntries.query.filter_by(client_id=session['client_id']).all()
-    journal_fingerprints = set((je.date, je.description.strip(), round(je.amount, 2)) for je in journal_entries)
+    journal_fingerprints = set((je.date, je.description.strip(), to_cents(je.amount)) for je in journal_entries)
 
     data = []
     for t in transactions:
-        key = (t.date, t.description.strip(), round(abs(t.amount), 2))
+        key = (t.date, t.description.strip(), to_cents(abs(t.amount)))
         is_duplicate = key in journal_fingerprints
 
         data.append({
@@ -0,0 +1,295 @@
+import collections
+import os
+import socket
+import threading
+import time
+import traceback
+import uuid
+from datetime import datetime, timedelta
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import insert, or_, update
+from sqlalchemy.exc import IntegrityError
+
+from app import db, scheduler
+from app.models import ScheduledJobState, SchedulerLock
+
+LEADER_LOCK = 'leader'
+# A crashed run's job lock lapses after this; longer than any job should take.
+JOB_LOCK_SECONDS = 6 * 3600
+
+# trigger is 'cron' or 'interval' and fields its APScheduler arguments.
+ScheduledJob = collections.namedtuple('ScheduledJob', 'id task trigger fields')
+
+_start_lock = threading.Lock()
+_owner = None
+
+
+def scheduled_jobs(app):
+    """The app's scheduled jobs. Each task takes the local time it was scheduled for."""
+    jobs = [
+        ScheduledJob('calculate_depreciation', 'calculate_and_record_depreciation', 'cron', {'day': 1, 'hour': 0}),
+        ScheduledJob('reverse_accruals', 'reverse_accruals', 'cron', {'day': 1, 'hour': 0}),
+        ScheduledJob('create_recurring_journal_entries', 'create_recurring_journal_entries', 'cron', {'day': '*', 'hour': 0}),
+        ScheduledJob('cleanup_pending_plaid_links', 'cleanup_pending_plaid_links', 'cron', {'day': '*', 'hour': 2}),
+        ScheduledJob('check_budgets', 'check_budgets', 'cron', {'day': '*', 'hour': 3}),
+        ScheduledJob('check_notification_rules', 'check_notification_rules', 'cron', {'day': '*', 'hour': 4}),
+        ScheduledJob('archive_audit_trail', 'archive_audit_trail', 'cron', {'day': 1, 'hour': 5}),
+        ScheduledJob('detect_recurring_transactions', 'detect_recurring_transactions', 'cron', {'minute': 15}),
+    ]
+    if app.config['PLAID_BALANCE_REFRESH_MINUTES']:
+        jobs.append(ScheduledJob('refresh_plaid_balances', 'refresh_plaid_balances', 'interval',
+                                 {'minutes': app.config['PLAID_BALANCE_REFRESH_MINUTES']}))
+    return {job.id: job for job in jobs}
+
+
+def make_trigger(job):
+    from apscheduler.triggers.cron import CronTrigger
+    from apscheduler.triggers.interval import IntervalTrigger
+    return CronTrigger(**job.fields) if job.trigger == 'cron' else IntervalTrigger(**job.fields)
+
+
+def latest_fire_time(trigger, after, now):
+    """The trigger's last fire time in (after, now], as naive local time, or None.
+
+    Interval triggers are read as a fixed grid of intervals from the epoch,
+    so every process agrees on the slot a run belongs to.
+    """
+    if hasattr(trigger, 'interval'):
+        step = trigger.interval
+        slot = datetime(1970, 1, 1) + (now - datetime(1970, 1, 1)) // step * step
+        return slot if slot > after else None
+    tz = trigger.timezone
+    fire = trigger.get_next_fire_time(None, (after + timedelta(seconds=1)).astimezone(tz))
+    latest = None
+    while fire is not None:
+        local = fire.astimezone().replace(tzinfo=None)
+        if local > now:
+            break
+        latest = local
+        fire = trigger.get_next_fire_time(fire, fire + timedelta(seconds=1))
+    return latest
+
+
+def process_owner():
+    """Identifies this process in scheduler_lock rows."""
+    global _owner
+    if _owner is None or not _owner.startswith(f'{socket.gethostname()}:{os.getpid()}:'):
+        _owner = f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}'
+    return _owner
+
+
+def acquire_lock(name, owner, seconds):
+    """Takes or renews the lease called name for owner; False if another owner holds it unexpired."""
+    table = SchedulerLock.__table__
+    now = datetime.utcnow()
+    expires_at = now + timedelta(seconds=seconds)
+    renewed = db.session.execute(update(table).where(
+        table.c.name == name, or_(table.c.owner == owner, table.c.expires_at < now)
+    ).values(owner=owner, expires_at=expires_at))
+    if renewed.rowcount == 0:
+        try:
+            db.session.execute(insert(table).values(name=name, owner=owner, expires_at=expires_at))
+        except IntegrityError:
+            db.session.rollback()
+            return False
+    db.session.commit()
+    return True
+
+
+def release_lock(name, owner):
+    table = SchedulerLock.__table__
+    db.session.execute(update(table).where(table.c.name == name, table.c.owner == owner)
+                       .values(expires_at=datetime(1970, 1, 1)))
+    db.session.commit()
+
+
+def run_scheduled_job(job_id, scheduled_for=None):
+    """Runs a scheduled job once for the time it was scheduled for; returns whether it ran.
+
+    The job's lock keeps two schedulers from running it at the same time,
+    and its ScheduledJobState row makes a second run for the same time (from
+    another scheduler, or a catch-up racing the regular run) a no-op.
+    """
+    app = scheduler.app
+    with app.app_context():
+        job = scheduled_jobs(app)[job_id]
+        now = datetime.now()
+        scheduled_for = scheduled_for or latest_fire_time(make_trigger(job), now - timedelta(days=1), now) or now
+        owner = process_owner()
+        if not acquire_lock(f'job:{job_id}', owner, JOB_LOCK_SECONDS):
+            app.logger.info(f"Scheduled job {job_id} is already running elsewhere; skipped.")
+            return False
+        try:
+            state = db.session.get(ScheduledJobState, job_id)
+            if state is None:
+                state = ScheduledJobState(job_id=job_id)
+                db.session.add(state)
+            elif state.last_scheduled_for and state.last_scheduled_for >= scheduled_for:
+                return False
+            state.last_started_at = datetime.utcnow()
+            db.session.commit()
+
+            error = None
+            try:
+                from app import tasks
+                getattr(tasks, job.task)(scheduled_for)
+            except Exception:
+                db.session.rollback()
+                error = traceback.format_exc()
+                app.logger.error(f"Scheduled job {job_id} ({scheduled_for}) failed:\n{error}")
+            # Failed runs are recorded too; per-client jobs can be re-run with `flask run-job`.
+            state = db.session.get(ScheduledJobState, job_id)
+            state.last_scheduled_for = scheduled_for
+            state.last_finished_at = datetime.utcnow()
+            state.last_error = error
+            db.session.commit()
+            return True
+        finally:
+            release_lock(f'job:{job_id}', owner)
+
+
+def missed_runs(app, now=None):
+    """[(job id, scheduled time)] for jobs that should have run since their last run but did not.
+
+    Only the latest missed time of each job is returned, and only within
+    SCHEDULER_CATCH_UP_DAYS. Jobs that never ran under this scheduler have
+    no state yet and are not caught up.
+    """
+    now = now or datetime.now()
+    window = now - timedelta(days=app.config['SCHEDULER_CATCH_UP_DAYS'])
+    states = {state.job_id: state for state in ScheduledJobState.query}
+    missed = []
+    for job in scheduled_jobs(app).values():
+        state = states.get(job.id)
+        if state is None or state.last_scheduled_for is None:
+            continue
+        fire_time = latest_fire_time(make_trigger(job), max(state.last_scheduled_for, window), now)
+        if fire_time:
+            missed.append((job.id, fire_time))
+    return missed
+
+
+def catch_up(app):
+    """Queues a run of every job that missed its latest scheduled time."""
+    if not app.config['SCHEDULER_CATCH_UP_DAYS']:
+        return []
+    with app.app_context():
+        missed = missed_runs(app)
+    for job_id, scheduled_for in missed:
+        app.logger.info(f"Catching up scheduled job {job_id} missed at {scheduled_for}.")
+        scheduler.add_job(id=f'{job_id}:catch_up', func=run_scheduled_job, args=[job_id, scheduled_for],
+                          replace_existing=True)
+    return missed
+
+
+class LeaderElection:
+    """Keeps the 'leader' lease in scheduler_lock so that one process runs the scheduled jobs.
+
+    Every process that starts the scheduler starts it paused and campaigns
+    every third of SCHEDULER_LEASE_SECONDS. The process holding the lease
+    resumes its scheduler and catches up missed runs; if it stops renewing
+    (it exited, hung or lost the database) the lease lapses and another
+    process takes over.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.leading = False
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='scheduler-election', daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join(timeout=5)
+        if self.leading:
+            with self.app.app_context():
+                release_lock(LEADER_LOCK, process_owner())
+
+    def campaign(self):
+        """Tries to take or keep the lease and resumes or pauses the scheduler to match."""
+        with self.app.app_context():
+            try:
+                leader = acquire_lock(LEADER_LOCK, process_owner(), self.app.config['SCHEDULER_LEASE_SECONDS'])
+            except Exception:
+                db.session.rollback()
+                self.app.logger.exception("Scheduler leader election failed")
+                leader = False
+        if leader and not self.leading:
+            self.app.logger.info(f"This process ({process_owner()}) is now the scheduler leader.")
+            self.leading = True
+            scheduler.resume()
+            catch_up(self.app)
+        elif not leader and self.leading:
+            self.app.logger.warning("Lost the scheduler leader lease; pausing scheduled jobs.")
+            self.leading = False
+            scheduler.pause()
+        return leader
+
+    def _run(self):
+        interval = self.app.config['SCHEDULER_LEASE_SECONDS'] / 3
+        while not self._stop.is_set():
+            self.campaign()
+            self._stop.wait(interval)
+
+
+def start_scheduler(app):
+    """Starts APScheduler with the app's jobs in this process, paused until it is elected leader.
+
+    Returns the LeaderElection, or None if the scheduler was already running.
+    """
+    with _start_lock:
+        if scheduler.running:
+            return None
+        scheduler.init_app(app)
+        scheduler.start(paused=True)
+        for job in scheduled_jobs(app).values():
+            scheduler.add_job(id=job.id, func=run_scheduled_job, args=[job.id], trigger=make_trigger(job),
+                              replace_existing=True)
+        election = LeaderElection(app)
+        app.extensions['scheduler_election'] = election
+        election.start()
+        return election
+
+
+def init_app(app):
+    """Starts the scheduler with the first request this process serves, if SCHEDULER_ENABLED.
+
+    Waiting for a request keeps the scheduler out of CLI commands (`flask db
+    upgrade`, `flask run-job`, ...) and out of the reloader's watcher
+    process. Tests never start it. Several processes may start it; only the
+    elected leader runs jobs.
+    """
+    if not app.config['SCHEDULER_ENABLED'] or app.testing:
+        return
+
+    @app.before_request
+    def start_scheduler_once():
+        if not scheduler.running:
+            start_scheduler(app)
+
+
+@click.command('run-scheduler')
+@with_appcontext
+def run_scheduler():
+    """Runs the scheduled jobs in this process until it is stopped.
+
+    Start it on more than one host for a standby: only the elected leader
+    runs jobs, and another takes over within SCHEDULER_LEASE_SECONDS.
+    """
+    app = current_app._get_current_object()
+    election = start_scheduler(app)
+    print(f"Scheduler started with {len(scheduler.get_jobs())} jobs as {process_owner()}; "
+          f"jobs run while this process holds the leader lease. Press Ctrl+C to stop.")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        if election:
+            election.stop()
+        scheduler.shutdown()
@@ -0,0 +1,382 @@
+"""A local stand-in for the parts of the Plaid API the app uses.
+
+Serves deterministic accounts and transactions for any access token (same
+token -> same data), so the Plaid gateway, webhook verification and the
+sync routes can be exercised in tests and benchmarks without network
+access or sandbox credentials. Point the app at it with PLAID_ENV=local and
+PLAID_HOST=http://127.0.0.1:<port>.
+
+Usage:
+    python -m benchmarks.fake_plaid --port 8765 --transactions 5000 --latency 0.05
+
+Beyond static data it can simulate new activity (FakePlaid.mutate), sync
+paginations broken by TRANSACTIONS_SYNC_MUTATION_DURING_PAGINATION
+(--sync-interruptions) and signed webhook deliveries (send_webhook);
+benchmarks/plaid_sync.py drives the app's sync pipeline with it.
+"""
+import argparse
+import base64
+import collections
+import hashlib
+import json
+import random
+import threading
+import time
+import urllib.error
+import urllib.request
+from datetime import date, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+MERCHANTS = ['WHOLE FOODS MKT', 'CHIPOTLE', 'SHELL OIL', 'COMCAST', 'GITHUB', 'DELTA AIR', 'STAPLES',
+             'STRIPE TRANSFER', 'UBER', 'STARBUCKS']
+CATEGORIES = ['Food and Drink', 'Travel', 'Shops', 'Service', 'Transfer']
+ACCOUNT_TYPES = [('depository', 'checking'), ('depository', 'savings'), ('credit', 'credit card')]
+WEBHOOK_KEY_ID = 'fake-plaid-key-1'
+# Nullable fields the SDK requires to be present on a transaction's location and payment_meta.
+LOCATION_FIELDS = ['address', 'city', 'region', 'postal_code', 'country', 'lat', 'lon', 'store_number']
+PAYMENT_META_FIELDS = ['reference_number', 'ppd_id', 'payee', 'by_order_of', 'payer', 'payment_method',
+                       'payment_processor', 'reason']
+
+
+def _b64(number):
+    return base64.urlsafe_b64encode(number.to_bytes(32, 'big')).rstrip(b'=').decode()
+
+
+class FakeItem:
+    """The accounts and transactions behind one access token.
+
+    Besides the current transactions (for /transactions/get) the item keeps
+    the change log that /transactions/sync pages through: every initial
+    transaction as 'added', then whatever mutate() adds, modifies or removes.
+    """
+
+    def __init__(self, access_token, accounts, transactions, days):
+        self.rng = random.Random(access_token)
+        self.item_id = 'item-' + hashlib.sha1(access_token.encode()).hexdigest()[:12]
+        self.accounts = []
+        for i in range(accounts):
+            account_type, subtype = ACCOUNT_TYPES[i % len(ACCOUNT_TYPES)]
+            self.accounts.append({
+                'account_id': f'{self.item_id}-acc-{i}',
+                'balances': {'available': None, 'current': round(self.rng.uniform(100, 20000), 2),
+                             'limit': None, 'iso_currency_code': 'USD', 'unofficial_currency_code': None},
+                'mask': f'{1000 + i}',
+                'name': f'Fake {subtype.title()} {i}',
+                'official_name': None,
+                'type': account_type,
+                'subtype': subtype,
+            })
+        self.days = days
+        self.next_id = 0
+        self.by_id = {}
+        self.changes = []
+        # Bumped by every mutation; a sync cursor issued mid-pagination is stale once it moves.
+        self.version = 0
+        for _ in range(transactions):
+            self._add()
+        self.transactions = []
+        self._resort()
+
+    def _add(self, when=None):
+        account = self.accounts[self.next_id % len(self.accounts)]
+        when = when or date.today() - timedelta(days=self.rng.randrange(self.days))
+        transaction = {
+            'transaction_id': f'{self.item_id}-txn-{self.next_id}',
+            'account_id': account['account_id'],
+            'amount': round(self.rng.uniform(-500, 500), 2),
+            'iso_currency_code': 'USD',
+            'unofficial_currency_code': None,
+            'category': [self.rng.choice(CATEGORIES)],
+            'category_id': None,
+            'date': when.isoformat(),
+            'name': self.rng.choice(MERCHANTS),
+            'merchant_name': None,
+            'pending': False,
+            'pending_transaction_id': None,
+            'account_owner': None,
+            'authorized_date': None,
+            'authorized_datetime': None,
+            'datetime': None,
+            'location': dict.fromkeys(LOCATION_FIELDS),
+            'payment_meta': dict.fromkeys(PAYMENT_META_FIELDS),
+            'payment_channel': 'other',
+            'transaction_code': None,
+        }
+        self.next_id += 1
+        self.by_id[transaction['transaction_id']] = transaction
+        self.changes.append(('added', transaction))
+        return transaction
+
+    def _resort(self):
+        # Plaid returns the newest transactions first.
+        self.transactions = sorted(self.by_id.values(), key=lambda t: (t['date'], t['transaction_id']),
+                                   reverse=True)
+
+    def _adjust_balance(self, account_id, amount):
+        for account in self.accounts:
+            if account['account_id'] == account_id:
+                account['balances']['current'] = round(account['balances']['current'] - amount, 2)
+
+    def mutate(self, added=0, modified=0, removed=0):
+        """New activity at the bank: posts, corrects and removes transactions."""
+        for _ in range(added):
+            transaction = self._add(when=date.today())
+            self._adjust_balance(transaction['account_id'], transaction['amount'])
+        existing = list(self.by_id)
+        for transaction_id in self.rng.sample(existing, min(modified, len(existing))):
+            changed = dict(self.by_id[transaction_id], amount=round(self.rng.uniform(-500, 500), 2))
+            self.by_id[transaction_id] = changed
+            self.changes.append(('modified', changed))
+        existing = list(self.by_id)
+        for transaction_id in self.rng.sample(existing, min(removed, len(existing))):
+            transaction = self.by_id.pop(transaction_id)
+            self.changes.append(('removed', {'transaction_id': transaction_id,
+                                             'account_id': transaction['account_id']}))
+        self.version += 1
+        self._resort()
+
+    def item(self):
+        return {'item_id': self.item_id, 'institution_id': 'ins_fake', 'webhook': None, 'error': None,
+                'available_products': [], 'billed_products': ['transactions'], 'consent_expiration_time': None,
+                'update_type': 'background'}
+
+
+class FakePlaid:
+    """Request handling and data, separate from the HTTP server so tests can call it directly.
+
+    sync_interruptions makes that many /transactions/sync paginations per
+    item fail halfway with TRANSACTIONS_SYNC_MUTATION_DURING_PAGINATION (a
+    transaction is modified under the client, as happens at a real bank), so
+    the app's retry path runs. Counts of calls and returned error codes are
+    kept for benchmarks.
+    """
+
+    def __init__(self, accounts=3, transactions=1200, days=730, latency=0.0, sync_interruptions=0):
+        self.accounts = accounts
+        self.transactions = transactions
+        self.days = days
+        self.latency = latency
+        self.sync_interruptions = sync_interruptions
+        self.calls = []
+        self.errors = collections.Counter()
+        self._items = {}
+        self._interruptions = collections.Counter()
+        self._lock = threading.Lock()
+        self._signing_key = None
+
+    def get_item(self, access_token):
+        with self._lock:
+            item = self._items.get(access_token)
+            if item is None:
+                item = self._items[access_token] = FakeItem(access_token, self.accounts, self.transactions, self.days)
+            return item
+
+    def mutate(self, access_token, added=0, modified=0, removed=0):
+        item = self.get_item(access_token)
+        with self._lock:
+            item.mutate(added, modified, removed)
+
+    def handle(self, path, body):
+        """(status, response dict) for a POST of body to path."""
+        with self._lock:
+            self.calls.append(path)
+        if self.latency:
+            time.sleep(self.latency)
+        handler = self.ROUTES.get(path)
+        if handler is None:
+            status, response = 404, self._error('INVALID_REQUEST', 'NOT_FOUND', f'unknown endpoint {path}')
+        else:
+            status, response = handler(self, body)
+        if status >= 400:
+            with self._lock:
+                self.errors[response['error_code']] += 1
+        return status, response
+
+    def _error(self, error_type, error_code, message):
+        return {'error_type': error_type, 'error_code': error_code, 'error_message': message,
+                'display_message': None, 'request_id': self._request_id()}
+
+    def _request_id(self):
+        return 'fake-' + hashlib.sha1(str(time.time_ns()).encode()).hexdigest()[:10]
+
+    def _accounts(self, item, body):
+        wanted = (body.get('options') or {}).get('account_ids')
+        return [a for a in item.accounts if not wanted or a['account_id'] in wanted]
+
+    def accounts_get(self, body):
+        item = self.get_item(body['access_token'])
+        return 200, {'accounts': self._accounts(item, body), 'item': item.item(), 'request_id': self._request_id()}
+
+    def transactions_get(self, body):
+        item = self.get_item(body['access_token'])
+        options = body.get('options') or {}
+        account_ids = options.get('account_ids')
+        start, end = body['start_date'], body['end_date']
+        matching = [t for t in item.transactions if start <= t['date'] <= end
+                    and (not account_ids or t['account_id'] in account_ids)]
+        offset = options.get('offset', 0)
+        count = options.get('count', 100)
+        return 200, {'accounts': self._accounts(item, {'options': {'account_ids': account_ids}}),
+                     'transactions': matching[offset:offset + count], 'total_transactions': len(matching),
+                     'item': item.item(), 'request_id': self._request_id()}
+
+    def transactions_sync(self, body):
+        access_token = body['access_token']
+        item = self.get_item(access_token)
+        count = body.get('count', 100)
+        with self._lock:
+            # Cursors are "offset:version:has_more" into the item's change log.
+            offset, version, paginating = (int(part) for part in (body.get('cursor') or '0:0:0').split(':'))
+            if paginating and self._interruptions[access_token] < self.sync_interruptions \
+                    and offset * 2 >= len(item.changes):
+                self._interruptions[access_token] += 1
+                item.mutate(modified=1)
+            if paginating and version != item.version:
+                return 400, self._error('TRANSACTIONS_ERROR', 'TRANSACTIONS_SYNC_MUTATION_DURING_PAGINATION',
+                                        'Underlying transaction data changed since the last page was fetched. '
+                                        'Please restart pagination from last update.')
+            page = item.changes[offset:offset + count]
+            next_offset = offset + len(page)
+            has_more = next_offset < len(item.changes)
+            accounts = [dict(a, balances=dict(a['balances'])) for a in item.accounts]
+            version = item.version
+        return 200, {'accounts': accounts,
+                     'added': [t for kind, t in page if kind == 'added'],
+                     'modified': [t for kind, t in page if kind == 'modified'],
+                     'removed': [t for kind, t in page if kind == 'removed'],
+                     'next_cursor': f'{next_offset}:{version}:{int(has_more)}', 'has_more': has_more,
+                     'transactions_update_status': 'HISTORICAL_UPDATE_COMPLETE', 'request_id': self._request_id()}
+
+    def item_remove(self, body):
+        with self._lock:
+            self._items.pop(body['access_token'], None)
+        return 200, {'request_id': self._request_id()}
+
+    def _key(self):
+        if self._signing_key is None:
+            from cryptography.hazmat.primitives.asymmetric import ec
+            self._signing_key = ec.generate_private_key(ec.SECP256R1())
+        return self._signing_key
+
+    def public_jwk(self):
+        numbers = self._key().public_key().public_numbers()
+        return {'alg': 'ES256', 'crv': 'P-256', 'kid': WEBHOOK_KEY_ID, 'kty': 'EC', 'use': 'sig',
+                'x': _b64(numbers.x), 'y': _b64(numbers.y), 'created_at': int(time.time()), 'expired_at': None}
+
+    def webhook_verification_key_get(self, body):
+        if body.get('key_id') != WEBHOOK_KEY_ID:
+            return 400, self._error('INVALID_INPUT', 'INVALID_WEBHOOK_VERIFICATION_KEY_ID', 'unknown key id')
+        return 200, {'key': self.public_jwk(), 'request_id': self._request_id()}
+
+    def sign_webhook(self, body):
+        """A Plaid-Verification header value for a webhook with this raw body (bytes)."""
+        import jwt
+        claims = {'iat': int(time.time()), 'request_body_sha256': hashlib.sha256(body).hexdigest()}
+        return jwt.encode(claims, self._key(), algorithm='ES256', headers={'kid': WEBHOOK_KEY_ID})
+
+    def transactions_webhook(self, access_token, webhook_code='HISTORICAL_UPDATE'):
+        """The payload Plaid sends when an item has new transactions."""
+        item = self.get_item(access_token)
+        return {'webhook_type': 'TRANSACTIONS', 'webhook_code': webhook_code, 'item_id': item.item_id,
+                'new_transactions': len(item.transactions), 'error': None, 'environment': 'sandbox'}
+
+    def webhook_request(self, payload):
+        """(body, headers) of a signed webhook delivery."""
+        body = json.dumps(payload).encode()
+        return body, {'Content-Type': 'application/json', 'Plaid-Verification': self.sign_webhook(body)}
+
+    def send_webhook(self, url, payload):
+        """POSTs a signed webhook to the app; returns (status, parsed response)."""
+        body, headers = self.webhook_request(payload)
+        request = urllib.request.Request(url, data=body, headers=headers, method='POST')
+        try:
+            with urllib.request.urlopen(request) as response:
+                return response.status, json.loads(response.read() or b'null')
+        except urllib.error.HTTPError as e:
+            return e.code, json.loads(e.read() or b'null')
+
+    ROUTES = {
+        '/accounts/get': accounts_get,
+        '/accounts/balance/get': accounts_get,
+        '/transactions/get': transactions_get,
+        '/transactions/sync': transactions_sync,
+        '/item/remove': item_remove,
+        '/webhook_verification_key/get': webhook_verification_key_get,
+    }
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keep-alive, like the real API
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        body = json.loads(self.rfile.read(length) or b'{}')
+        status, payload = self.server.plaid.handle(self.path, body)
+        data = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FakePlaidServer(ThreadingHTTPServer):
+    """FakePlaid over HTTP on a background thread; use as a context manager."""
+
+    daemon_threads = True
+
+    def __init__(self, plaid=None, host='127.0.0.1', port=0):
+        super().__init__((host, port), _Handler)
+        self.plaid = plaid or FakePlaid()
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, name='fake-plaid', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--accounts', type=int, default=3, help='accounts per item')
+    parser.add_argument('--transactions', type=int, default=1200, help='transactions per item')
+    parser.add_argument('--days', type=int, default=730, help='days of history')
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to every response')
+    parser.add_argument('--sync-interruptions', type=int, default=0,
+                        help='/transactions/sync paginations per item to fail with a mutation error')
+    args = parser.parse_args()
+
+    plaid = FakePlaid(accounts=args.accounts, transactions=args.transactions, days=args.days, latency=args.latency,
+                      sync_interruptions=args.sync_interruptions)
+    server = FakePlaidServer(plaid, args.host, args.port)
+    print(f"Fake Plaid listening on {server.url} (PLAID_ENV=local PLAID_HOST={server.url})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,144 @@
+"""Benchmarks the Plaid sync pipeline offline against benchmarks/fake_plaid.py.
+
+Usage:
+    python -m benchmarks.plaid_sync                                   # 2 items x 2000 transactions
+    python -m benchmarks.plaid_sync --items 5 --transactions 20000 --latency 0.02
+    python -m benchmarks.plaid_sync --sync-interruptions 2 --output plaid.json
+
+Each item is linked the way the app does it (accounts synced from Plaid and
+mapped to local accounts), then two phases are timed end to end through the
+webhook route, signature verification included:
+
+    initial      a HISTORICAL_UPDATE webhook per item pulls the full history
+    incremental  after new activity at the fake bank, a second webhook per item
+
+For each phase the wall time, transactions stored per second, SQL statements,
+Plaid calls by endpoint and Plaid error codes (mutation-during-pagination
+retries) are reported, and written as JSON with --output.
+"""
+import argparse
+import collections
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+from app import create_app, db
+from app.models import Account, Client, PlaidAccount, PlaidItem, Transaction
+from benchmarks.fake_plaid import FakePlaid, FakePlaidServer
+from benchmarks.run_benchmarks import QueryCounter, _git_commit
+
+
+def setup(fake, items):
+    """A client with `items` linked Plaid items whose accounts map to local accounts; returns the items."""
+    from app.routes.plaid import sync_plaid_accounts
+
+    client = Client(business_name='Plaid Sync Bench', contact_name='bench')
+    db.session.add(client)
+    db.session.commit()
+    plaid_items = []
+    for i in range(items):
+        access_token = f'access-bench-{i}'
+        item = PlaidItem(client_id=client.id, item_id=fake.get_item(access_token).item_id,
+                         access_token=access_token, institution_id='ins_fake', institution_name=f'Fake Bank {i}')
+        db.session.add(item)
+        db.session.commit()
+        sync_plaid_accounts(item.id)
+        for plaid_account in PlaidAccount.query.filter_by(plaid_item_id=item.id):
+            account = Account(name=plaid_account.name, type='Asset', opening_balance=0, client_id=client.id)
+            db.session.add(account)
+            db.session.flush()
+            plaid_account.local_account_id = account.id
+        db.session.commit()
+        plaid_items.append(item)
+    return plaid_items
+
+
+def run_phase(app, fake, plaid_items, counter):
+    client = app.test_client()
+    calls_before = collections.Counter(fake.calls)
+    errors_before = collections.Counter(fake.errors)
+    stored_before = Transaction.query.count()
+    counter.count = 0
+    started = time.perf_counter()
+    for item in plaid_items:
+        body, headers = fake.webhook_request(fake.transactions_webhook(item.access_token))
+        response = client.post('/plaid/api/plaid_webhook', data=body, headers=headers)
+        if response.status_code != 200:
+            raise RuntimeError(f'Webhook for item {item.id} failed with HTTP {response.status_code}')
+    seconds = time.perf_counter() - started
+    stored = Transaction.query.count() - stored_before
+    return {
+        'seconds': round(seconds, 3),
+        'transactions_stored': stored,
+        'transactions_per_second': round(stored / seconds, 1) if seconds else None,
+        'queries': counter.count,
+        'plaid_calls': dict(collections.Counter(fake.calls) - calls_before),
+        'plaid_errors': dict(fake.errors - errors_before),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the Plaid sync pipeline against a local fake Plaid.')
+    parser.add_argument('--items', type=int, default=2)
+    parser.add_argument('--accounts', type=int, default=3, help='accounts per item')
+    parser.add_argument('--transactions', type=int, default=2000, help='transactions per item')
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to every Plaid response')
+    parser.add_argument('--sync-interruptions', type=int, default=1,
+                        help='initial paginations per item broken by a mutation error')
+    parser.add_argument('--new', type=int, default=50, help='transactions added per item before the second phase')
+    parser.add_argument('--modified', type=int, default=10)
+    parser.add_argument('--removed', type=int, default=5)
+    parser.add_argument('--output', help='Write results JSON to this path.')
+    args = parser.parse_args()
+
+    fake = FakePlaid(accounts=args.accounts, transactions=args.transactions, latency=args.latency,
+                     sync_interruptions=args.sync_interruptions)
+    workdir = tempfile.mkdtemp(prefix='logical-books-plaid-bench-')
+    results = {}
+    try:
+        with FakePlaidServer(fake) as server:
+            app = create_app({
+                'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + os.path.join(workdir, 'bench.db'),
+                'SECRET_KEY': 'bench',
+                'SCHEDULER_ENABLED': False,
+                'PLAID_ENV': 'local',
+                'PLAID_HOST': server.url,
+            })
+            with app.app_context():
+                db.create_all()
+                counter = QueryCounter(db.engine)
+                plaid_items = setup(fake, args.items)
+
+                results['initial'] = run_phase(app, fake, plaid_items, counter)
+                for item in plaid_items:
+                    fake.mutate(item.access_token, added=args.new, modified=args.modified, removed=args.removed)
+                results['incremental'] = run_phase(app, fake, plaid_items, counter)
+            app.plaid_client.close()
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    for phase, result in results.items():
+        print(f"{phase:12s} {result['seconds']:8.2f} s   {result['transactions_stored']:7d} stored   "
+              f"{result['transactions_per_second'] or 0:9.1f}/s   queries {result['queries']:7d}   "
+              f"plaid {sum(result['plaid_calls'].values()):5d} calls   errors {result['plaid_errors']}")
+
+    report = {
+        'commit': _git_commit(),
+        'timestamp': datetime.utcnow().isoformat(timespec='seconds'),
+        'python': sys.version.split()[0],
+        'platform': platform.platform(),
+        'params': vars(args),
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
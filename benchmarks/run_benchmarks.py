@@ -0,0 +1,207 @@
+"""Times the hot routes against a synthetic dataset and reports latency and query counts.
+
+Usage:
+    python -m benchmarks.run_benchmarks                       # small dataset in a temp dir
+    python -m benchmarks.run_benchmarks --entries 1000000 --clients 50 --accounts 500
+    python -m benchmarks.run_benchmarks --db /tmp/bench.db    # reuse a generated database
+    python -m benchmarks.run_benchmarks --output after.json --compare before.json
+
+Each route is requested once to warm caches and then `--repeat` times; the
+median and p95 wall time and the number of SQL statements per request are
+recorded. Results are written as JSON so that a before/after pair can be
+compared with `--compare`.
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+from sqlalchemy import event
+
+from app import create_app, db
+from app.models import ImportTemplate
+from benchmarks import synthetic_data
+
+
+# (name, method, path). Paths are relative to the blueprint prefixes in create_app.
+ROUTES = [
+    ('dashboard', 'GET', '/dashboard/'),
+    ('ledger', 'GET', '/reports/ledger'),
+    ('income_statement', 'GET', '/reports/income_statement'),
+    ('balance_sheet', 'GET', '/reports/balance_sheet'),
+    ('budget_report', 'GET', '/reports/budget'),
+    ('analysis', 'GET', '/reports/analysis'),
+    ('journal', 'GET', '/journal/'),
+    ('unapproved_data', 'GET', '/transactions/unapproved_transactions_data/unmodified-table'),
+    ('run_unapproved_rules', 'POST', '/transactions/run_unapproved_rules'),
+    ('import_csv', 'POST', '/transactions/import_csv'),
+]
+
+
+class QueryCounter:
+    def __init__(self, engine):
+        self.count = 0
+        event.listen(engine, 'before_cursor_execute', self._on_execute)
+
+    def _on_execute(self, conn, cursor, statement, parameters, context, executemany):
+        self.count += 1
+
+
+def _git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL,
+                                       cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _percentile(samples, pct):
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100.0 * len(ordered))) - 1))
+    return ordered[index]
+
+
+def _request(client, method, path, csv_payload, import_account_id):
+    if path.endswith('/import_csv'):
+        data = {
+            'account': str(import_account_id),
+            'csv_files': (io.BytesIO(csv_payload.encode()), 'bench.csv'),
+        }
+        return client.post(path, data=data, content_type='multipart/form-data')
+    if method == 'POST':
+        return client.post(path)
+    return client.get(path)
+
+
+def run(app, repeat=5, routes=None, csv_rows=500, log=print):
+    engine = db.engine
+    counter = QueryCounter(engine)
+    csv_payload = synthetic_data.sample_csv(rows=csv_rows)
+    template = ImportTemplate.query.filter_by(name='Bench CSV').order_by(ImportTemplate.id).first()
+    client_id, import_account_id = template.client_id, template.account_id
+
+    client = app.test_client()
+    # Select the benchmark client the same way the UI does, then log in.
+    client.get(f'/clients/client_detail/{client_id}')
+    response = client.post('/login', data={'username': synthetic_data.BENCH_USERNAME,
+                                           'password': synthetic_data.BENCH_PASSWORD})
+    if response.status_code != 302 or response.location.endswith('/login'):
+        raise RuntimeError(f'Benchmark login failed with status {response.status_code}')
+
+    results = {}
+    for name, method, path in ROUTES:
+        if routes and name not in routes:
+            continue
+        # Warm-up request (template compilation, SQLite page cache).
+        response = _request(client, method, path, csv_payload, import_account_id)
+        if response.status_code >= 400:
+            log(f'{name}: HTTP {response.status_code}, skipped')
+            results[name] = {'status': response.status_code}
+            continue
+
+        timings = []
+        queries = []
+        for _ in range(repeat):
+            counter.count = 0
+            started = time.perf_counter()
+            response = _request(client, method, path, csv_payload, import_account_id)
+            timings.append((time.perf_counter() - started) * 1000.0)
+            queries.append(counter.count)
+        results[name] = {
+            'status': response.status_code,
+            'median_ms': round(statistics.median(timings), 2),
+            'p95_ms': round(_percentile(timings, 95), 2),
+            'queries': int(statistics.median(queries)),
+        }
+        log(f"{name:24s} median {results[name]['median_ms']:10.2f} ms   "
+            f"p95 {results[name]['p95_ms']:10.2f} ms   queries {results[name]['queries']:6d}")
+    return results
+
+
+def compare(before, after, log=print):
+    log(f"\n{'route':24s} {'before ms':>12s} {'after ms':>12s} {'speedup':>8s} {'queries':>17s}")
+    for name, current in after['results'].items():
+        previous = before.get('results', {}).get(name)
+        if not previous or 'median_ms' not in previous or 'median_ms' not in current:
+            continue
+        speedup = previous['median_ms'] / current['median_ms'] if current['median_ms'] else float('inf')
+        log(f"{name:24s} {previous['median_ms']:12.2f} {current['median_ms']:12.2f} {speedup:7.2f}x "
+            f"{previous['queries']:8d} -> {current['queries']:<6d}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the hot routes against synthetic data.')
+    parser.add_argument('--db', help='Existing benchmark database (from benchmarks.synthetic_data). '
+                                     'A fresh one is generated in a temp dir when omitted.')
+    parser.add_argument('--clients', type=int, default=2)
+    parser.add_argument('--accounts', type=int, default=60)
+    parser.add_argument('--entries', type=int, default=20000)
+    parser.add_argument('--transactions', type=int, default=2000)
+    parser.add_argument('--rules', type=int, default=25)
+    parser.add_argument('--years', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=1234)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--csv-rows', type=int, default=500)
+    parser.add_argument('--route', action='append', dest='routes', help='Only run the named route (repeatable).')
+    parser.add_argument('--output', help='Write results JSON to this path.')
+    parser.add_argument('--compare', help='Previous results JSON to compare against.')
+    args = parser.parse_args()
+
+    workdir = None
+    if args.db:
+        db_path = os.path.abspath(args.db)
+    else:
+        workdir = tempfile.mkdtemp(prefix='logical-books-bench-')
+        db_path = os.path.join(workdir, 'bench.db')
+
+    app = create_app({
+        'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + db_path,
+        'SECRET_KEY': 'bench',
+        'SCHEDULER_ENABLED': False,
+    })
+    # Route errors should show up as HTTP 500s in the report, not abort the run.
+    app.config['PROPAGATE_EXCEPTIONS'] = False
+
+    try:
+        with app.app_context():
+            params = {'db': db_path}
+            if workdir:
+                db.create_all()
+                started = time.perf_counter()
+                params.update(synthetic_data.generate(
+                    clients=args.clients, accounts=args.accounts, entries=args.entries,
+                    transactions=args.transactions, rules=args.rules, years=args.years, seed=args.seed))
+                params['generate_seconds'] = round(time.perf_counter() - started, 1)
+
+            results = run(app, repeat=args.repeat, routes=args.routes, csv_rows=args.csv_rows)
+    finally:
+        if workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        'commit': _git_commit(),
+        'timestamp': datetime.utcnow().isoformat(timespec='seconds'),
+        'python': sys.version.split()[0],
+        'platform': platform.platform(),
+        'params': params,
+        'repeat': args.repeat,
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), report)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,133 @@
+"""Times cold starts of the app: the import, create_app() and a CLI command.
+
+Usage:
+    python -m benchmarks.startup                        # 5 runs of each
+    python -m benchmarks.startup --repeat 10 --output startup.json
+    python -m benchmarks.startup --importtime 15        # also list the 15 slowest imports
+
+Every run is a fresh interpreter, so nothing is cached in memory between
+runs (the OS file cache is warm after the first). For each scenario the
+median and slowest wall time are reported, along with which of the heavy
+modules (the Plaid SDK and its PlaidApi, pandas, numpy) the process
+ended up importing; after startup none of them should be loaded.
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+from benchmarks.run_benchmarks import _git_commit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+HEAVY_MODULES = ['plaid', 'plaid.api.plaid_api', 'pandas', 'numpy']
+
+REPORT_HEAVY = (
+    "import json, sys; "
+    "print('HEAVY=' + json.dumps([m for m in %r if m in sys.modules]))" % HEAVY_MODULES
+)
+
+# (name, python code run in a fresh interpreter)
+SCENARIOS = [
+    ('import', "import app; " + REPORT_HEAVY),
+    ('create_app', "from app import create_app; create_app(); " + REPORT_HEAVY),
+    ('first_request', "from app import create_app; c = create_app().test_client(); c.get('/login'); " + REPORT_HEAVY),
+]
+
+
+def run_once(code, env):
+    started = time.perf_counter()
+    result = subprocess.run([sys.executable, '-c', code], cwd=ROOT, env=env, capture_output=True, text=True)
+    seconds = time.perf_counter() - started
+    if result.returncode != 0:
+        raise RuntimeError(f'Startup run failed:\n{result.stderr}')
+    heavy = []
+    for line in result.stdout.splitlines():
+        if line.startswith('HEAVY='):
+            heavy = json.loads(line[len('HEAVY='):])
+    return seconds, heavy
+
+
+def run_cli_once(env):
+    # `flask routes` loads the app through the CLI and lists the URL map.
+    started = time.perf_counter()
+    result = subprocess.run([sys.executable, '-m', 'flask', '--app', 'app:create_app', 'routes'],
+                            cwd=ROOT, env=env, capture_output=True, text=True)
+    seconds = time.perf_counter() - started
+    if result.returncode != 0:
+        raise RuntimeError(f'flask routes failed:\n{result.stderr}')
+    return seconds, None
+
+
+def slowest_imports(env, count):
+    """(cumulative seconds, module) for the slowest imports of create_app(), from -X importtime."""
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'from app import create_app; create_app()'],
+                            cwd=ROOT, env=env, capture_output=True, text=True)
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, module = line[len('import time:'):].split('|')
+        # Only top-level imports, so a package and its submodules are not counted twice.
+        if not module.startswith('  '):
+            rows.append((int(cumulative) / 1e6, module.strip()))
+    return sorted(rows, reverse=True)[:count]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Time cold starts of the app in fresh interpreters.')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--importtime', type=int, default=0, metavar='N', help='also list the N slowest imports')
+    parser.add_argument('--output', help='Write results JSON to this path.')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='logical-books-startup-')
+    env = dict(os.environ,
+               DATABASE_URL='sqlite:///' + os.path.join(workdir, 'startup.db'),
+               JINJA_BYTECODE_CACHE_DIR=os.path.join(workdir, 'jinja_cache'),
+               SCHEDULER_ENABLED='0')
+    results = {}
+    try:
+        scenarios = [(name, lambda code=code: run_once(code, env)) for name, code in SCENARIOS]
+        scenarios.append(('cli', lambda: run_cli_once(env)))
+        for name, run in scenarios:
+            samples, heavy = [], None
+            for _ in range(args.repeat):
+                seconds, heavy = run()
+                samples.append(seconds)
+            results[name] = {
+                'median_s': round(statistics.median(samples), 3),
+                'max_s': round(max(samples), 3),
+                'heavy_modules': heavy,
+            }
+            print(f"{name:14s} median {results[name]['median_s']:6.3f} s   max {results[name]['max_s']:6.3f} s"
+                  + (f"   heavy modules loaded: {', '.join(heavy) or 'none'}" if heavy is not None else ''))
+        imports = slowest_imports(env, args.importtime) if args.importtime else []
+        for seconds, module in imports:
+            print(f"  {seconds:6.3f} s  {module}")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        'commit': _git_commit(),
+        'timestamp': datetime.utcnow().isoformat(timespec='seconds'),
+        'python': sys.version.split()[0],
+        'platform': platform.platform(),
+        'params': vars(args),
+        'results': results,
+        'slowest_imports': [{'module': module, 'seconds': round(seconds, 3)} for seconds, module in imports],
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
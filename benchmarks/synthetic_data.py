@@ -0,0 +1,356 @@
+"""Synthetic multi-year ledger generator used by the benchmark suite.
+
+Builds a deterministic dataset (same seed -> same rows) with a realistic
+chart of accounts, categories, budgets, transaction rules, import templates,
+Plaid-style unapproved transactions and a large journal. Rows are written
+with bulk inserts in chunks so that generating millions of journal entries
+stays practical on SQLite.
+
+Usage:
+    python -m benchmarks.synthetic_data --db /tmp/bench.db --clients 50 \
+        --accounts 500 --entries 1000000
+"""
+import argparse
+import os
+import random
+import time
+from datetime import date, timedelta
+
+from sqlalchemy import insert
+
+from app import create_app, db
+from app.models import (
+    Client, Role, User, Account, JournalEntries, Transaction, Budget, Category,
+    TransactionRule, ImportTemplate, budget_categories
+)
+
+BENCH_USERNAME = 'bench'
+BENCH_PASSWORD = 'bench'
+
+CHUNK_SIZE = 10000
+
+EXPENSE_CATEGORIES = {
+    'Groceries': ['WHOLE FOODS MKT', 'TRADER JOE S', 'KROGER', 'SAFEWAY', 'ALDI'],
+    'Dining and Drinks': ['TST*LITTLE BLUE MACARO', 'CHIPOTLE', 'STARBUCKS', 'SQ *BLUE BOTTLE', 'DOORDASH'],
+    'Fuel': ['CIRCLE K', 'SHELL OIL', 'CHEVRON', 'EXXONMOBIL'],
+    'Utilities': ['PG&E', 'COMCAST', 'CITY WATER DEPT', 'VERIZON WIRELESS'],
+    'Rent': ['OAKWOOD PROPERTY MGMT'],
+    'Software': ['GITHUB', 'ADOBE', 'GOOGLE *WORKSPACE', 'SLACK TECHNOLOGIES', 'AWS'],
+    'Insurance': ['STATE FARM', 'GEICO'],
+    'Travel': ['DELTA AIR', 'UNITED AIRLINES', 'MARRIOTT', 'UBER', 'LYFT'],
+    'Office Supplies': ['STAPLES', 'OFFICE DEPOT', 'AMAZON MKTPL'],
+    'Advertising': ['FACEBK ADS', 'GOOGLE ADS'],
+    'Payroll': ['GUSTO PAYROLL'],
+    'Professional Services': ['LEGALZOOM', 'CPA ASSOCIATES'],
+}
+MONTHLY_CATEGORIES = {'Rent', 'Utilities', 'Software', 'Insurance', 'Payroll'}
+INCOME_CATEGORIES = {
+    'Sales': ['STRIPE TRANSFER', 'SQUARE DEPOSIT', 'SHOPIFY PAYOUT'],
+    'Consulting': ['ACH CREDIT CLIENT PMT', 'WIRE TRANSFER IN'],
+    'Interest': ['INTEREST PAYMENT'],
+}
+ASSET_ACCOUNTS = ['Checking', 'Savings', 'Cash', 'Money Market']
+LIABILITY_ACCOUNTS = ['SoFi CC', 'Amex Gold', 'Chase Sapphire', 'Line of Credit']
+
+
+def _chunks(rows, size=CHUNK_SIZE):
+    for i in range(0, len(rows), size):
+        yield rows[i:i + size]
+
+
+def _bulk_insert(model_or_table, rows):
+    for chunk in _chunks(rows):
+        db.session.execute(insert(model_or_table), chunk)
+
+
+def _merchant(rng, names):
+    name = rng.choice(names)
+    if rng.random() < 0.4:
+        name = f'{name} # {rng.randint(100, 99999):05d}'
+    return name
+
+
+def _amount(rng, category):
+    if category in ('Rent', 'Payroll'):
+        return round(rng.uniform(1500, 6000), 2)
+    if category in MONTHLY_CATEGORIES:
+        return round(rng.uniform(20, 400), 2)
+    return round(rng.lognormvariate(3.2, 1.0), 2)
+
+
+def _build_accounts(rng, client_id, accounts_per_client):
+    """Creates a two-level chart of accounts and returns leaf ids by role."""
+    parents = {
+        'Asset': Account(name='Assets', type='Asset', client_id=client_id),
+        'Liability': Account(name='Liabilities', type='Liability', client_id=client_id),
+        'Equity': Account(name='Equity', type='Equity', client_id=client_id),
+        'Revenue': Account(name='Income', type='Revenue', client_id=client_id),
+        'Expense': Account(name='Expense Accounts', type='Expense', client_id=client_id),
+    }
+    db.session.add_all(parents.values())
+    db.session.flush()
+
+    leaf_count = max(accounts_per_client - len(parents), 10)
+    # Roughly: 10% assets, 10% liabilities, 5% equity, 10% revenue, rest expense.
+    split = {
+        'Asset': max(leaf_count // 10, 1),
+        'Liability': max(leaf_count // 10, 1),
+        'Equity': max(leaf_count // 20, 1),
+        'Revenue': max(leaf_count // 10, 1),
+    }
+    split['Expense'] = max(leaf_count - sum(split.values()), len(EXPENSE_CATEGORIES))
+
+    base_names = {
+        'Asset': ASSET_ACCOUNTS,
+        'Liability': LIABILITY_ACCOUNTS,
+        'Equity': ["Owner's Capital", "Owner's Draw", 'Retained Earnings'],
+        'Revenue': list(INCOME_CATEGORIES),
+        'Expense': list(EXPENSE_CATEGORIES),
+    }
+    rows = []
+    for account_type, count in split.items():
+        names = base_names[account_type]
+        for i in range(count):
+            name = names[i % len(names)]
+            if i >= len(names):
+                name = f'{name} {i // len(names) + 1}'
+            rows.append({
+                'name': name,
+                'type': account_type,
+                'category': name.rsplit(' ', 1)[0] if i >= len(names) else name,
+                'opening_balance': round(rng.uniform(0, 20000), 2) if account_type == 'Asset' else 0.0,
+                'current_balance': 0.0,
+                'client_id': client_id,
+                'parent_id': parents[account_type].id,
+            })
+    _bulk_insert(Account, rows)
+
+    leaves = {t: [] for t in split}
+    for account_id, account_type, category in db.session.query(Account.id, Account.type, Account.category).filter(
+            Account.client_id == client_id, Account.parent_id != None).all():
+        leaves[account_type].append((account_id, category))
+    return leaves
+
+
+def _build_budgets(rng, client_id, start_date):
+    categories = {}
+    for name in list(EXPENSE_CATEGORIES) + list(INCOME_CATEGORIES):
+        category = Category(name=name, client_id=client_id)
+        db.session.add(category)
+        categories[name] = category
+    db.session.flush()
+
+    overall = Budget(name='Overall Budget', amount=0, period='monthly', start_date=start_date,
+                     end_date=start_date + timedelta(days=30), client_id=client_id)
+    db.session.add(overall)
+    db.session.flush()
+
+    links = []
+    for name in EXPENSE_CATEGORIES:
+        budget = Budget(name=name, amount=round(rng.uniform(100, 5000), -1), period='monthly',
+                        start_date=start_date, end_date=start_date + timedelta(days=30),
+                        client_id=client_id, parent_id=overall.id,
+                        keywords=', '.join(m.split(' ')[0] for m in EXPENSE_CATEGORIES[name][:2]))
+        db.session.add(budget)
+        db.session.flush()
+        links.append({'budget_id': budget.id, 'category_id': categories[name].id})
+        # A nested child budget on some categories to exercise tree walks.
+        if rng.random() < 0.3:
+            child = Budget(name=f'{name} - Team', amount=round(rng.uniform(50, 500), -1), period='monthly',
+                           start_date=start_date, end_date=start_date + timedelta(days=30),
+                           client_id=client_id, parent_id=budget.id,
+                           keywords=EXPENSE_CATEGORIES[name][0].split(' ')[0])
+            db.session.add(child)
+    db.session.add(Budget(name='Miscellaneous', amount=500, period='monthly', start_date=start_date,
+                          end_date=start_date + timedelta(days=30), client_id=client_id,
+                          is_miscellaneous=True))
+    db.session.flush()
+    _bulk_insert(budget_categories, links)
+
+
+def _build_rules(rng, client_id, leaves, rule_count):
+    rows = []
+    merchants = [(cat, m) for cat, names in EXPENSE_CATEGORIES.items() for m in names]
+    expense_by_category = {}
+    for account_id, category in leaves['Expense']:
+        expense_by_category.setdefault(category, account_id)
+    for i in range(rule_count):
+        category, merchant = merchants[i % len(merchants)]
+        rows.append({
+            'client_id': client_id,
+            'keyword': merchant.split(' ')[0].lower(),
+            'new_category': category,
+            'new_debit_account_id': expense_by_category.get(category),
+            'new_credit_account_id': rng.choice(leaves['Liability'])[0],
+            'is_automatic': True,
+            'delete_transaction': False,
+            'flag_for_manual_assignment': i % 17 == 0,
+        })
+    _bulk_insert(TransactionRule, rows)
+
+
+def _journal_rows(rng, client_id, leaves, count, start_date, days):
+    expense_accounts = {}
+    for account_id, category in leaves['Expense']:
+        expense_accounts.setdefault(category, []).append(account_id)
+    revenue_accounts = {}
+    for account_id, category in leaves['Revenue']:
+        revenue_accounts.setdefault(category, []).append(account_id)
+    funding = [a for a, _ in leaves['Asset']] + [a for a, _ in leaves['Liability']]
+    deposit = [a for a, _ in leaves['Asset']]
+    expense_categories = list(EXPENSE_CATEGORIES)
+    income_categories = list(INCOME_CATEGORIES)
+
+    rows = []
+    for _ in range(count):
+        entry_date = start_date + timedelta(days=rng.randrange(days))
+        if rng.random() < 0.85:
+            category = rng.choice(expense_categories)
+            debit = rng.choice(expense_accounts.get(category) or [a for a, _ in leaves['Expense']])
+            credit = rng.choice(funding)
+            description = _merchant(rng, EXPENSE_CATEGORIES[category])
+            amount = _amount(rng, category)
+            transaction_type = 'expense'
+        else:
+            category = rng.choice(income_categories)
+            debit = rng.choice(deposit)
+            credit = rng.choice(revenue_accounts.get(category) or [a for a, _ in leaves['Revenue']])
+            description = _merchant(rng, INCOME_CATEGORIES[category])
+            amount = round(rng.uniform(200, 15000), 2)
+            transaction_type = 'deposit'
+        rows.append({
+            'date': entry_date,
+            'description': description,
+            'debit_account_id': debit,
+            'credit_account_id': credit,
+            'amount': amount,
+            'category': category,
+            'client_id': client_id,
+            'locked': False,
+            'is_accrual': False,
+            'is_reversing': False,
+            'status': 'posted',
+            'transaction_type': transaction_type,
+        })
+    return rows
+
+
+def _transaction_rows(rng, client_id, leaves, count, start_date, days, id_offset):
+    sources = [a for a, _ in leaves['Asset']] + [a for a, _ in leaves['Liability']]
+    rows = []
+    for i in range(count):
+        category = rng.choice(list(EXPENSE_CATEGORIES))
+        rows.append({
+            'plaid_transaction_id': f'bench-{client_id}-{id_offset + i}',
+            'date': start_date + timedelta(days=rng.randrange(days)),
+            'description': _merchant(rng, EXPENSE_CATEGORIES[category]),
+            'amount': -_amount(rng, category),
+            'category': category if rng.random() < 0.7 else None,
+            'client_id': client_id,
+            'is_approved': False,
+            'rule_modified': False,
+            'needs_manual_assignment': False,
+            'source_account_id': rng.choice(sources),
+        })
+    return rows
+
+
+def generate(clients=2, accounts=60, entries=20000, transactions=2000, rules=25, years=3, seed=1234, log=print):
+    """Populates the bound database. Returns a summary dict of what was created.
+
+    `entries` and `transactions` are totals across all clients.
+    """
+    rng = random.Random(seed)
+    today = date.today()
+    start_date = date(today.year - years + 1, 1, 1)
+    days = (today - start_date).days + 1
+
+    role = Role.query.filter_by(name='Admin').first()
+    if not role:
+        role = Role(name='Admin')
+        db.session.add(role)
+        db.session.flush()
+
+    entries_per_client = entries // clients
+    transactions_per_client = transactions // clients
+    client_ids = []
+    started = time.perf_counter()
+    for n in range(clients):
+        client = Client(business_name=f'Bench Client {n + 1:03d}', contact_name='Benchmark', client_status='Active')
+        db.session.add(client)
+        db.session.flush()
+        client_ids.append(client.id)
+
+        leaves = _build_accounts(rng, client.id, accounts)
+        _build_budgets(rng, client.id, today.replace(day=1))
+        _build_rules(rng, client.id, leaves, rules)
+        db.session.add(ImportTemplate(name='Bench CSV', client_id=client.id, account_id=leaves['Asset'][0][0],
+                                      date_col=0, description_col=1, amount_col=2, category_col=3,
+                                      has_header=True))
+
+        remaining = entries_per_client
+        while remaining > 0:
+            batch = min(remaining, CHUNK_SIZE * 5)
+            _bulk_insert(JournalEntries, _journal_rows(rng, client.id, leaves, batch, start_date, days))
+            remaining -= batch
+        _bulk_insert(Transaction, _transaction_rows(rng, client.id, leaves, transactions_per_client,
+                                                    start_date, days, 0))
+        db.session.commit()
+        log(f'client {n + 1}/{clients}: {accounts} accounts, {entries_per_client} entries, '
+            f'{transactions_per_client} transactions ({time.perf_counter() - started:.1f}s)')
+
+    if not User.query.filter_by(username=BENCH_USERNAME).first():
+        user = User(username=BENCH_USERNAME, role_id=role.id, client_id=client_ids[0])
+        user.set_password(BENCH_PASSWORD)
+        db.session.add(user)
+    db.session.commit()
+
+    return {
+        'clients': clients,
+        'accounts_per_client': accounts,
+        'entries': entries_per_client * clients,
+        'transactions': transactions_per_client * clients,
+        'rules_per_client': rules,
+        'years': years,
+        'seed': seed,
+        'client_ids': client_ids,
+    }
+
+
+def sample_csv(rows=500, seed=1234):
+    """Returns CSV text matching the generated 'Bench CSV' import template."""
+    rng = random.Random(seed)
+    today = date.today()
+    lines = ['Date,Description,Amount,Category']
+    for _ in range(rows):
+        category = rng.choice(list(EXPENSE_CATEGORIES))
+        entry_date = today - timedelta(days=rng.randrange(365))
+        description = _merchant(rng, EXPENSE_CATEGORIES[category]).replace(',', ' ')
+        lines.append(f'{entry_date.isoformat()},{description},{-_amount(rng, category)},{category}')
+    return '\n'.join(lines) + '\n'
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate a synthetic ledger database for benchmarking.')
+    parser.add_argument('--db', required=True, help='Path of the SQLite file to create (must not exist).')
+    parser.add_argument('--clients', type=int, default=2)
+    parser.add_argument('--accounts', type=int, default=60, help='Accounts per client.')
+    parser.add_argument('--entries', type=int, default=20000, help='Journal entries in total.')
+    parser.add_argument('--transactions', type=int, default=2000, help='Unapproved Plaid-style transactions in total.')
+    parser.add_argument('--rules', type=int, default=25, help='Transaction rules per client.')
+    parser.add_argument('--years', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=1234)
+    args = parser.parse_args()
+
+    if os.path.exists(args.db):
+        parser.error(f'{args.db} already exists; refusing to add to an existing database.')
+
+    app = create_app({'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + os.path.abspath(args.db)})
+    with app.app_context():
+        db.create_all()
+        generate(clients=args.clients, accounts=args.accounts, entries=args.entries,
+                 transactions=args.transactions, rules=args.rules, years=args.years, seed=args.seed)
+
+
+if __name__ == '__main__':
+    main()
@@ -6,6 +6,15 @@ DB_FILE = 'bookkeeping.db'
 EXPORT_DIR = 'data_export'
 OUTPUT_FILE = os.path.join(EXPORT_DIR, 'data_export.xlsx')
 
+# Columns stored as integer cents (see app/money.py); exported as dollars so
+# that `flask import-data` can load them back through the models.
+CENTS_COLUMNS = {
+    'journal_entries': ['amount'],
+    'transaction': ['amount'],
+    'account': ['opening_balance', 'current_balance'],
+    'budget': ['amount'],
+}
+
 def export_database_to_excel():
     if not os.path.exists(DB_FILE):
         print(f"Error: Database file '{DB_FILE}' not found.")
@@ -33,6 +42,8 @@ def export_database_to_excel():
             try:
                 # Use pandas to read the SQL table into a DataFrame
                 df = pd.read_sql_query(f'SELECT * FROM "{table_name}" ', conn)
+                for column in CENTS_COLUMNS.get(table_name, []):
+                    df[column] = df[column] / 100
                 
                 # Write the DataFrame to a sheet in the Excel file
                 df.to_excel(writer, sheet_name=table_name, index=False)
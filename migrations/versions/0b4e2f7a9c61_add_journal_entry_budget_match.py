@@ -0,0 +1,45 @@
+"""Add journal_entry_budget_match table and journal_entries.budget_matched
+
+Revision ID: 0b4e2f7a9c61
+Revises: f1b6d8a2c493
+Create Date: 2026-10-19 15:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0b4e2f7a9c61'
+down_revision = 'f1b6d8a2c493'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('journal_entry_budget_match',
+    sa.Column('journal_entry_id', sa.Integer(), nullable=False),
+    sa.Column('budget_id', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['budget_id'], ['budget.id'], ondelete='CASCADE'),
+    sa.ForeignKeyConstraint(['journal_entry_id'], ['journal_entries.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('journal_entry_id', 'budget_id')
+    )
+    with op.batch_alter_table('journal_entry_budget_match', schema=None) as batch_op:
+        batch_op.create_index('ix_journal_entry_budget_match_budget_id', ['budget_id', 'journal_entry_id'], unique=False)
+
+    # Existing entries start unmatched; run `flask sync-budget-matches` after upgrading
+    # (otherwise each client is matched on its first budget view or journal commit).
+    with op.batch_alter_table('journal_entries', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('budget_matched', sa.Boolean(), server_default=sa.false(), nullable=False))
+        batch_op.create_index('ix_journal_entries_client_id_budget_matched', ['client_id', 'budget_matched'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('journal_entries', schema=None) as batch_op:
+        batch_op.drop_index('ix_journal_entries_client_id_budget_matched')
+        batch_op.drop_column('budget_matched')
+
+    with op.batch_alter_table('journal_entry_budget_match', schema=None) as batch_op:
+        batch_op.drop_index('ix_journal_entry_budget_match_budget_id')
+
+    op.drop_table('journal_entry_budget_match')
@@ -0,0 +1,47 @@
+"""Store money amounts as integer cents
+
+Revision ID: 3c1f2a9d7b64
+Revises: dd078d4f033e
+Create Date: 2026-10-19 09:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3c1f2a9d7b64'
+down_revision = 'dd078d4f033e'
+branch_labels = None
+depends_on = None
+
+
+MONEY_COLUMNS = [
+    ('journal_entries', 'amount', False),
+    ('transaction', 'amount', False),
+    ('account', 'opening_balance', True),
+    ('account', 'current_balance', True),
+    ('budget', 'amount', False),
+]
+
+
+def upgrade():
+    for table, column, nullable in MONEY_COLUMNS:
+        op.execute(f'UPDATE "{table}" SET {column} = ROUND({column} * 100) WHERE {column} IS NOT NULL')
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            batch_op.alter_column(column,
+                                  existing_type=sa.Float(),
+                                  type_=sa.BigInteger(),
+                                  existing_nullable=nullable,
+                                  postgresql_using=f'{column}::bigint')
+
+
+def downgrade():
+    for table, column, nullable in MONEY_COLUMNS:
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            batch_op.alter_column(column,
+                                  existing_type=sa.BigInteger(),
+                                  type_=sa.Float(),
+                                  existing_nullable=nullable,
+                                  postgresql_using=f'{column}::double precision')
+        op.execute(f'UPDATE "{table}" SET {column} = {column} / 100.0 WHERE {column} IS NOT NULL')
@@ -0,0 +1,26 @@
+"""Add client.account_tree_version
+
+Revision ID: 3c8e1a5d7f24
+Revises: 0b4e2f7a9c61
+Create Date: 2026-10-19 16:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3c8e1a5d7f24'
+down_revision = '0b4e2f7a9c61'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('client', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('account_tree_version', sa.Integer(), server_default='0', nullable=False))
+
+
+def downgrade():
+    with op.batch_alter_table('client', schema=None) as batch_op:
+        batch_op.drop_column('account_tree_version')
@@ -0,0 +1,50 @@
+"""Add daily_spending table, notification rule targets and journal_entries (client_id, date) index
+
+Revision ID: 6d2f9b4e8a13
+Revises: 3c8e1a5d7f24
+Create Date: 2026-10-19 17:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '6d2f9b4e8a13'
+down_revision = '3c8e1a5d7f24'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Run `flask rebuild-daily-spending` after upgrading to fill in existing entries.
+    op.create_table('daily_spending',
+    sa.Column('client_id', sa.Integer(), nullable=False),
+    sa.Column('day', sa.Date(), nullable=False),
+    sa.Column('category', sa.String(length=120), nullable=False),
+    sa.Column('amount', sa.BigInteger(), nullable=False),
+    sa.ForeignKeyConstraint(['client_id'], ['client.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('client_id', 'day', 'category')
+    )
+
+    with op.batch_alter_table('notification_rule', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('category', sa.String(length=120), nullable=True))
+        batch_op.add_column(sa.Column('account_id', sa.Integer(), nullable=True))
+        batch_op.add_column(sa.Column('last_fired_key', sa.String(length=20), nullable=True))
+        batch_op.create_foreign_key('fk_notification_rule_account_id', 'account', ['account_id'], ['id'], ondelete='CASCADE')
+
+    with op.batch_alter_table('journal_entries', schema=None) as batch_op:
+        batch_op.create_index('ix_journal_entries_client_id_date', ['client_id', 'date'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('journal_entries', schema=None) as batch_op:
+        batch_op.drop_index('ix_journal_entries_client_id_date')
+
+    with op.batch_alter_table('notification_rule', schema=None) as batch_op:
+        batch_op.drop_constraint('fk_notification_rule_account_id', type_='foreignkey')
+        batch_op.drop_column('last_fired_key')
+        batch_op.drop_column('account_id')
+        batch_op.drop_column('category')
+
+    op.drop_table('daily_spending')
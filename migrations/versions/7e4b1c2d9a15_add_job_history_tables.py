@@ -0,0 +1,59 @@
+"""Add job history tables
+
+Revision ID: 7e4b1c2d9a15
+Revises: 3c1f2a9d7b64
+Create Date: 2026-10-19 10:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7e4b1c2d9a15'
+down_revision = '3c1f2a9d7b64'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('job_run',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('job_name', sa.String(length=120), nullable=False),
+    sa.Column('run_key', sa.String(length=50), nullable=False),
+    sa.Column('status', sa.String(length=50), nullable=False),
+    sa.Column('started_at', sa.DateTime(), nullable=True),
+    sa.Column('finished_at', sa.DateTime(), nullable=True),
+    sa.Column('clients_total', sa.Integer(), nullable=True),
+    sa.Column('clients_succeeded', sa.Integer(), nullable=True),
+    sa.Column('clients_failed', sa.Integer(), nullable=True),
+    sa.Column('clients_skipped', sa.Integer(), nullable=True),
+    sa.Column('items_processed', sa.Integer(), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('job_run', schema=None) as batch_op:
+        batch_op.create_index('ix_job_run_job_name_run_key', ['job_name', 'run_key'], unique=False)
+
+    op.create_table('job_run_result',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('job_run_id', sa.Integer(), nullable=False),
+    sa.Column('job_name', sa.String(length=120), nullable=False),
+    sa.Column('run_key', sa.String(length=50), nullable=False),
+    sa.Column('client_id', sa.Integer(), nullable=False),
+    sa.Column('status', sa.String(length=50), nullable=False),
+    sa.Column('items_processed', sa.Integer(), nullable=True),
+    sa.Column('duration_ms', sa.Integer(), nullable=True),
+    sa.Column('error', sa.Text(), nullable=True),
+    sa.Column('finished_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['client_id'], ['client.id'], ),
+    sa.ForeignKeyConstraint(['job_run_id'], ['job_run.id'], ),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('job_name', 'run_key', 'client_id', name='uq_job_run_result_client')
+    )
+
+
+def downgrade():
+    op.drop_table('job_run_result')
+    with op.batch_alter_table('job_run', schema=None) as batch_op:
+        batch_op.drop_index('ix_job_run_job_name_run_key')
+    op.drop_table('job_run')
@@ -0,0 +1,36 @@
+"""Add notification dedup keys, inbox indexes and user read cursors
+
+Revision ID: 8a5c3e7d1f62
+Revises: 6d2f9b4e8a13
+Create Date: 2026-10-19 18:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8a5c3e7d1f62'
+down_revision = '6d2f9b4e8a13'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('notification', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('dedup_key', sa.String(length=120), nullable=True))
+        batch_op.create_index('ix_notification_user_id_id', ['user_id', 'id'], unique=False)
+        batch_op.create_index('ix_notification_user_id_dedup_key', ['user_id', 'dedup_key'], unique=True)
+
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('last_read_notification_id', sa.Integer(), server_default='0', nullable=False))
+
+
+def downgrade():
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.drop_column('last_read_notification_id')
+
+    with op.batch_alter_table('notification', schema=None) as batch_op:
+        batch_op.drop_index('ix_notification_user_id_dedup_key')
+        batch_op.drop_index('ix_notification_user_id_id')
+        batch_op.drop_column('dedup_key')
@@ -0,0 +1,31 @@
+"""Add next_due_date and last_posted_date to recurring transaction
+
+Revision ID: a8d3f5e21c07
+Revises: 7e4b1c2d9a15
+Create Date: 2026-10-19 11:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a8d3f5e21c07'
+down_revision = '7e4b1c2d9a15'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Existing rows are scheduled by the recurring job on its next run (see app/recurring.py).
+    with op.batch_alter_table('recurring_transaction', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('next_due_date', sa.Date(), nullable=True))
+        batch_op.add_column(sa.Column('last_posted_date', sa.Date(), nullable=True))
+        batch_op.create_index('ix_recurring_transaction_next_due_date_client_id', ['next_due_date', 'client_id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('recurring_transaction', schema=None) as batch_op:
+        batch_op.drop_index('ix_recurring_transaction_next_due_date_client_id')
+        batch_op.drop_column('last_posted_date')
+        batch_op.drop_column('next_due_date')
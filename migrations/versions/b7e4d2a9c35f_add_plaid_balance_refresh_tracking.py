@@ -0,0 +1,32 @@
+"""Track Plaid balance refreshes per item and index Plaid account lookups
+
+Revision ID: b7e4d2a9c35f
+Revises: 8a5c3e7d1f62
+Create Date: 2026-10-19 20:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b7e4d2a9c35f'
+down_revision = '8a5c3e7d1f62'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('plaid_item', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('balances_refreshed_at', sa.DateTime(), nullable=True))
+
+    with op.batch_alter_table('plaid_account', schema=None) as batch_op:
+        batch_op.create_index('ix_plaid_account_plaid_item_id_account_id', ['plaid_item_id', 'account_id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('plaid_account', schema=None) as batch_op:
+        batch_op.drop_index('ix_plaid_account_plaid_item_id_account_id')
+
+    with op.batch_alter_table('plaid_item', schema=None) as batch_op:
+        batch_op.drop_column('balances_refreshed_at')
@@ -0,0 +1,57 @@
+"""Add recurring candidate and detection state tables
+
+Revision ID: c52e9b7f1d38
+Revises: a8d3f5e21c07
+Create Date: 2026-10-19 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c52e9b7f1d38'
+down_revision = 'a8d3f5e21c07'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('recurring_candidate',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('client_id', sa.Integer(), nullable=False),
+    sa.Column('merchant_key', sa.String(length=255), nullable=False),
+    sa.Column('amount_bucket', sa.Integer(), nullable=False),
+    sa.Column('description', sa.String(length=255), nullable=False),
+    sa.Column('amount', sa.BigInteger(), nullable=False),
+    sa.Column('frequency', sa.String(length=50), nullable=False),
+    sa.Column('interval_days', sa.Float(), nullable=False),
+    sa.Column('gap_mad_days', sa.Float(), nullable=False),
+    sa.Column('occurrences', sa.Integer(), nullable=False),
+    sa.Column('first_date', sa.Date(), nullable=False),
+    sa.Column('last_date', sa.Date(), nullable=False),
+    sa.Column('next_expected_date', sa.Date(), nullable=True),
+    sa.Column('confidence', sa.Float(), nullable=False),
+    sa.Column('status', sa.String(length=50), nullable=False),
+    sa.Column('updated_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['client_id'], ['client.id'], ),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('client_id', 'merchant_key', 'amount_bucket', name='uq_recurring_candidate_merchant_amount')
+    )
+    with op.batch_alter_table('recurring_candidate', schema=None) as batch_op:
+        batch_op.create_index('ix_recurring_candidate_client_id_status', ['client_id', 'status'], unique=False)
+
+    op.create_table('recurring_detection_state',
+    sa.Column('client_id', sa.Integer(), nullable=False),
+    sa.Column('last_transaction_id', sa.Integer(), nullable=False),
+    sa.Column('last_run_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['client_id'], ['client.id'], ),
+    sa.PrimaryKeyConstraint('client_id')
+    )
+
+
+def downgrade():
+    op.drop_table('recurring_detection_state')
+    with op.batch_alter_table('recurring_candidate', schema=None) as batch_op:
+        batch_op.drop_index('ix_recurring_candidate_client_id_status')
+    op.drop_table('recurring_candidate')
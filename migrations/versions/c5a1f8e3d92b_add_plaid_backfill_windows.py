@@ -0,0 +1,38 @@
+"""Add Plaid backfill window checkpoints
+
+Revision ID: c5a1f8e3d92b
+Revises: b7e4d2a9c35f
+Create Date: 2026-10-19 21:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c5a1f8e3d92b'
+down_revision = 'b7e4d2a9c35f'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('plaid_backfill_window',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('plaid_item_id', sa.Integer(), nullable=False),
+    sa.Column('account_key', sa.String(length=40), nullable=False),
+    sa.Column('start_date', sa.Date(), nullable=False),
+    sa.Column('end_date', sa.Date(), nullable=False),
+    sa.Column('next_offset', sa.Integer(), nullable=False),
+    sa.Column('total_transactions', sa.Integer(), nullable=True),
+    sa.Column('added', sa.Integer(), nullable=False),
+    sa.Column('completed_at', sa.DateTime(), nullable=True),
+    sa.Column('updated_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['plaid_item_id'], ['plaid_item.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('plaid_item_id', 'account_key', 'start_date', 'end_date', name='uq_plaid_backfill_window')
+    )
+
+
+def downgrade():
+    op.drop_table('plaid_backfill_window')
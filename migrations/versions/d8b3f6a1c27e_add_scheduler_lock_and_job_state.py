@@ -0,0 +1,38 @@
+"""Add scheduler leases and scheduled job state
+
+Revision ID: d8b3f6a1c27e
+Revises: c5a1f8e3d92b
+Create Date: 2026-10-19 23:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd8b3f6a1c27e'
+down_revision = 'c5a1f8e3d92b'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('scheduler_lock',
+    sa.Column('name', sa.String(length=120), nullable=False),
+    sa.Column('owner', sa.String(length=120), nullable=False),
+    sa.Column('expires_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('name')
+    )
+    op.create_table('scheduled_job_state',
+    sa.Column('job_id', sa.String(length=120), nullable=False),
+    sa.Column('last_scheduled_for', sa.DateTime(), nullable=True),
+    sa.Column('last_started_at', sa.DateTime(), nullable=True),
+    sa.Column('last_finished_at', sa.DateTime(), nullable=True),
+    sa.Column('last_error', sa.Text(), nullable=True),
+    sa.PrimaryKeyConstraint('job_id')
+    )
+
+
+def downgrade():
+    op.drop_table('scheduled_job_state')
+    op.drop_table('scheduler_lock')
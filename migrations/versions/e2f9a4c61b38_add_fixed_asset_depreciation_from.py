@@ -0,0 +1,33 @@
+"""Add fixed_asset.depreciation_from
+
+Revision ID: e2f9a4c61b38
+Revises: d8b3f6a1c27e
+Create Date: 2026-10-20 09:00:00.000000
+
+"""
+from datetime import date
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e2f9a4c61b38'
+down_revision = 'd8b3f6a1c27e'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('fixed_asset', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('depreciation_from', sa.Date(), nullable=True))
+
+    # Existing assets were depreciated one month at a time from whenever the job first saw
+    # them; catching up only starts from this month, so their earlier months are not backfilled.
+    op.get_bind().execute(sa.text('UPDATE fixed_asset SET depreciation_from = :month'),
+                          {'month': date.today().replace(day=1)})
+
+
+def downgrade():
+    with op.batch_alter_table('fixed_asset', schema=None) as batch_op:
+        batch_op.drop_column('depreciation_from')
@@ -0,0 +1,32 @@
+"""Add (client_id, date) index to audit trail and backfill client_id
+
+Revision ID: e3a7c9d41b52
+Revises: c52e9b7f1d38
+Create Date: 2026-10-19 13:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e3a7c9d41b52'
+down_revision = 'c52e9b7f1d38'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Older entries were written without a client; they belong to their user's client.
+    op.execute(
+        'UPDATE audit_trail SET client_id = '
+        '(SELECT "user".client_id FROM "user" WHERE "user".id = audit_trail.user_id) '
+        'WHERE client_id IS NULL'
+    )
+    with op.batch_alter_table('audit_trail', schema=None) as batch_op:
+        batch_op.create_index('ix_audit_trail_client_id_date', ['client_id', 'date'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('audit_trail', schema=None) as batch_op:
+        batch_op.drop_index('ix_audit_trail_client_id_date')
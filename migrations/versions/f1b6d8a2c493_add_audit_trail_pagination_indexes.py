@@ -0,0 +1,30 @@
+"""Add audit trail indexes for keyset pagination and action filtering
+
+Revision ID: f1b6d8a2c493
+Revises: e3a7c9d41b52
+Create Date: 2026-10-19 14:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f1b6d8a2c493'
+down_revision = 'e3a7c9d41b52'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('audit_trail', schema=None) as batch_op:
+        batch_op.drop_index('ix_audit_trail_client_id_date')
+        batch_op.create_index('ix_audit_trail_client_id_date_id', ['client_id', 'date', 'id'], unique=False)
+        batch_op.create_index('ix_audit_trail_client_id_action_date', ['client_id', 'action', 'date'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('audit_trail', schema=None) as batch_op:
+        batch_op.drop_index('ix_audit_trail_client_id_action_date')
+        batch_op.drop_index('ix_audit_trail_client_id_date_id')
+        batch_op.create_index('ix_audit_trail_client_id_date', ['client_id', 'date'], unique=False)
@@ -43,11 +43,16 @@ echo "Python environment setup complete."
 # --- 4. Database Setup ---
 echo "Running database migrations..."
 flask db upgrade
+flask sync-budget-matches
+flask rebuild-daily-spending
 
 
 
 echo "Database migrations complete."
 
+# Precompile templates so new workers don't compile them on their first requests.
+flask compile-templates
+
 # --- 5. Generate and Set SECRET_KEY ---
 echo "Generating SECRET_KEY..."
 SECRET_KEY=$(python3 -c 'import os; print(os.urandom(24).hex())')
@@ -72,7 +77,9 @@ WorkingDirectory=$APP_DIR
 Environment=\"PATH=$VENV_DIR/bin\"
 Environment=\"FLASK_ENV=production\"
 Environment=\"SECRET_KEY=$SECRET_KEY\"
-ExecStart=$VENV_DIR/bin/gunicorn --workers 3 --bind 0.0.0.0:8000 wsgi:app
+Environment=\"EVENTS_FANOUT_DB=$APP_DIR/instance/events.db\"
+Environment=\"SCHEDULER_ENABLED=0\"
+ExecStart=$VENV_DIR/bin/gunicorn --workers 3 --threads 8 --bind 0.0.0.0:8000 wsgi:app
 ExecReload=/bin/kill -s HUP \$MAINPID
 KillMode=mixed
 Restart=on-failure
@@ -82,6 +89,29 @@ WantedBy=multi-user.target
 EOF"
 echo "Gunicorn Systemd service file created."
 
+# Scheduled jobs run once, in their own process, rather than in every Gunicorn worker.
+echo "Creating scheduler Systemd service file..."
+sudo bash -c "cat > /etc/systemd/system/$APP_NAME-scheduler.service <<EOF
+[Unit]
+Description=Scheduled jobs for $APP_NAME
+After=network.target
+
+[Service]
+User=$USER
+Group=www-data
+WorkingDirectory=$APP_DIR
+Environment=\"PATH=$VENV_DIR/bin\"
+Environment=\"FLASK_ENV=production\"
+Environment=\"SECRET_KEY=$SECRET_KEY\"
+Environment=\"EVENTS_FANOUT_DB=$APP_DIR/instance/events.db\"
+ExecStart=$VENV_DIR/bin/flask --app wsgi:app run-scheduler
+Restart=on-failure
+
+[Install]
+WantedBy=multi-user.target
+EOF"
+echo "Scheduler Systemd service file created."
+
 
 
 # --- 8. Enable and Start Services ---
@@ -89,6 +119,8 @@ echo "Enabling and starting services..."
 sudo systemctl daemon-reload
 sudo systemctl start $APP_NAME
 sudo systemctl enable $APP_NAME
+sudo systemctl start $APP_NAME-scheduler
+sudo systemctl enable $APP_NAME-scheduler
 echo "Services enabled and started."
 
 echo "Deployment complete! Your application should be accessible via your EC2 instance's public IP address."
@@ -1,16 +1,17 @@
 import pytest
+from datetime import datetime
 from app import create_app, db
 from app.models import Client, Account, JournalEntries, Transaction, Budget, User, Role
 
 
 @pytest.fixture
 def app():
-    app = create_app()
-    app.config.update({
+    app = create_app({
         "TESTING": True,
         'SQLALCHEMY_DATABASE_URI': 'sqlite:///:memory:',
         'WTF_CSRF_ENABLED': False,
-        'SECRET_KEY': 'test_secret'
+        'SECRET_KEY': 'test_secret',
+        'JINJA_BYTECODE_CACHE_DIR': ''
     })
 
     with app.app_context():
@@ -38,7 +39,12 @@ def client(app):
     return app.test_client()
 
 @pytest.fixture
-def authenticated_client(client):
+def authenticated_client(client, app):
+    # main's before_request sends requests without a selected client to the client list, /login included.
+    with app.app_context():
+        client_id = User.query.filter_by(username='testuser').first().client_id
+    with client.session_transaction() as session:
+        session['client_id'] = client_id
     response = client.post('/login', data={'username': 'testuser', 'password': 'password'}, follow_redirects=True)
     assert response.status_code == 200
     yield client
@@ -117,4 +123,727 @@ def test_dashboard_loads(authenticated_client):
     # Select the client
     response = authenticated_client.get(f'/clients/client_detail/{test_client.id}', follow_redirects=True)
     assert response.status_code == 200
-    assert b'Dashboard' in response.data
\ No newline at end of file
+    assert b'Dashboard' in response.data
+
+
+def test_money_amounts_are_exact(app):
+    """Test that amounts are stored as cents and summed without float drift."""
+    client = Client.query.first()
+    account = Account(name='Cash', type='Asset', client_id=client.id)
+    db.session.add(account)
+    db.session.commit()
+    for _ in range(10):
+        db.session.add(JournalEntries(date=datetime(2024, 1, 1).date(), description='Coffee', amount=0.1,
+                                      debit_account_id=account.id, credit_account_id=account.id,
+                                      client_id=client.id))
+    db.session.add(JournalEntries(date=datetime(2024, 1, 1).date(), description='Odd', amount=0.1 + 0.2,
+                                  debit_account_id=account.id, credit_account_id=account.id,
+                                  client_id=client.id))
+    db.session.commit()
+
+    raw = db.session.execute(db.text("SELECT amount FROM journal_entries WHERE description = 'Odd'")).scalar()
+    assert raw == 30
+    total = db.session.query(db.func.sum(JournalEntries.amount)).scalar()
+    assert total == 1.3
+    assert JournalEntries.query.filter(JournalEntries.amount == 0.3).count() == 1
+
+
+def test_client_job_isolates_failures_and_skips_completed_clients(app):
+    """Test that a per-client job commits per client and can be re-run safely."""
+    from app.jobs import run_client_job
+    good = Client.query.first()
+    bad = Client(business_name='Failing Client')
+    db.session.add(bad)
+    db.session.commit()
+    calls = []
+
+    def job(client_id, run_date):
+        calls.append(client_id)
+        db.session.add(Account(name='Job Account', type='Asset', client_id=client_id))
+        if client_id == bad.id:
+            raise ValueError('boom')
+        return 1
+
+    job_run = run_client_job('test_job', job, run_key='2024-01', max_workers=1)
+    assert (job_run.status, job_run.clients_succeeded, job_run.clients_failed) == ('partial', 1, 1)
+    assert sorted(calls) == sorted([good.id, bad.id])
+    assert Account.query.filter_by(name='Job Account').count() == 1
+
+    calls.clear()
+    job_run = run_client_job('test_job', job, run_key='2024-01', max_workers=1)
+    assert calls == [bad.id]
+    assert job_run.clients_skipped == 1
+
+    # Work that only fails when it is flushed or committed is isolated the same way.
+    from app.models import JobRunResult
+    def fails_at_commit(client_id, run_date):
+        db.session.add(Account(name='Orphan', type='Asset', client_id=client_id if client_id == good.id else -1))
+        return 1
+
+    job_run = run_client_job('commit_job', fails_at_commit, run_key='2024-01', max_workers=1)
+    assert (job_run.status, job_run.clients_succeeded, job_run.clients_failed) == ('partial', 1, 1)
+    assert JobRunResult.query.filter_by(job_name='commit_job', client_id=bad.id).one().status == 'failed'
+    assert Account.query.filter_by(name='Orphan').count() == 1
+
+    # Manual runs use the run key of the job's schedule.
+    from app.tasks import CLIENT_JOBS
+    moment = datetime(2024, 1, 1, 5, 30)
+    assert CLIENT_JOBS['detect_recurring_transactions'][1](moment) == '2024-01-01T05'
+    assert CLIENT_JOBS['refresh_plaid_balances'][1](moment) == '2024-01-01T05:30'
+
+
+def test_depreciation_posts_catch_up_months_once(app, authenticated_client):
+    """Test that depreciation catches up missed months and is not posted twice."""
+    from app.depreciation import post_depreciation, get_schedule
+    from app.models import FixedAsset, Depreciation
+    client = Client.query.first()
+    asset = FixedAsset(name='Laptop', purchase_date=datetime(2024, 1, 15).date(), purchase_price=1000,
+                       salvage_value=100, useful_life=3, depreciation_method='straight-line', client_id=client.id)
+    # Predates catch-up posting, so months before depreciation_from are left alone.
+    legacy = FixedAsset(name='Desk', purchase_date=datetime(2023, 6, 1).date(), purchase_price=600,
+                        salvage_value=0, useful_life=5, depreciation_method='straight-line', client_id=client.id,
+                        depreciation_from=datetime(2024, 3, 1).date())
+    db.session.add_all([asset, legacy])
+    db.session.commit()
+
+    assert sum(amount for _, amount in get_schedule(asset)) == 90000
+    assert post_depreciation(client.id, datetime(2024, 4, 1).date()) == 5
+    db.session.commit()
+    assert post_depreciation(client.id, datetime(2024, 4, 1).date()) == 0
+    assert Depreciation.query.filter_by(fixed_asset_id=asset.id).count() == 3
+    assert [d.date for d in Depreciation.query.filter_by(fixed_asset_id=legacy.id).order_by(Depreciation.date)] == [
+        datetime(2024, 3, 1).date(), datetime(2024, 4, 1).date()]
+
+    response = authenticated_client.post('/fixed_assets/add_fixed_asset', data={
+        'name': 'Van', 'purchase_date': '2024-01-01', 'cost': '20000', 'useful_life': '5', 'salvage_value': '0',
+        'depreciation_method': 'sum-of-years'}, follow_redirects=True)
+    assert b'Unknown depreciation method' in response.data
+    assert FixedAsset.query.filter_by(name='Van').count() == 0
+
+
+def test_recurring_entries_catch_up_from_next_due_date(app):
+    """Test that due recurrences post every missed occurrence and advance next_due_date."""
+    from app.recurring import post_due_recurring
+    from app.models import RecurringTransaction
+    client = Client.query.first()
+    account = Account(name='Rent', type='Expense', client_id=client.id)
+    db.session.add(account)
+    db.session.commit()
+    recurring = RecurringTransaction(description='Office rent', amount=1500, frequency='monthly',
+                                     start_date=datetime(2024, 1, 31).date(), debit_account_id=account.id,
+                                     credit_account_id=account.id, client_id=client.id,
+                                     next_due_date=datetime(2024, 1, 31).date())
+    db.session.add(recurring)
+    db.session.commit()
+
+    assert post_due_recurring(client.id, datetime(2024, 4, 15).date()) == 3
+    db.session.commit()
+    dates = [e.date for e in JournalEntries.query.order_by(JournalEntries.date)]
+    assert dates == [datetime(2024, 1, 31).date(), datetime(2024, 2, 29).date(), datetime(2024, 3, 31).date()]
+    assert recurring.next_due_date == datetime(2024, 4, 30).date()
+    assert post_due_recurring(client.id, datetime(2024, 4, 15).date()) == 0
+
+    # A recurrence that ended before it was ever scheduled is not picked up again.
+    from app.recurring import clients_with_due_recurring
+    db.session.add(RecurringTransaction(description='Old lease', amount=900, frequency='monthly',
+                                        start_date=datetime(2023, 1, 1).date(), end_date=datetime(2023, 12, 1).date(),
+                                        debit_account_id=account.id, credit_account_id=account.id, client_id=client.id))
+    db.session.commit()
+    assert clients_with_due_recurring(datetime(2024, 4, 15).date()) == []
+
+
+def test_recurring_detection_groups_fuzzy_merchants_and_keeps_dismissals(app):
+    """Test that detection tolerates noisy descriptions, amounts and gaps, and respects dismissals."""
+    from app.recurring_detection import detect_recurring_for_client
+    from app.models import RecurringCandidate
+    client = Client.query.first()
+    days = [datetime(2024, 1, 3), datetime(2024, 2, 2), datetime(2024, 3, 4), datetime(2024, 4, 3), datetime(2024, 5, 2)]
+    for i, day in enumerate(days):
+        db.session.add(Transaction(date=day.date(), description=f'SQ *NETFLIX #{1000 + i}', amount=-(15.49 + i * 0.1),
+                                   client_id=client.id))
+    db.session.commit()
+
+    assert detect_recurring_for_client(client.id, datetime(2024, 6, 1).date()) == 1
+    db.session.commit()
+    candidate = RecurringCandidate.query.one()
+    assert (candidate.merchant_key, candidate.frequency, candidate.occurrences) == ('netflix', 'monthly', 5)
+
+    candidate.status = 'dismissed'
+    db.session.add(Transaction(date=datetime(2024, 6, 3).date(), description='SQ *NETFLIX #2000', amount=-15.99,
+                               client_id=client.id))
+    db.session.commit()
+    detect_recurring_for_client(client.id, datetime(2024, 6, 10).date())
+    db.session.commit()
+    assert RecurringCandidate.query.one().status == 'dismissed'
+    assert detect_recurring_for_client(client.id, datetime(2024, 6, 10).date()) == 0
+
+    # Only the touched merchant is re-analysed, and a price rise into a new amount bucket stays dismissed.
+    for i, day in enumerate([datetime(2024, 7, 3), datetime(2024, 8, 2), datetime(2024, 9, 3), datetime(2024, 10, 3)]):
+        db.session.add(Transaction(date=day.date(), description=f'SQ *NETFLIX #{3000 + i}', amount=-22.99,
+                                   client_id=client.id))
+    db.session.add(Transaction(date=datetime(2024, 10, 4).date(), description='Hardware store', amount=-40,
+                               client_id=client.id))
+    db.session.commit()
+    assert detect_recurring_for_client(client.id, datetime(2024, 10, 10).date()) == 2
+    db.session.commit()
+    assert [c.status for c in RecurringCandidate.query.order_by(RecurringCandidate.id)] == ['dismissed', 'dismissed']
+
+    # An open subscription whose price moves to a new bucket leaves one open candidate at the new price.
+    for month in range(1, 9):
+        db.session.add(Transaction(date=datetime(2024, month, 12).date(), description=f'SPOTIFY #{4000 + month}',
+                                   amount=-9.99 if month <= 4 else -13.99, client_id=client.id))
+        db.session.commit()
+        detect_recurring_for_client(client.id, datetime(2024, month, 13).date())
+        db.session.commit()
+    spotify = RecurringCandidate.query.filter_by(merchant_key='spotify').order_by(RecurringCandidate.id).all()
+    assert [(c.status, c.amount) for c in spotify] == [('superseded', -9.99), ('open', -13.99)]
+
+    # Open candidates with no charges left in the lookback window expire.
+    detect_recurring_for_client(client.id, datetime(2027, 1, 1).date())
+    db.session.commit()
+    assert [c.status for c in RecurringCandidate.query.filter_by(merchant_key='spotify')] == ['superseded', 'expired']
+
+
+def test_bulk_approve_transactions(authenticated_client, app, tmp_path):
+    """Test that approving many transactions creates their entries and a single audit record."""
+    import json
+    from app.audit import flush_file_sink
+    from app.models import AuditTrail
+    client = Client.query.first()
+    account = Account(name='Checking', type='Asset', client_id=client.id)
+    db.session.add(account)
+    db.session.commit()
+    transactions = [Transaction(date=datetime(2024, 1, i + 1).date(), description=f'Purchase {i}', amount=-10 - i,
+                                client_id=client.id) for i in range(7)]
+    db.session.add_all(transactions)
+    db.session.commit()
+    # Logging in needs a selected client, which the fixture doesn't have.
+    authenticated_client.get(f'/clients/client_detail/{client.id}')
+    authenticated_client.post('/login', data={'username': 'testuser', 'password': 'password'})
+
+    def approve(batch):
+        data = {'transaction_ids': [str(t.id) for t in batch]}
+        for t in batch[:-1]:
+            data[f'debit_account_{t.id}'] = account.id
+            data[f'credit_account_{t.id}'] = account.id
+        return authenticated_client.post('/transactions/approve_transactions', data=data)
+
+    assert approve(transactions[:5]).status_code == 302
+    assert Transaction.query.filter_by(is_approved=True).count() == 4
+    assert JournalEntries.query.count() == 4
+    assert JournalEntries.query.filter_by(transaction_id=transactions[0].id).one().amount == 10
+    assert AuditTrail.query.count() == 1
+
+    # With an audit log file, bulk approvals are written there instead.
+    app.config['AUDIT_LOG_FILE'] = str(tmp_path / 'audit.jsonl')
+    approve(transactions[4:])
+    flush_file_sink()
+    assert Transaction.query.filter_by(is_approved=True).count() == 6
+    assert AuditTrail.query.count() == 1
+    lines = [json.loads(line) for line in open(tmp_path / 'audit.jsonl')]
+    assert [line['action'] for line in lines] == ['Approved 2 transactions and generated journal entries']
+    assert lines[0]['details'].splitlines() == [f'{transactions[4].id}: Purchase 4', f'{transactions[5].id}: Purchase 5']
+
+
+def test_audit_records_follow_the_callers_transaction(app):
+    """Test that buffered audit records are written by the caller's commit and dropped on rollback."""
+    from app import audit
+    from app.models import AuditTrail
+    client = Client.query.first()
+    audit.record('Kept', client_id=client.id)
+    audit.record('Also kept', client_id=client.id)
+    assert AuditTrail.query.count() == 0
+    db.session.commit()
+    audit.record('Rolled back', client_id=client.id)
+    db.session.rollback()
+    db.session.commit()
+    assert sorted(a.action for a in AuditTrail.query.filter_by(client_id=client.id)) == ['Also kept', 'Kept']
+
+
+def test_audit_trail_pages_and_archive(app, tmp_path):
+    """Test keyset pagination and that archived months stay searchable."""
+    from app import audit
+    from app.models import AuditTrail
+    app.config['AUDIT_ARCHIVE_DIR'] = str(tmp_path)
+    client = Client.query.first()
+    for i in range(5):
+        db.session.add(AuditTrail(date=datetime(2023, 1 + i, 10), action=f'Edited journal entry: {i}', client_id=client.id))
+        db.session.add(AuditTrail(date=datetime(2024, 6, 1 + i), action=f'Deleted fixed asset: {i}', client_id=client.id))
+    db.session.commit()
+
+    first, cursor = audit.query_page(client.id, limit=4)
+    second, cursor = audit.query_page(client.id, cursor=cursor, limit=4)
+    last, cursor = audit.query_page(client.id, cursor=cursor, limit=4)
+    assert [len(first), len(second), len(last), cursor] == [4, 4, 2, None]
+    assert first[0]['action'] == 'Deleted fixed asset: 4' and last[-1]['action'] == 'Edited journal entry: 0'
+    entries, _ = audit.query_page(client.id, action='Edited', end=datetime(2023, 2, 10).date())
+    assert [e['action'] for e in entries] == ['Edited journal entry: 1', 'Edited journal entry: 0']
+    for limit in (0, -3):
+        entries, cursor = audit.query_page(client.id, limit=limit)
+        assert len(entries) == 1 and cursor
+
+    assert audit.archive_client_audit_trail(client.id, datetime(2024, 7, 1).date()) == 5
+    db.session.commit()
+    assert AuditTrail.query.count() == 5
+    archived, cursor = audit.search_archive(client.id, limit=3)
+    assert [e['action'] for e in archived] == [f'Edited journal entry: {i}' for i in (4, 3, 2)]
+    archived, cursor = audit.search_archive(client.id, cursor=cursor, limit=3)
+    assert [e['action'] for e in archived] == ['Edited journal entry: 1', 'Edited journal entry: 0'] and cursor is None
+
+
+def test_budget_matches_follow_entry_and_budget_changes(app):
+    """Test that journal_entry_budget_match tracks entry edits, bulk inserts and budget edits."""
+    from sqlalchemy import insert
+    from app.models import Category
+    from app.utils import get_budgets_actual_spent, get_miscellaneous_spending_breakdown
+    client = Client.query.first()
+    expense = Account(name='Expenses', type='Expense', client_id=client.id)
+    cash = Account(name='Cash', type='Asset', client_id=client.id)
+    groceries = Category(name='Groceries', client_id=client.id)
+    db.session.add_all([expense, cash, groceries])
+    db.session.commit()
+    budget = Budget(name='Food', amount=500, period='monthly', start_date=datetime(2024, 1, 1).date(),
+                    end_date=datetime(2024, 1, 31).date(), client_id=client.id, keywords='cafe', categories=[groceries])
+    misc = Budget(name='Misc', amount=100, period='monthly', start_date=datetime(2024, 1, 1).date(),
+                  end_date=datetime(2024, 1, 31).date(), client_id=client.id, is_miscellaneous=True)
+    db.session.add_all([budget, misc])
+    entry = JournalEntries(date=datetime(2024, 1, 5).date(), description='Market', amount=40, category='Groceries',
+                           debit_account_id=expense.id, credit_account_id=cash.id, client_id=client.id)
+    db.session.add(entry)
+    db.session.execute(insert(JournalEntries), [
+        {'date': datetime(2024, 1, 6).date(), 'description': 'Corner Cafe', 'amount': 5, 'category': 'Dining',
+         'debit_account_id': expense.id, 'credit_account_id': cash.id, 'client_id': client.id},
+        {'date': datetime(2024, 1, 7).date(), 'description': 'Cinema', 'amount': 12, 'category': 'Fun',
+         'debit_account_id': expense.id, 'credit_account_id': cash.id, 'client_id': client.id},
+    ])
+    db.session.commit()
+    window = (datetime(2024, 1, 1).date(), datetime(2024, 1, 31).date())
+    assert get_budgets_actual_spent([budget.id], *window)[budget.id]['actual_spent'] == 45
+    assert get_miscellaneous_spending_breakdown(misc, *window) == [('Fun', 12)]
+
+    entry.category = 'Fun'
+    db.session.commit()
+    assert get_budgets_actual_spent([budget.id], *window)[budget.id]['actual_spent'] == 5
+    budget.keywords = 'cafe, cinema'
+    db.session.commit()
+    assert get_budgets_actual_spent([budget.id], *window)[budget.id]['actual_spent'] == 17
+    assert get_miscellaneous_spending_breakdown(misc, *window) == [('Fun', 40)]
+    from app.budgeting import miscellaneous_spending
+    assert miscellaneous_spending(client.id, *window) == {
+        'total': 57, 'covered': 17, 'uncovered': 40,
+        'uncovered_by_day': {datetime(2024, 1, 5).date(): 40, datetime(2024, 1, 6).date(): 0, datetime(2024, 1, 7).date(): 0}}
+
+    # Deleting outside the ORM relies on the ON DELETE CASCADE, which SQLite only honours with foreign_keys on.
+    from app.models import JournalEntryBudgetMatch
+    cafe_id = JournalEntries.query.filter_by(description='Corner Cafe').one().id
+    db.session.execute(db.text('DELETE FROM journal_entries WHERE id = :id'), {'id': cafe_id})
+    db.session.commit()
+    assert JournalEntryBudgetMatch.query.filter_by(journal_entry_id=cafe_id).count() == 0
+
+    # Renaming a category re-matches the entries filed under its old and new names.
+    groceries.name = 'Fun'
+    db.session.commit()
+    assert get_budgets_actual_spent([budget.id], *window)[budget.id]['actual_spent'] == 52
+
+    # Reads only use stored matches; entries written outside the ORM wait for a sync.
+    db.session.execute(insert(JournalEntries.__table__).values(
+        date=datetime(2024, 1, 8).date(), description='Cafe latte', amount=3, category='Dining',
+        debit_account_id=expense.id, credit_account_id=cash.id, client_id=client.id, budget_matched=False))
+    db.session.commit()
+    assert get_budgets_actual_spent([budget.id], *window)[budget.id]['actual_spent'] == 52
+    assert JournalEntries.query.filter_by(budget_matched=False).count() == 1
+    from app.budgeting import sync_budget_matches
+    assert sync_budget_matches(client.id) == 1
+    db.session.commit()
+    assert get_budgets_actual_spent([budget.id], *window)[budget.id]['actual_spent'] == 55
+
+    # Bulk updates skip the flush hooks; changing a matched column still re-matches the entries.
+    JournalEntries.query.filter_by(description='Market').update({'category': 'Dining'})
+    db.session.commit()
+    assert get_budgets_actual_spent([budget.id], *window)[budget.id]['actual_spent'] == 15
+
+
+def test_budget_tree_levels_descendants_and_totals(app):
+    """Test that the budget tree rolls up amounts and levels without walking relationships."""
+    from app.budgeting import load_budget_tree
+    client = Client.query.first()
+    start, end = datetime(2024, 1, 1).date(), datetime(2024, 1, 31).date()
+    home = Budget(name='Home', amount=100, period='monthly', start_date=start, end_date=end, client_id=client.id)
+    db.session.add(home)
+    db.session.commit()
+    utilities = Budget(name='Utilities', amount=50, period='monthly', start_date=start, end_date=end, client_id=client.id, parent_id=home.id)
+    db.session.add(utilities)
+    db.session.commit()
+    power = Budget(name='Power', amount=20, period='monthly', start_date=start, end_date=end, client_id=client.id, parent_id=utilities.id)
+    db.session.add(power)
+    db.session.commit()
+
+    tree = load_budget_tree(client.id)
+    assert [b.name for b in tree.roots] == ['Home']
+    assert [b.name for b in tree.descendants(home.id)] == ['Utilities', 'Power']
+    assert (tree.level(power.id), tree.total_budgeted(home.id), tree.total_budgeted(utilities.id)) == (2, 170, 70)
+    assert tree.total_budgeted(home.id) == home.total_budgeted
+
+
+def test_account_tree_cache_and_balances(app):
+    """Test that the account tree follows account edits and rolls balances up to parents."""
+    from app.account_tree import load_account_tree
+    from app.utils import get_account_choices, get_account_tree, update_all_balances
+    client = Client.query.first()
+    assets = Account(name='Assets', type='Asset', opening_balance=0, client_id=client.id)
+    income = Account(name='Income', type='Revenue', opening_balance=0, client_id=client.id)
+    db.session.add_all([assets, income])
+    db.session.commit()
+    bank = Account(name='Bank', type='Asset', opening_balance=10, client_id=client.id, parent_id=assets.id)
+    cash = Account(name='Cash', type='Asset', opening_balance=2.5, client_id=client.id, parent_id=assets.id)
+    db.session.add_all([bank, cash])
+    db.session.commit()
+    assert get_account_choices(client.id) == [
+        (assets.id, 'Assets', 0), (bank.id, 'Bank', 1), (cash.id, 'Cash', 1), (income.id, 'Income', 0)]
+
+    cached = load_account_tree(client.id)
+    assert load_account_tree(client.id) is cached
+    cash.parent_id = bank.id
+    db.session.commit()
+    tree = load_account_tree(client.id)
+    assert tree is not cached
+    assert tree.descendant_ids(assets.id) == [bank.id, cash.id]
+
+    db.session.add(JournalEntries(date=datetime(2024, 1, 5).date(), description='Sale', amount=0.1,
+                                  debit_account_id=cash.id, credit_account_id=income.id, client_id=client.id))
+    db.session.commit()
+    update_all_balances(client.id)
+    assert (cash.current_balance, bank.current_balance, assets.current_balance, income.current_balance) == (2.6, 2.6, 2.6, 0.1)
+    report = get_account_tree([assets, income])
+    assert [(row['name'], row['balance']) for row in report] == [('Assets', 12.6), ('Income', 0.1)]
+    assert report[0]['children'][0]['children'][0]['balance'] == 2.6
+
+
+def test_notification_rules_fire_as_entries_post(app, tmp_path):
+    """Test that spending and balance rules fire on commit, once per period, through their channels."""
+    import json
+    from app.models import NotificationRule, Notification, DailySpending
+    from app.notifications import flush_delivery_queue
+    app.config['NOTIFY_OUTBOX_DIR'] = str(tmp_path)
+    client = Client.query.first()
+    client.contact_email = 'owner@example.com'
+    food = Account(name='Food', type='Expense', opening_balance=0, client_id=client.id)
+    bank = Account(name='Bank', type='Asset', opening_balance=100, client_id=client.id)
+    db.session.add_all([food, bank])
+    db.session.commit()
+    db.session.add_all([
+        NotificationRule(name='Daily', criteria_type='daily_spending', criteria_value=50, notification_method='in_app', client_id=client.id),
+        NotificationRule(name='Groceries', criteria_type='category_spending', criteria_value=20, category='Groceries',
+                         notification_method='email', client_id=client.id),
+        NotificationRule(name='Low cash', criteria_type='balance_below', criteria_value=40, account_id=bank.id,
+                         notification_method='in_app', client_id=client.id),
+    ])
+    db.session.commit()
+
+    today = datetime.now().date()
+    def spend(amount, category):
+        db.session.add(JournalEntries(date=today, description='Shop', amount=amount, category=category,
+                                      debit_account_id=food.id, credit_account_id=bank.id, client_id=client.id))
+        db.session.commit()
+
+    spend(15, 'Groceries')
+    assert Notification.query.count() == 0
+    spend(30, 'Groceries')
+    assert db.session.get(DailySpending, (client.id, today, 'Groceries')).amount == 45
+    flush_delivery_queue()
+    with open(tmp_path / 'email.jsonl') as f:
+        assert [json.loads(line)['to'] for line in f] == ['owner@example.com']
+    spend(10, '')
+    spend(5, '')
+    messages = [n.message for n in Notification.query.all()]
+    assert len(messages) == 1 and 'spent 55.00 today' in messages[0]
+
+    from app.utils import update_all_balances
+    update_all_balances(client.id)
+    assert bank.current_balance == 40
+    spend(1, '')
+    update_all_balances(client.id)
+    assert Notification.query.count() == 2
+
+    # Bulk updates and deletes bypass the flush hooks but still refresh daily_spending.
+    def spending():
+        return dict(db.session.query(DailySpending.category, DailySpending.amount).filter_by(client_id=client.id))
+    from app.bulk_writes import bulk_writes
+    JournalEntries.query.filter_by(category='Groceries').update({'description': 'Market'})
+    assert [(write.kind, write.columns) for write in bulk_writes(db.session)] == [('update', {'description'})]
+    JournalEntries.query.filter_by(category='Groceries').update({'category': 'Food'})
+    db.session.commit()
+    assert spending() == {'Food': 45, '': 16}
+    JournalEntries.query.filter_by(category='Food').delete()
+    db.session.commit()
+    assert spending() == {'': 16}
+
+
+def test_notification_inbox_is_per_user_incremental_and_deduplicated(authenticated_client):
+    """Test that the inbox only returns the user's new notifications and dedup keys suppress repeats."""
+    from app.notifications import notify
+    with authenticated_client.application.app_context():
+        user = User.query.filter_by(username='testuser').first()
+        other = User(username='other', role_id=user.role_id, client_id=user.client_id)
+        other.set_password('password')
+        db.session.add(other)
+        db.session.commit()
+        assert notify([user.id, other.id], 'Over budget', dedup_key='budget:1:2024-05') == 2
+        assert notify([user.id], 'Over budget', dedup_key='budget:1:2024-05') == 0
+        notify([other.id], 'Not yours')
+        db.session.commit()
+
+    data = authenticated_client.get('/notifications').get_json()
+    assert [item['message'] for item in data['items']] == ['Over budget'] and data['unread'] == 1
+    assert authenticated_client.get(f"/notifications?since={data['cursor']}").get_json()['items'] == []
+
+    with authenticated_client.application.app_context():
+        notify([User.query.filter_by(username='testuser').first().id], 'Low balance')
+        db.session.commit()
+    newer = authenticated_client.get(f"/notifications?since={data['cursor']}").get_json()
+    assert [item['message'] for item in newer['items']] == ['Low balance'] and newer['unread'] == 2
+
+    authenticated_client.post('/notifications/read_all')
+    assert authenticated_client.get('/notifications').get_json() == {'items': [], 'unread': 0, 'cursor': 0}
+
+
+def test_event_stream_publishes_balance_changes_after_commit(app):
+    """Test that balance changes reach event subscribers only once committed, and fan out through SQLite."""
+    from app import events
+    broker = events.get_broker()
+    client = Client.query.first()
+    bank = Account(name='Bank', type='Asset', opening_balance=0, client_id=client.id)
+    db.session.add(bank)
+    db.session.commit()
+    last_id = broker.latest_id()
+
+    bank.current_balance = 12.5
+    db.session.flush()
+    assert broker.listen(client.id, last_id, 0) == []
+    db.session.commit()
+    (event_id, event_type, data), = broker.listen(client.id, last_id, 0)
+    assert (event_type, data['accounts'][bank.id]['balance']) == ('balances', 12.5)
+    assert broker.listen(client.id + 1, last_id, 0) == []
+
+    chunks = events.stream(broker, client.id, last_id, duration=1)
+    assert next(chunks).startswith('retry:')
+    assert next(chunks).startswith(f'id: {event_id}\nevent: balances\n')
+
+
+def test_sqlite_event_fanout_is_shared_between_brokers(tmp_path):
+    """Test that an event published by one SQLite broker reaches another broker on the same file once."""
+    from app.events import SqliteEventBroker
+    writer, reader = SqliteEventBroker(str(tmp_path / 'events.db')), SqliteEventBroker(str(tmp_path / 'events.db'))
+    event_id = writer.publish(1, 'sync', {'stage': 'done', 'added': 3})
+    assert reader.listen(1, 0, 0) == [(event_id, 'sync', {'stage': 'done', 'added': 3})]
+    assert reader.listen(1, event_id, 0) == []
+
+
+def test_plaid_gateway_pages_transactions_and_rate_limits(app):
+    """Test that the gateway pages through /transactions/get in order and its token bucket throttles bursts."""
+    import asyncio
+    from datetime import date, timedelta
+    from app.plaid_gateway import PlaidGateway, TokenBucket
+    from benchmarks.fake_plaid import FakePlaid, FakePlaidServer
+
+    async def fetch_all(gateway):
+        pages = gateway.transactions_pages('access-token', date.today() - timedelta(days=800), date.today(),
+                                           page_size=100)
+        return [t async for _, page, _ in pages for t in page]
+
+    with FakePlaidServer(FakePlaid(transactions=1234)) as server:
+        gateway = PlaidGateway.from_config(dict(app.config, PLAID_ENV='local', PLAID_HOST=server.url))
+        transactions = asyncio.run(fetch_all(gateway))
+        gateway.close()
+    assert len({t['transaction_id'] for t in transactions}) == len(transactions) == 1234
+    assert [t['date'] for t in transactions] == sorted((t['date'] for t in transactions), reverse=True)
+    assert server.plaid.calls.count('/transactions/get') == 13
+
+    bucket = TokenBucket(rate=1000, burst=2)
+    assert [bucket.acquire() > 0 for _ in range(3)] == [False, False, True]
+
+
+def test_plaid_webhook_verification_key_is_cached(client, app):
+    """Test that webhook verification keys are fetched once and tampered webhooks are rejected."""
+    import json
+    from app.plaid_gateway import PlaidGateway
+    from benchmarks.fake_plaid import FakePlaidServer
+
+    with FakePlaidServer() as server:
+        app.plaid_client = PlaidGateway.from_config(dict(app.config, PLAID_ENV='local', PLAID_HOST=server.url))
+        for _ in range(3):
+            body = json.dumps({'webhook_type': 'ITEM', 'webhook_code': 'WEBHOOK_UPDATE_ACKNOWLEDGED'}).encode()
+            response = client.post('/plaid/api/plaid_webhook', data=body, content_type='application/json',
+                                   headers={'Plaid-Verification': server.plaid.sign_webhook(body)})
+            assert response.get_json() == {'status': 'received'}
+        response = client.post('/plaid/api/plaid_webhook', data=b'{}', content_type='application/json',
+                               headers={'Plaid-Verification': server.plaid.sign_webhook(b'{"tampered": 1}')})
+        assert response.status_code == 403
+        app.plaid_client.close()
+    assert server.plaid.calls.count('/webhook_verification_key/get') == 1
+
+
+def test_plaid_sync_recovers_from_mutation_during_pagination(client, app):
+    """Test that a sync interrupted by a mutation during pagination restarts and stores every transaction."""
+    from app.models import PlaidItem
+    from app.plaid_gateway import PlaidGateway
+    from benchmarks.fake_plaid import FakePlaid, FakePlaidServer
+
+    fake = FakePlaid(transactions=250, sync_interruptions=1)
+    with FakePlaidServer(fake) as server:
+        app.plaid_client = PlaidGateway.from_config(dict(app.config, PLAID_ENV='local', PLAID_HOST=server.url))
+        item = PlaidItem(client_id=Client.query.first().id, item_id=fake.get_item('access-1').item_id,
+                         access_token='access-1', institution_id='ins_fake', institution_name='Fake Bank')
+        db.session.add(item)
+        db.session.commit()
+
+        body, headers = fake.webhook_request(fake.transactions_webhook('access-1'))
+        assert client.post('/plaid/api/plaid_webhook', data=body, headers=headers).status_code == 200
+        fake.mutate('access-1', added=5)
+        body, headers = fake.webhook_request(fake.transactions_webhook('access-1'))
+        assert client.post('/plaid/api/plaid_webhook', data=body, headers=headers).status_code == 200
+        app.plaid_client.close()
+
+    assert fake.errors == {'TRANSACTIONS_SYNC_MUTATION_DURING_PAGINATION': 1}
+    assert Transaction.query.filter(Transaction.plaid_transaction_id.isnot(None)).count() == 255
+    assert PlaidItem.query.get(item.id).cursor.startswith('256:')
+
+
+def test_plaid_balance_refresh_batches_items_and_skips_fresh_ones(app):
+    """Test that balance refreshes make one call per item and skip items refreshed recently unless forced."""
+    from app.models import PlaidItem, PlaidAccount
+    from app.plaid_balances import refresh_client_balances
+    from app.plaid_gateway import PlaidGateway
+    from benchmarks.fake_plaid import FakePlaid, FakePlaidServer
+
+    fake = FakePlaid(accounts=2, transactions=0)
+    client = Client.query.first()
+    with FakePlaidServer(fake) as server:
+        app.plaid_client = PlaidGateway.from_config(dict(app.config, PLAID_ENV='local', PLAID_HOST=server.url))
+        local = {}
+        for token in ('access-a', 'access-b'):
+            fake_item = fake.get_item(token)
+            item = PlaidItem(client_id=client.id, item_id=fake_item.item_id, access_token=token,
+                             institution_id='ins_fake', institution_name=token)
+            db.session.add(item)
+            db.session.flush()
+            for plaid_account in fake_item.accounts:
+                account = Account(name=plaid_account['name'], type='Asset', opening_balance=0, client_id=client.id)
+                db.session.add(account)
+                db.session.flush()
+                db.session.add(PlaidAccount(plaid_item_id=item.id, account_id=plaid_account['account_id'],
+                                            name=plaid_account['name'], local_account_id=account.id))
+                local[account.id] = plaid_account['balances']['current']
+        db.session.commit()
+
+        assert refresh_client_balances(client.id) == 4
+        assert {a.id: a.current_balance for a in Account.query.filter(Account.id.in_(local))} == local
+        assert fake.calls.count('/accounts/balance/get') == 2
+
+        assert refresh_client_balances(client.id) == 0
+        assert refresh_client_balances(client.id, force=True) == 4
+        assert fake.calls.count('/accounts/balance/get') == 4
+        app.plaid_client.close()
+
+
+def test_plaid_backfill_streams_windows_and_resumes_after_interruption(app):
+    """Test that an interrupted backfill resumes from its unfinished windows without duplicating transactions."""
+    from datetime import date, timedelta
+    from app import plaid_backfill
+    from app.models import PlaidItem, PlaidBackfillWindow
+    from app.plaid_gateway import PlaidGateway
+    from benchmarks.fake_plaid import FakePlaid, FakePlaidServer
+
+    fake = FakePlaid(transactions=600, days=360)
+    with FakePlaidServer(fake) as server:
+        app.plaid_client = PlaidGateway.from_config(dict(app.config, PLAID_ENV='local', PLAID_HOST=server.url))
+        item = PlaidItem(client_id=Client.query.first().id, item_id=fake.get_item('access-1').item_id,
+                         access_token='access-1', institution_id='ins_fake', institution_name='Fake Bank')
+        db.session.add(item)
+        db.session.commit()
+        start, end = date.today() - timedelta(days=365), date.today()
+
+        def interrupt(fetched, total):
+            raise ConnectionError('worker restarted')
+        with pytest.raises(ConnectionError):
+            plaid_backfill.backfill(item, start, end, on_progress=interrupt)
+        assert 0 < Transaction.query.count() < 600
+        assert PlaidBackfillWindow.query.filter(PlaidBackfillWindow.completed_at.is_(None)).count() == 5
+
+        assert plaid_backfill.backfill(item, start, end) == 600
+        assert Transaction.query.count() == 600
+        calls = fake.calls.count('/transactions/get')
+        assert calls <= 5 + 5 + 1
+
+        # A finished range fetched again starts over and finds nothing new.
+        assert plaid_backfill.backfill(item, start, end) == 0
+        app.plaid_client.close()
+
+
+def test_static_urls_are_fingerprinted_and_responses_compressed(client, app):
+    """Test that fingerprinted static files are cached long-term and pages are gzipped on request."""
+    import gzip
+    from flask import jsonify, url_for
+
+    with app.test_request_context():
+        url = url_for('static', filename='style.css')
+    assert '?v=' in url
+    response = client.get(url)
+    assert {'public', 'max-age=31536000', 'immutable'} <= set(response.headers['Cache-Control'].split(', '))
+    assert 'max-age' not in client.get('/static/style.css').headers.get('Cache-Control', '')
+
+    page = client.get('/clients/', headers={'Accept-Encoding': 'gzip'})
+    assert page.headers['Content-Encoding'] == 'gzip'
+    assert b'</html>' in gzip.decompress(page.data)
+    assert 'Content-Encoding' not in client.get('/clients/').headers
+
+    with app.test_request_context():
+        assert jsonify(when=datetime(2024, 1, 2, 3, 4, 5)).get_json() == {'when': '2024-01-02T03:04:05'}
+
+
+def test_startup_defers_heavy_imports_and_the_scheduler(client, app):
+    """Test that creating the app imports neither the Plaid SDK nor pandas and does not start the scheduler."""
+    import os
+    import subprocess
+    import sys
+    from app import scheduler
+
+    code = ("import sys; from app import create_app; "
+            "create_app({'SQLALCHEMY_DATABASE_URI': 'sqlite://', 'JINJA_BYTECODE_CACHE_DIR': ''}); "
+            "print(sorted(m for m in ('plaid', 'pandas', 'numpy') if m in sys.modules))")
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    result = subprocess.run([sys.executable, '-c', code], cwd=root, capture_output=True, text=True)
+    assert result.stdout.strip().splitlines()[-1] == '[]', result.stderr
+
+    assert app.plaid_client._api is None
+    client.get('/login')
+    assert not scheduler.running
+
+
+def test_scheduler_lease_and_scheduled_runs_happen_once(app, monkeypatch):
+    """Test that the leader lease has one owner and a scheduled time runs once and is caught up once."""
+    from datetime import timedelta
+    from app import scheduler, scheduling, tasks
+    from app.models import ScheduledJobState
+
+    with app.app_context():
+        assert scheduling.acquire_lock('leader', 'host-a', 60)
+        assert not scheduling.acquire_lock('leader', 'host-b', 60)
+        assert scheduling.acquire_lock('leader', 'host-a', 60)
+        scheduling.release_lock('leader', 'host-a')
+        assert scheduling.acquire_lock('leader', 'host-b', 60)
+
+    runs = []
+    monkeypatch.setattr(tasks, 'check_budgets', lambda scheduled_for=None: runs.append(scheduled_for))
+    monkeypatch.setattr(scheduler, 'app', app, raising=False)
+    slot = datetime(2024, 3, 5, 3, 0)
+    assert scheduling.run_scheduled_job('check_budgets', slot)
+    assert not scheduling.run_scheduled_job('check_budgets', slot)
+    assert runs == [slot]
+
+    with app.app_context():
+        # check_budgets runs daily at 03:00; two days later only the latest missed run is caught up.
+        missed = dict(scheduling.missed_runs(app, now=slot + timedelta(days=2, hours=1)))
+        assert missed['check_budgets'] == slot + timedelta(days=2)
+        assert 'archive_audit_trail' not in missed
+        assert db.session.get(ScheduledJobState, 'check_budgets').last_error is None
@@ -35,6 +35,15 @@ echo "4. Running database migrations..."
 ./venv/bin/python3 -m flask db upgrade
 echo "Database migrations complete."
 
+# 5. Budget matches for entries added by migrations or written outside the app
+echo "5. Matching journal entries to budgets..."
+./venv/bin/python3 -m flask sync-budget-matches
+
+# 6. Daily spending totals the notification rules read, for the same entries
+echo "6. Rebuilding daily spending totals..."
+./venv/bin/python3 -m flask rebuild-daily-spending
+
 echo "--- Update Complete ---"
 
 systemctl restart logical-books
+systemctl restart logical-books-scheduler